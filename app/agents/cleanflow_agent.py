@@ -16,12 +16,30 @@ SYSTEM_PROMPT = """あなたはデータ前処理の専門家です。
       "order": 1,
       "name": "ステップ名",
       "description": "このステップの説明",
-      "code_snippet": "# Pandasコード\\ndf = df.dropna()"
+      "operation": {"op": "standardize", "columns": ["age", "income"]}
+    },
+    {
+      "order": 2,
+      "name": "ステップ名",
+      "description": "このステップの説明",
+      "code_snippet": "# Pandasコード\\ndf['ratio'] = df['a'] / df['b']"
     }
   ]
 }
 
+利用できる操作（operation）:
+- {"op": "drop_na", "columns": [...], "how": "any"}  欠損値を含む行を削除（columns は省略可）
+- {"op": "fill_na", "columns": [...], "strategy": "mean" | "median" | "mode" | "constant", "value": 0}  欠損値を補完
+- {"op": "standardize", "columns": [...]}  標準化
+- {"op": "label_encode", "columns": [...]}  ラベルエンコーディング
+- {"op": "one_hot", "columns": [...], "drop_first": false}  ワンホットエンコーディング
+- {"op": "clip_outliers", "columns": [...], "method": "iqr" | "zscore", "factor": 1.5}  外れ値を境界値に置き換え
+- {"op": "cast", "columns": [...], "dtype": "int" | "float" | "str" | "bool" | "category" | "datetime" | "numeric"}  型変換
+- {"op": "drop_columns", "columns": [...]}  カラムの削除
+
 注意事項:
+- 各ステップは operation と code_snippet のどちらか一方を指定すること
+- 上記の操作で実現できる処理は operation を使い、それ以外の処理だけ code_snippet を使うこと
 - code_snippetは実行可能なPythonコード(Pandas使用)であること
 - 入力データフレームは変数`df`として渡される
 - 処理後のデータフレームも`df`として返すこと
@@ -121,31 +139,29 @@ def _generate_dummy_plan(profile: dict, task_type: str, target_column: Optional[
             "order": step_order,
             "name": "欠損値の処理",
             "description": "欠損値を含む行を削除します",
-            "code_snippet": "# 欠損値を含む行を削除\ndf = df.dropna()"
+            "operation": {"op": "drop_na"}
         })
         step_order += 1
     
     # 数値列の標準化
     numeric_cols = profile.get("numeric_columns", [])
     if numeric_cols and task_type in ["classification", "regression"]:
-        cols_str = str(numeric_cols)
         steps.append({
             "order": step_order,
             "name": "数値列の標準化",
             "description": "数値列を標準化（平均0、標準偏差1）します",
-            "code_snippet": f"# 数値列の標準化\nfrom sklearn.preprocessing import StandardScaler\nnumeric_cols = {cols_str}\nscaler = StandardScaler()\ndf[numeric_cols] = scaler.fit_transform(df[numeric_cols])"
+            "operation": {"op": "standardize", "columns": list(numeric_cols)}
         })
         step_order += 1
     
     # カテゴリ列のエンコーディング
     categorical_cols = profile.get("categorical_columns", [])
     if categorical_cols:
-        cols_str = str(categorical_cols)
         steps.append({
             "order": step_order,
             "name": "カテゴリ変数のエンコーディング",
             "description": "カテゴリ変数をラベルエンコーディングします",
-            "code_snippet": f"# カテゴリ変数のラベルエンコーディング\nfrom sklearn.preprocessing import LabelEncoder\ncategorical_cols = {cols_str}\nfor col in categorical_cols:\n    le = LabelEncoder()\n    df[col] = le.fit_transform(df[col].astype(str))"
+            "operation": {"op": "label_encode", "columns": list(categorical_cols)}
         })
         step_order += 1
     
@@ -0,0 +1,67 @@
+"""ステップのコードのコンパイルキャッシュ
+
+ステップのコードはプロセスごとのLRUキャッシュ（コードのハッシュがキー）でコンパイル済みの
+コードオブジェクトを再利用する。ステップの実行（app/services/step_executor.py）と、
+キューに登録する前の構文の検査（app/services/execution_service.py）で同じキャッシュを使う。
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from types import CodeType
+from typing import Optional
+
+from app.core.config import settings
+
+
+class CodeCache:
+    """ステップのコンパイル済みコードのLRUキャッシュ（コードのSHA-256がキー）"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CodeType]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def compile(self, code: str) -> CodeType:
+        """コンパイル済みのコードを取得（なければコンパイルして登録。構文エラーは SyntaxError）"""
+        key = hashlib.sha256(code.encode("utf-8")).hexdigest()
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return compiled
+        compiled = compile(code, f"<step {key[:12]}>", "exec")
+        with self._lock:
+            self._counters["misses"] += 1
+            if self.max_entries > 0:
+                self._entries[key] = compiled
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._counters["evictions"] += 1
+        return compiled
+
+    def stats(self) -> dict:
+        """ヒット・ミス・追い出しの件数とエントリ数を取得"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({"entries": len(self._entries), "max_entries": self.max_entries})
+        return stats
+
+
+_code_cache: Optional[CodeCache] = None
+_code_cache_lock = threading.Lock()
+
+
+def get_code_cache() -> CodeCache:
+    """このプロセスの共有コードキャッシュを取得"""
+    global _code_cache
+    with _code_cache_lock:
+        if _code_cache is None:
+            _code_cache = CodeCache(settings.EXECUTION_CODE_CACHE_SIZE)
+        return _code_cache
+
+
+def compile_step(code: str) -> CodeType:
+    """ステップのコードをキャッシュ経由でコンパイル（構文エラーは SyntaxError）"""
+    return get_code_cache().compile(code)
@@ -16,11 +16,79 @@ class Settings(BaseSettings):
     # CORS設定
     CORS_ORIGINS: list[str] = ["*"]
     
+    # データ保存設定
+    DATA_DIR: str = "./data"  # アップロードされたデータセット等の保存先
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024  # アップロードを書き込む単位（バイト）
+    COLUMNAR_STORE_ENABLED: bool = True  # アップロード時にカラム単位のバイナリ形式へ変換するか
+    INGEST_CHUNK_SIZE: int = 100_000  # CSVを変換する際に1回に読み込む行数
+    INGEST_SCHEMA_SAMPLE_ROWS: int = 10_000  # スキーマ推定に使う先頭の行数
+    INGEST_CATEGORY_MAX_UNIQUE: int = 1000  # category として読み込む文字列カラムのユニーク数の上限
+    INGEST_CATEGORY_MAX_UNIQUE_RATE: float = 0.5  # 同ユニーク率の上限
+    INGEST_USE_PYARROW: bool = True  # pyarrow がインストールされていれば一括読み込みに使うか
+    
+    # 実行キュー設定
+    EXECUTION_WORKERS: int = 2  # アプリ内で起動する実行ワーカーの数（0で起動しない。python -m app.worker で別途起動可能）
+    EXECUTION_POLL_INTERVAL: float = 1.0  # pending の実行を確認する間隔（秒）
+    EXECUTION_HEARTBEAT_INTERVAL: float = 30.0  # 処理中の実行の生存を記録する間隔（秒）
+    EXECUTION_STALE_TIMEOUT: float = 300.0  # 生存の記録がこの秒数途絶えた running の実行を回収する（0で時間では回収しない）
+    EXECUTION_SWEEP_INTERVAL: float = 60.0  # ワーカーが回収する実行を確認する間隔（秒）
+    EXECUTION_MAX_ATTEMPTS: int = 2  # 回収した実行を pending に戻して処理し直す回数の上限（超えた場合は failed）
+    EXECUTION_STEP_EXECUTOR: str = "sandbox"  # ステップの実行バックエンド（sandbox, inprocess）
+    EXECUTION_SANDBOX_WORKERS: int = 2  # 事前に起動するステップ実行用のワーカープロセス数
+    EXECUTION_STEP_TIMEOUT: float = 600.0  # 1ステップの実行時間の上限（秒、0で無制限）
+    EXECUTION_STEP_CPU_TIME: int = 600  # 1ステップのCPU時間の上限（秒、0で無制限）
+    EXECUTION_STEP_MEMORY_LIMIT: int = 8 * 1024 * 1024 * 1024  # ワーカープロセスのメモリ上限（RLIMIT_AS による仮想アドレス空間の上限で RSS ではない、0で無制限）
+    EXECUTION_CODE_CACHE_SIZE: int = 1024  # プロセスごとに保持するステップのコンパイル済みコードの数（0で保持しない）
+    EXECUTION_STEP_CACHE_ENABLED: bool = True  # ステップ実行後のDataFrameを保存し、再実行時に再開するか
+    EXECUTION_STEP_CACHE_DIR: Optional[str] = None  # 保存先（Noneで DATA_DIR/step_cache）
+    EXECUTION_STEP_CACHE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024  # 保存先の合計サイズの上限（0で無制限）
+    EXECUTION_PARALLEL_STEPS: int = 4  # 読み書きするカラムが重ならない連続したステップを同時に実行する数（1で順に実行）
+    EXECUTION_STEP_LOG_FLUSH_STEPS: int = 10  # ステップログをまとめてコミットするステップ数（失敗時・終了時は常にコミット）
+    EXECUTION_STEP_LOG_FLUSH_INTERVAL: float = 5.0  # 前回のコミットからこの秒数が経過したステップでもコミットする
+    EXECUTION_STREAM_MIN_BYTES: int = 512 * 1024 * 1024  # mode=auto でチャンク実行に切り替える入力ファイルのサイズ
+    EXECUTION_STREAM_CHUNK_SIZE: int = 100_000  # チャンク実行で1回に処理する行数
+    EXECUTION_STREAM_MAX_VOCABULARY: int = 1_000_000  # チャンク実行の LabelEncoder が保持するカラムごとのユニーク値の上限
+    EXECUTION_OUTPUT_ENABLED: bool = True  # 前処理後のデータを保存し、GET /executions/{id}/output でダウンロードできるようにするか
+    EXECUTION_OUTPUT_FORMAT: str = "csv"  # 保存する形式（csv, parquet。parquet は pyarrow が必要）
+    EXECUTION_OUTPUT_CHUNK_SIZE: int = 1024 * 1024  # ダウンロード時に1回に送るバイト数
+    EXECUTION_OUTPUT_GZIP_LEVEL: int = 6  # gzip=true でダウンロードする場合の圧縮レベル
+    EXECUTION_MAX_RUNTIME: float = 0.0  # 1回の実行の実行時間の上限（秒、0で無制限。プランの max_runtime が優先）
+    EXECUTION_CANCEL_CHECK_INTERVAL: float = 1.0  # 実行中に取り消し要求を確認する間隔（秒）
+    EXECUTION_EVENTS_ENABLED: bool = True  # 実行の進捗イベントを保存し、GET /executions/{id}/events で配信するか
+    EXECUTION_EVENTS_POLL_INTERVAL: float = 0.2  # 配信中に新しいイベントを確認する間隔（秒）
+    EXECUTION_EVENTS_HEARTBEAT_INTERVAL: float = 15.0  # 新しいイベントがない間に接続維持用のコメントを送る間隔（秒）
+    EXECUTION_PREVIEW_ROWS: int = 1000  # プレビュー（preview=true）で実行する既定の行数
+    EXECUTION_PREVIEW_MAX_ROWS: int = 10_000  # プレビューで指定できる行数の上限
+    EXECUTION_PREVIEW_HEAD_ROWS: int = 10  # プレビューのレスポンスに含める実行結果の先頭の行数
+    EXECUTION_PREVIEW_SANDBOX_WORKERS: int = 1  # 事前に起動するプレビュー用のワーカープロセス数
+    EXECUTION_PREVIEW_STEP_TIMEOUT: float = 10.0  # プレビューの1ステップの実行時間の上限（秒、0で無制限）
+    EXECUTION_PREVIEW_STEP_CPU_TIME: int = 10  # プレビューの1ステップのCPU時間の上限（秒、0で無制限）
+    EXECUTION_BATCH_MAX_INPUTS: int = 1000  # 一括実行で一度に指定できる入力の数
+    EXECUTION_BATCH_INPUT_DIR: Optional[str] = None  # 一括実行でファイルパスを指定できるディレクトリ（Noneで無効）
+    EXECUTION_BATCH_MAX_CONCURRENCY: int = 2  # 1つの一括実行で同時に処理する子の実行の数（0で無制限）
+    
     # LLM設定
     ANTHROPIC_API_KEY: Optional[str] = None
     LLM_MODEL: str = "claude-sonnet-4-20250514"
     LLM_MAX_TOKENS: int = 4096
     
+    # プロファイリング設定
+    PROFILING_CHUNK_SIZE: int = 100_000  # ストリーミングモードで1回に読む行数
+    PROFILING_QUANTILE_SKETCH_K: int = 200  # KLLスケッチの精度パラメータ
+    PROFILING_HLL_PRECISION: int = 12  # HyperLogLogのレジスタ数（2^p）
+    PROFILING_SAMPLE_SIZE: int = 10_000  # sampleモードのサンプルサイズ
+    PROFILING_SAMPLE_SEED: Optional[int] = 42  # サンプリングの乱数シード（Noneで毎回変化）
+    PROFILING_CONFIDENCE_LEVEL: float = 0.95  # sampleモードの信頼水準
+    PROFILING_PARALLEL_WORKERS: int = 0  # カラム並列プロファイリングのプロセス数（0以下で無効）
+    PROFILING_PARALLEL_SHARDS: int = 0  # カラムを分割するシャード数（0でプロセス数の4倍）
+    PROFILING_PARALLEL_MIN_COLUMNS: int = 200  # 並列化するカラム数の下限
+    
+    # プロファイルキャッシュ設定
+    PROFILE_CACHE_ENABLED: bool = True
+    PROFILE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # メモリ層の上限（JSONサイズ換算）
+    PROFILE_CACHE_DB_PATH: Optional[str] = None  # ディスク層のSQLiteファイル（Noneで無効）
+    PROFILE_CACHE_DISK_MAX_BYTES: int = 1024 * 1024 * 1024  # ディスク層の上限（0で無制限）
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -0,0 +1,52 @@
+"""既存データベースのスキーマ更新
+
+テーブルは Base.metadata.create_all で作成するが、create_all は既存のテーブルにカラムを追加しない。
+モデルに追加した NULL 可のカラム（datasets.content_hash, datasets.store_path など）が既存の
+テーブルにない場合は ALTER TABLE ... ADD COLUMN で追加する。
+
+カラムの削除・型や制約の変更は行わない。SQLite では既存のカラムの NOT NULL 制約を外せないため、
+plan_steps.code_snippet が NOT NULL のまま作成されたデータベースで構造化された操作のステップを
+保存するには、データベースを作成し直す必要がある。
+"""
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from app.db.base import Base
+
+logger = logging.getLogger(__name__)
+
+
+def add_missing_columns(engine: Engine) -> list[str]:
+    """モデルにあって既存のテーブルにないカラムを追加し、追加したカラム（テーブル.カラム）を返す"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    raise RuntimeError(
+                        f"NOT NULL のカラム {table.name}.{column.name} は自動で追加できません。データベースを作成し直してください"
+                    )
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                added.append(f"{table.name}.{column.name}")
+                for index in table.indexes:
+                    if column in index.columns.values():
+                        index.create(bind=conn, checkfirst=True)
+    if added:
+        logger.info("既存のテーブルにカラムを追加しました: %s", ", ".join(added))
+    return added
+
+
+def upgrade_schema(engine: Engine) -> None:
+    """テーブルを作成し、既存のテーブルに不足しているカラムを追加する"""
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
@@ -1,12 +1,15 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
 from app.core.config import settings
-from app.db.base import Base
+from app.db.migrations import upgrade_schema
 from app.db.session import engine
 from app.routers import auth, datasets, plans, executions
 from app.routers import profiling
+from app.services import execution_queue, step_executor
 from app.exceptions import (
     ResourceNotFoundException,
     UnauthorizedAccessException,
@@ -14,14 +17,25 @@ from app.exceptions import (
     DuplicateResourceException,
 )
 
-# データベーステーブルを作成
-Base.metadata.create_all(bind=engine)
+# データベーステーブルを作成（既存のテーブルには不足しているカラムを追加する）
+upgrade_schema(engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動時に実行キューのワーカーとプレビュー用のワーカープロセスを起動し、終了時に停止する"""
+    execution_queue.start_workers()
+    step_executor.start_pool("preview")
+    yield
+    execution_queue.shutdown_workers()
+
 
 # FastAPIアプリを作成
 app = FastAPI(
     title="CleanFlow Agent API",
     description="CSVデータの前処理を自動化するAPI",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS設定
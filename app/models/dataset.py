@@ -17,8 +17,11 @@ class Dataset(Base):
     user_id = Column(String, ForeignKey("users.id"), nullable=False, index=True)
     name = Column(String(255), nullable=False)
     description = Column(Text, nullable=True)  # 任意、NULL可
-    # 将来の拡張用（ファイルアップロード機能など）
+    # アップロードされたCSVファイルの保存先と内容ハッシュ（SHA-256）
     file_path = Column(String(500), nullable=True)
+    content_hash = Column(String(64), nullable=True)
+    # カラム単位のバイナリ形式に変換したデータの保存先（app/services/columnar_store.py）
+    store_path = Column(String(500), nullable=True)
     rows = Column(Integer, nullable=True)
     columns = Column(Integer, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
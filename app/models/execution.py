@@ -1,5 +1,5 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, Text, Float, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, Integer, BigInteger, ForeignKey, Text, Float, DateTime
+from sqlalchemy.orm import backref, relationship
 from sqlalchemy.sql import func
 import uuid
 
@@ -15,17 +15,36 @@ class Execution(Base):
     
     id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
     plan_id = Column(String, ForeignKey("plans.id"), nullable=False, index=True)
-    status = Column(String(50), nullable=False)  # pending, running, completed, failed
+    status = Column(String(50), nullable=False)  # pending, running, completed, failed, cancelled
     before_summary_json = Column(Text, nullable=True)
     after_summary_json = Column(Text, nullable=True)
     error_message = Column(Text, nullable=True)
     execution_time = Column(Float, nullable=True)
+    # 実行キューの入力（データセットID、または保存したCSVデータのパス。どちらもNULLならサンプルデータ）
+    dataset_id = Column(String, ForeignKey("datasets.id"), nullable=True)
+    input_path = Column(String(500), nullable=True)
+    # 一括実行で指定されたサーバー上のCSVファイル（input_path と異なり実行後も削除しない）
+    source_path = Column(String(500), nullable=True)
+    # 一括実行の親の実行履歴（子の実行はそれぞれ1つの入力を処理する）
+    parent_id = Column(String, ForeignKey("executions.id"), nullable=True, index=True)
+    # 実行モード（登録時は auto / memory / stream、処理開始後は実際に使ったモード memory / stream）
+    mode = Column(String(20), nullable=True)
+    # チャンク実行の出力（CSVファイルのパス）
+    output_path = Column(String(500), nullable=True)
+    # 実行を取得したワーカー（app/services/execution_queue.py）と、取得した回数・最後に生存を記録した日時
+    worker_id = Column(String(255), nullable=True)
+    attempts = Column(Integer, nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    # 取り消しが要求された日時（app/services/execution_cancellation.py）
+    cancel_requested_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=True)
     completed_at = Column(DateTime(timezone=True), nullable=True)
     
     # リレーションシップ
     plan = relationship("Plan", backref="executions")
     step_logs = relationship("ExecutionStepLog", backref="execution", cascade="all, delete-orphan", order_by="ExecutionStepLog.step_order")
+    children = relationship("Execution", backref=backref("parent", remote_side=[id]), order_by="Execution.created_at")
 
 
 class ExecutionStepLog(Base):
@@ -39,8 +58,17 @@ class ExecutionStepLog(Base):
     execution_id = Column(String, ForeignKey("executions.id"), nullable=False, index=True)
     step_order = Column(Integer, nullable=False)
     step_name = Column(String(255), nullable=False)
-    status = Column(String(50), nullable=False)  # success, failed
+    status = Column(String(50), nullable=False)  # success, failed, cached（中間結果キャッシュから再開）, cancelled（中断）
     execution_time = Column(Float, nullable=True)
     error_message = Column(Text, nullable=True)
+    # ステップのリソース使用量（app/services/step_executor.py で計測。計測できない場合は NULL）
+    cpu_time = Column(Float, nullable=True)  # CPU時間（秒）
+    peak_memory_bytes = Column(BigInteger, nullable=True)  # 実行中に増えたメモリ（RSS）のピーク
+    memory_before_bytes = Column(BigInteger, nullable=True)  # 実行前のDataFrameのメモリ使用量
+    memory_after_bytes = Column(BigInteger, nullable=True)  # 実行後のDataFrameのメモリ使用量
+    rows_before = Column(Integer, nullable=True)
+    rows_after = Column(Integer, nullable=True)
+    columns_before = Column(Integer, nullable=True)
+    columns_after = Column(Integer, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
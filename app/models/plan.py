@@ -1,9 +1,12 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, Text, DateTime
+from sqlalchemy import Column, String, Integer, Float, ForeignKey, Text, DateTime
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from typing import Optional
+import json
 import uuid
 
 from app.db.base import Base
+from app.schemas.plan_operation import StepSource
 
 
 class Plan(Base):
@@ -19,6 +22,8 @@ class Plan(Base):
     name = Column(String(255), nullable=True)
     task_type = Column(String(50), nullable=False)  # classification, regression, clustering
     target_column = Column(String(255), nullable=True)
+    # 1回の実行の実行時間の上限（秒。NULLの場合は EXECUTION_MAX_RUNTIME）
+    max_runtime = Column(Float, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
     
@@ -40,6 +45,22 @@ class PlanStep(Base):
     order = Column(Integer, nullable=False)
     name = Column(String(255), nullable=False)
     description = Column(Text, nullable=True)
-    code_snippet = Column(Text, nullable=False)
+    # コードスニペット、または構造化された操作（app/schemas/plan_operation.py）のどちらかを指定する。
+    # 内容はキューに登録する前に検査する（app/services/execution_service.py の _get_executable_plan）
+    code_snippet = Column(Text, nullable=True)
+    operation_json = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
-
+    
+    @property
+    def operation(self) -> Optional[dict]:
+        """構造化された操作（コードスニペットのステップは None）"""
+        return json.loads(self.operation_json) if self.operation_json else None
+    
+    @operation.setter
+    def operation(self, operation: Optional[dict]) -> None:
+        self.operation_json = json.dumps(operation, ensure_ascii=False) if operation is not None else None
+    
+    @property
+    def source(self) -> Optional[StepSource]:
+        """ステップの実行内容（操作があれば操作、なければコードスニペット）"""
+        return self.operation or self.code_snippet
@@ -35,6 +35,12 @@ class DatasetRepository:
         self.db.refresh(dataset)
         return dataset
     
+    def update(self, dataset: Dataset) -> Dataset:
+        """データセットを更新"""
+        self.db.commit()
+        self.db.refresh(dataset)
+        return dataset
+    
     def delete(self, dataset: Dataset) -> None:
         """データセットを削除"""
         self.db.delete(dataset)
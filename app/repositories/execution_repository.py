@@ -1,5 +1,7 @@
 """実行リポジトリ"""
-from sqlalchemy.orm import Session
+from datetime import datetime
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.orm import Session, aliased
 from typing import List, Optional
 
 from app.models.execution import Execution, ExecutionStepLog
@@ -16,11 +18,141 @@ class ExecutionRepository:
         return self.db.query(Execution).filter(Execution.id == execution_id).first()
     
     def find_by_plan_id(self, plan_id: str) -> List[Execution]:
-        """プランIDで実行履歴一覧を取得（作成日時降順）"""
+        """プランIDで実行履歴一覧を取得（作成日時降順。一括実行の子は親の実行履歴から参照する）"""
         return self.db.query(Execution).filter(
-            Execution.plan_id == plan_id
+            Execution.plan_id == plan_id,
+            Execution.parent_id.is_(None)
         ).order_by(Execution.created_at.desc()).all()
     
+    def count_children_by_status(self, parent_id: str) -> dict[str, int]:
+        """一括実行の子の実行履歴の件数をステータスごとに取得"""
+        rows = self.db.query(Execution.status, func.count(Execution.id)).filter(
+            Execution.parent_id == parent_id
+        ).group_by(Execution.status).all()
+        return {status: count for status, count in rows}
+    
+    def claim_next_pending(self, worker_id: str, batch_concurrency: int = 0) -> Optional[Execution]:
+        """最も古い pending の実行を running にして取得（なければ None）
+        
+        一括実行の子より通常の実行を優先する（大きな一括実行の後に登録された実行も待たせない）。
+        batch_concurrency が正の場合、処理中の子がその数に達している一括実行の子は取得しない。
+        上限は取得時点の件数で判定するため、複数のワーカーが同時に取得すると一時的に超えることがある。
+        
+        status が pending の場合だけ更新する条件付きUPDATEで取得するため、
+        複数のワーカー（別プロセスを含む）が同じ実行を取得することはない。
+        """
+        query = self.db.query(Execution.id).filter(Execution.status == "pending")
+        if batch_concurrency > 0:
+            sibling = aliased(Execution)
+            running_siblings = (
+                select(func.count(sibling.id))
+                .where(sibling.parent_id == Execution.parent_id, sibling.status == "running")
+                .correlate(Execution)
+                .scalar_subquery()
+            )
+            query = query.filter(or_(Execution.parent_id.is_(None), running_siblings < batch_concurrency))
+        query = query.order_by(Execution.parent_id.isnot(None), Execution.created_at, Execution.id)
+        while True:
+            candidate = query.first()
+            if candidate is None:
+                return None
+            result = self.db.execute(
+                update(Execution)
+                .where(Execution.id == candidate.id, Execution.status == "pending")
+                .values(
+                    status="running",
+                    worker_id=worker_id,
+                    started_at=datetime.utcnow(),
+                    heartbeat_at=datetime.utcnow(),
+                    attempts=func.coalesce(Execution.attempts, 0) + 1,
+                )
+            )
+            self.db.commit()
+            if result.rowcount == 1:
+                return self.find_by_id(candidate.id)
+    
+    def touch_heartbeat(self, execution_id: str, worker_id: str) -> bool:
+        """処理中の実行の生存を記録（ワーカーが回収されていた場合は False）"""
+        result = self.db.execute(
+            update(Execution)
+            .where(Execution.id == execution_id, Execution.status == "running", Execution.worker_id == worker_id)
+            .values(heartbeat_at=datetime.utcnow())
+        )
+        self.db.commit()
+        return result.rowcount == 1
+    
+    def find_running(self) -> List[Execution]:
+        """ワーカーが処理中（running）の実行履歴を取得（一括実行の親を除く）"""
+        return self.db.query(Execution).filter(
+            Execution.status == "running",
+            Execution.worker_id.isnot(None)
+        ).all()
+    
+    def requeue_claim(self, execution_id: str, worker_id: str) -> bool:
+        """停止したワーカーが取得していた実行を pending に戻す（途中までのステップログは削除する）
+        
+        status と worker_id が変わっていない場合だけ更新する条件付きUPDATEで行う。
+        """
+        result = self.db.execute(
+            update(Execution)
+            .where(Execution.id == execution_id, Execution.status == "running", Execution.worker_id == worker_id)
+            .values(
+                status="pending", worker_id=None, started_at=None, heartbeat_at=None,
+                before_summary_json=None, after_summary_json=None,
+            )
+        )
+        if result.rowcount == 1:
+            self.db.query(ExecutionStepLog).filter(
+                ExecutionStepLog.execution_id == execution_id
+            ).delete(synchronize_session=False)
+        self.db.commit()
+        return result.rowcount == 1
+    
+    def finish_claim(self, execution_id: str, worker_id: str, status: str, message: str) -> bool:
+        """停止したワーカーが取得していた実行を終了（failed / cancelled）にする（requeue_claim と同じ条件付きUPDATE）"""
+        result = self.db.execute(
+            update(Execution)
+            .where(Execution.id == execution_id, Execution.status == "running", Execution.worker_id == worker_id)
+            .values(status=status, error_message=message, completed_at=datetime.utcnow())
+        )
+        self.db.commit()
+        return result.rowcount == 1
+    
+    def cancel_pending(self, execution_id: str, message: str) -> bool:
+        """pending の実行を cancelled にする（ワーカーが先に取得していた場合は False）
+        
+        claim_next_pending と同じく status が pending の場合だけ更新する条件付きUPDATEで行う。
+        """
+        now = datetime.utcnow()
+        result = self.db.execute(
+            update(Execution)
+            .where(Execution.id == execution_id, Execution.status == "pending")
+            .values(status="cancelled", cancel_requested_at=now, completed_at=now, error_message=message)
+        )
+        self.db.commit()
+        return result.rowcount == 1
+    
+    def request_cancel(self, execution_id: str) -> bool:
+        """処理中の実行の取り消しを要求（ワーカーが cancel_requested_at を確認して中断する）"""
+        result = self.db.execute(
+            update(Execution)
+            .where(
+                Execution.id == execution_id,
+                Execution.status.in_(("pending", "running")),
+                Execution.cancel_requested_at.is_(None),
+            )
+            .values(cancel_requested_at=datetime.utcnow())
+        )
+        self.db.commit()
+        return result.rowcount == 1
+    
+    def is_cancel_requested(self, execution_id: str) -> bool:
+        """実行の取り消しが要求されているか"""
+        requested_at = self.db.query(Execution.cancel_requested_at).filter(
+            Execution.id == execution_id
+        ).scalar()
+        return requested_at is not None
+    
     def create(self, execution: Execution) -> Execution:
         """実行履歴を作成"""
         self.db.add(execution)
@@ -28,12 +160,28 @@ class ExecutionRepository:
         self.db.refresh(execution)
         return execution
     
+    def create_batch(self, parent: Execution, children: List[Execution]) -> Execution:
+        """一括実行の親と子の実行履歴を1つのトランザクションで作成"""
+        self.db.add(parent)
+        self.db.add_all(children)
+        self.db.commit()
+        self.db.refresh(parent)
+        return parent
+    
     def update(self, execution: Execution) -> Execution:
         """実行履歴を更新"""
         self.db.commit()
         self.db.refresh(execution)
         return execution
     
+    def add_step_logs(self, step_logs: List[ExecutionStepLog]) -> None:
+        """ステップログをまとめて追加
+        
+        セッション内の実行履歴の変更と同じトランザクションでコミットする（再読み込みはしない）。
+        """
+        self.db.add_all(step_logs)
+        self.db.commit()
+    
     def add_step_log(self, step_log: ExecutionStepLog) -> ExecutionStepLog:
         """ステップログを追加"""
         self.db.add(step_log)
@@ -1,11 +1,15 @@
 """データセットルーター"""
-from fastapi import APIRouter, Depends, status
+import uuid
+
+from fastapi import APIRouter, Depends, Request, status
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from app.db.session import get_db
 from app.models.user import User
 from app.dependencies.auth import get_current_user
-from app.services.dataset_service import get_user_datasets, create_dataset
+from app.services.dataset_service import get_user_datasets, create_dataset, upload_dataset, dataset_file_path
+from app.services.upload_receiver import receive_file
 from app.schemas.dataset import DatasetCreate, DatasetSummary
 from app.schemas.responses import ApiResponse
 
@@ -49,3 +53,59 @@ def create_dataset_endpoint(
         data=dataset_summary.model_dump(),
         message="Dataset created successfully"
     ).model_dump()
+
+
+# ファイルはリクエストボディから直接保存するため、OpenAPI のリクエストボディは明示する
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "name": {"type": "string"},
+                        "description": {"type": "string"},
+                    },
+                }
+            }
+        },
+    }
+}
+
+
+@router.post(
+    "/upload", response_model=dict, status_code=status.HTTP_201_CREATED, openapi_extra=UPLOAD_REQUEST_BODY
+)
+async def upload_dataset_endpoint(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """CSVファイルをアップロードしてデータセットを作成
+    
+    multipart/form-data のファイル（file）をチャンク単位で受信しながらディスクに保存します
+    （一時ファイルを経由しないため、書き込みは1回だけです）。name と description は任意です。
+    作成したデータセットIDはプロファイリングやプラン実行に指定できます。
+    """
+    dataset_id = str(uuid.uuid4())
+    upload = await receive_file(request, dataset_file_path(dataset_id))
+    new_dataset = await run_in_threadpool(
+        upload_dataset, db, current_user.id, dataset_id, upload,
+        name=upload.fields.get("name"), description=upload.fields.get("description")
+    )
+    dataset_summary = DatasetSummary(
+        dataset_id=new_dataset.id,
+        name=new_dataset.name,
+        description=new_dataset.description,
+        has_file=True,
+        rows=new_dataset.rows,
+        columns=new_dataset.columns,
+        created_at=new_dataset.created_at
+    )
+    return ApiResponse.success(
+        data=dataset_summary.model_dump(),
+        message="Dataset uploaded successfully"
+    ).model_dump()
@@ -1,17 +1,41 @@
 """実行ルーター"""
 import json
-from fastapi import APIRouter, Depends, status
+import os
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from app.db.session import get_db
 from app.models.user import User
 from app.dependencies.auth import get_current_user
-from app.services.execution_service import execute_plan, get_execution, get_plan_executions
+from app.services.execution_service import (
+    cancel_execution,
+    enqueue_batch_execution,
+    enqueue_execution,
+    get_batch_progress,
+    get_execution,
+    get_plan_executions,
+    preview_plan,
+)
+from app.services.execution_queue import notify_workers
+from app.services.execution_events import open_event_stream
+from app.services.execution_output import (
+    MEDIA_TYPES,
+    RangeNotSatisfiable,
+    get_output_file,
+    iter_file,
+    iter_gzip,
+    parse_range,
+)
 from app.schemas.execution import (
+    BatchExecuteRequest,
+    BatchProgress,
     ExecutionResponse,
     ExecutionSummary,
     ExecutionStepLogResponse,
     ExecuteRequest,
+    PlanPreviewResponse,
 )
 from app.schemas.responses import ApiResponse
 
@@ -31,13 +55,23 @@ def _execution_to_response(execution) -> ExecutionResponse:
         after_data = json.loads(execution.after_summary_json)
         after_summary = ExecutionSummary(**after_data)
     
+    batch = get_batch_progress(execution)
+    
     step_logs = [
         ExecutionStepLogResponse(
             order=log.step_order,
             name=log.step_name,
             status=log.status,
             execution_time=log.execution_time,
-            error_message=log.error_message
+            error_message=log.error_message,
+            cpu_time=log.cpu_time,
+            peak_memory_bytes=log.peak_memory_bytes,
+            memory_before_bytes=log.memory_before_bytes,
+            memory_after_bytes=log.memory_after_bytes,
+            rows_before=log.rows_before,
+            rows_after=log.rows_after,
+            columns_before=log.columns_before,
+            columns_after=log.columns_after
         )
         for log in execution.step_logs
     ]
@@ -51,29 +85,77 @@ def _execution_to_response(execution) -> ExecutionResponse:
         step_logs=step_logs,
         execution_time=execution.execution_time,
         error_message=execution.error_message,
+        total_steps=len(execution.plan.steps),
+        mode=execution.mode,
+        parent_id=execution.parent_id,
+        batch=BatchProgress(**batch) if batch else None,
+        cancel_requested_at=execution.cancel_requested_at,
         created_at=execution.created_at,
+        started_at=execution.started_at,
         completed_at=execution.completed_at
     )
 
 
-@router.post("/{plan_id}/execute", response_model=dict, status_code=status.HTTP_201_CREATED)
+@router.post("/{plan_id}/execute", response_model=dict, status_code=status.HTTP_202_ACCEPTED)
 def execute_plan_endpoint(
     plan_id: str,
+    response: Response,
     request: ExecuteRequest = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """プランを実行
+    """プランの実行をキューに登録
     
-    指定されたプランを実行し、実行履歴を返します。
-    オプションでCSVデータを渡すことができます。
+    実行履歴（status: pending）をすぐに返し、処理はワーカーが行います。
+    進捗と結果は GET /executions/{execution_id} で確認してください。
+    オプションでCSVデータまたはアップロード済みデータセットのIDを渡すことができます。
+    mode=stream の場合は入力をチャンク単位で処理します（すべてのステップが対応している必要があります）。
+    
+    preview=true の場合は入力の先頭（preview_sample=random の場合はランダムに選んだ）preview_rows 行
+    だけで同期的に実行し、ステップごとの行数・カラム数の変化、エラー、実行結果の先頭の行を
+    200 で返します（実行履歴は保存しません）。
     """
     csv_data = request.csv_data if request else None
-    execution = execute_plan(db, plan_id, current_user.id, csv_data)
+    dataset_id = request.dataset_id if request else None
+    mode = request.mode if request else "auto"
+    if request and request.preview:
+        preview = preview_plan(
+            db, plan_id, current_user.id, csv_data, dataset_id,
+            request.preview_rows, request.preview_sample, request.preview_seed
+        )
+        response.status_code = status.HTTP_200_OK
+        return ApiResponse.success(
+            data=PlanPreviewResponse(**preview).model_dump(),
+            message="Plan preview completed"
+        ).model_dump()
+    execution = enqueue_execution(db, plan_id, current_user.id, csv_data, dataset_id, mode)
+    notify_workers()
+    return ApiResponse.success(
+        data=_execution_to_response(execution).model_dump(),
+        message="Plan execution queued"
+    ).model_dump()
+
+
+@router.post("/{plan_id}/execute/batch", response_model=dict, status_code=status.HTTP_202_ACCEPTED)
+def execute_plan_batch_endpoint(
+    plan_id: str,
+    request: BatchExecuteRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """1つのプランを複数の入力に対して実行するようキューに登録
+    
+    親の実行履歴を返し、入力ごとの子の実行はワーカーが並列に処理します。
+    進捗・スループット・入力ごとの結果は GET /executions/{execution_id}（親のID）の batch で確認してください。
+    """
+    execution = enqueue_batch_execution(
+        db, plan_id, current_user.id, request.dataset_ids, request.file_paths, request.mode
+    )
+    notify_workers()
     response = _execution_to_response(execution)
     return ApiResponse.success(
         data=response.model_dump(),
-        message="Plan executed successfully" if execution.status == "completed" else "Plan execution failed"
+        message="Batch execution queued"
     ).model_dump()
 
 
@@ -109,3 +191,90 @@ def get_execution_detail(
     response = _execution_to_response(execution)
     return ApiResponse.success(data=response.model_dump()).model_dump()
 
+
+@execution_detail_router.post("/{execution_id}/cancel", response_model=dict, status_code=status.HTTP_202_ACCEPTED)
+def cancel_execution_endpoint(
+    execution_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """実行を取り消す
+    
+    pending の実行はすぐに cancelled になります。running の実行はワーカーが次の確認
+    （EXECUTION_CANCEL_CHECK_INTERVAL 秒以内）で中断し、cancelled になります（それまでのステップログは残ります）。
+    一括実行の親を指定した場合は、すべての子の実行を取り消します。
+    """
+    execution = cancel_execution(db, execution_id, current_user.id)
+    return ApiResponse.success(
+        data=_execution_to_response(execution).model_dump(),
+        message="Execution cancellation requested"
+    ).model_dump()
+
+
+@execution_detail_router.get("/{execution_id}/output")
+def download_execution_output(
+    execution_id: str,
+    gzip: bool = False,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """前処理後のデータをダウンロード
+    
+    ファイルをチャンク単位で返します。gzip=true の場合は gzip 形式で圧縮して返します。
+    gzip を指定しない場合は Range ヘッダによる部分取得（単一の範囲）に対応します。
+    """
+    path, fmt = get_output_file(db, execution_id, current_user.id)
+    filename = f"execution-{execution_id}.{fmt}"
+    if gzip:
+        return StreamingResponse(
+            iter_gzip(path),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.gz"'}
+        )
+    
+    size = os.path.getsize(path)
+    try:
+        byte_range = parse_range(range_header, size)
+    except RangeNotSatisfiable:
+        return Response(
+            status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    start, end = byte_range or (0, size - 1)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start + 1),
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(
+        iter_file(path, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        media_type=MEDIA_TYPES[fmt],
+        headers=headers
+    )
+
+
+@execution_detail_router.get("/{execution_id}/events")
+def stream_execution_events(
+    execution_id: str,
+    last_event_id: int = Header(0, alias="Last-Event-ID"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """実行の進捗を Server-Sent Events で配信
+    
+    ステップの開始・終了（実行時間・CPU時間・メモリ使用量・行数）、チャンク実行の進捗、実行の終了を
+    発生順に送り、finished のイベントを送ると接続を閉じます。再接続時は Last-Event-ID ヘッダで
+    受け取り済みのイベントを省略できます。
+    """
+    events = open_event_stream(db, execution_id, current_user.id, last_event_id)
+    # 配信中にデータベースの接続を保持しないよう、レスポンスを返す前にセッションを閉じる
+    db.close()
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
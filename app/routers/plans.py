@@ -37,6 +37,7 @@ def create_plan_endpoint(
         name=new_plan.name,
         dataset_id=new_plan.dataset_id,
         task_type=new_plan.task_type,
+        max_runtime=new_plan.max_runtime,
         created_at=new_plan.created_at
     )
     return ApiResponse.success(
@@ -1,13 +1,16 @@
 """プロファイリングルーター"""
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, File, UploadFile
 from sqlalchemy.orm import Session
 
 from app.db.session import get_db
 from app.models.user import User
 from app.dependencies.auth import get_current_user
-from app.services.profiling_service import profile_csv_data, detect_data_quality_issues
+from app.services.profiling_service import profile_csv_data, profile_csv_file, detect_data_quality_issues
+from app.services.dataset_service import get_dataset_with_file, get_dataset_schema, append_dataset_rows
+from app.services.profile_cache import get_profile_cache
 from app.schemas.profiling import ProfileRequest, DatasetProfile, DataQualityIssue, ColumnProfile
 from app.schemas.responses import ApiResponse
+from app.exceptions import ValidationException
 
 router = APIRouter(prefix="/profiling", tags=["profiling"])
 
@@ -20,12 +23,44 @@ def analyze_data(
 ):
     """CSVデータをプロファイリング
     
-    CSVデータを分析し、統計情報と品質問題を返します。
+    CSVデータ（またはアップロード済みデータセット）を分析し、統計情報と品質問題を返します。
+    mode=stream を指定するとチャンク単位で読み込み、近似統計量を返します。
+    mode=sample を指定すると固定サイズのサンプルから信頼区間付きの推定値を返します。
     """
-    profile = profile_csv_data(request.csv_data)
+    if request.dataset_id:
+        dataset = get_dataset_with_file(db, request.dataset_id, current_user.id)
+        profile = profile_csv_file(
+            dataset.file_path, dataset.content_hash, mode=request.mode,
+            sample_size=request.sample_size, store_dir=dataset.store_path,
+            schema=None if dataset.store_path else get_dataset_schema(dataset)
+        )
+    elif request.csv_data is not None:
+        profile = profile_csv_data(request.csv_data, mode=request.mode, sample_size=request.sample_size)
+    else:
+        raise ValidationException("csv_data または dataset_id を指定してください")
+    return ApiResponse.success(data=_profile_response(profile).model_dump()).model_dump()
+
+
+@router.post("/datasets/{dataset_id}/append", response_model=dict)
+def append_and_profile(
+    dataset_id: str,
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """データセットに行を追記してプロファイルを増分更新
+    
+    multipart/form-data で受け取ったCSV（既存と同じヘッダ付き）の行をデータセットに追記し、
+    保存済みのプロファイル状態に追記分だけを加えて、データ全体のプロファイルを返します。
+    """
+    profile = append_dataset_rows(db, dataset_id, current_user.id, file.file)
+    return ApiResponse.success(data=_profile_response(profile).model_dump()).model_dump()
+
+
+def _profile_response(profile: dict) -> DatasetProfile:
+    """プロファイルと品質問題をレスポンス用に変換"""
     issues = detect_data_quality_issues(profile)
     
-    # レスポンス用に変換
     column_profiles = {
         col: ColumnProfile(**data) 
         for col, data in profile.get("column_profiles", {}).items()
@@ -34,6 +69,9 @@ def analyze_data(
     quality_issues = [DataQualityIssue(**issue) for issue in issues]
     
     response = DatasetProfile(
+        mode=profile["mode"],
+        sample_size=profile.get("sample_size"),
+        confidence_level=profile.get("confidence_level"),
         rows=profile["rows"],
         columns=profile["columns"],
         missing_values=profile["missing_values"],
@@ -45,5 +83,27 @@ def analyze_data(
         quality_issues=quality_issues
     )
     
-    return ApiResponse.success(data=response.model_dump()).model_dump()
+    return response
+
 
+
+@router.get("/cache", response_model=dict)
+def get_cache_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """プロファイルキャッシュの統計情報を取得"""
+    cache = get_profile_cache()
+    return ApiResponse.success(
+        data={"enabled": cache is not None, "stats": cache.stats() if cache else None}
+    ).model_dump()
+
+
+@router.delete("/cache", response_model=dict)
+def invalidate_cache(
+    current_user: User = Depends(get_current_user)
+):
+    """プロファイルキャッシュを全て無効化"""
+    cache = get_profile_cache()
+    if cache is not None:
+        cache.invalidate()
+    return ApiResponse.success(data=None, message="Profile cache invalidated").model_dump()
@@ -14,6 +14,9 @@ class DatasetSummary(BaseModel):
     dataset_id: str  # UUIDを文字列として扱う（SQLite互換性のため）
     name: str
     description: Optional[str] = None
+    has_file: bool = False  # CSVファイルがアップロード済みか
+    rows: Optional[int] = None
+    columns: Optional[int] = None
     created_at: datetime
     
     class Config:
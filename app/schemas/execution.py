@@ -16,25 +16,65 @@ class ExecutionStepLogResponse(BaseModel):
     """実行ステップログレスポンス"""
     order: int
     name: str
-    status: str  # success, failed
+    status: str  # success, failed, cached, cancelled
     execution_time: Optional[float] = None
     error_message: Optional[str] = None
+    cpu_time: Optional[float] = None  # CPU時間（秒）
+    peak_memory_bytes: Optional[int] = None  # 実行中に増えたメモリ（RSS）のピーク
+    memory_before_bytes: Optional[int] = None  # 実行前のDataFrameのメモリ使用量
+    memory_after_bytes: Optional[int] = None  # 実行後のDataFrameのメモリ使用量
+    rows_before: Optional[int] = None
+    rows_after: Optional[int] = None
+    columns_before: Optional[int] = None
+    columns_after: Optional[int] = None
     
     class Config:
         from_attributes = True
 
 
+class BatchInputResult(BaseModel):
+    """一括実行の入力ごとの結果"""
+    execution_id: str
+    dataset_id: Optional[str] = None
+    file_path: Optional[str] = None
+    status: str  # pending, running, completed, failed, cancelled
+    rows: Optional[int] = None
+    execution_time: Optional[float] = None
+    error_message: Optional[str] = None
+
+
+class BatchProgress(BaseModel):
+    """一括実行の集計（親の実行履歴のみ）"""
+    total: int
+    pending: int
+    running: int
+    completed: int
+    failed: int
+    cancelled: int = 0
+    rows: int  # 完了した入力の行数の合計
+    elapsed_seconds: Optional[float] = None
+    rows_per_second: Optional[float] = None
+    files_per_second: Optional[float] = None
+    results: list[BatchInputResult] = []
+
+
 class ExecutionResponse(BaseModel):
     """実行レスポンス"""
     execution_id: str
     plan_id: str
-    status: str  # pending, running, completed, failed
+    status: str  # pending, running, completed, failed, cancelled
     before_summary: Optional[ExecutionSummary] = None
     after_summary: Optional[ExecutionSummary] = None
     step_logs: list[ExecutionStepLogResponse] = []
     execution_time: Optional[float] = None
     error_message: Optional[str] = None
+    total_steps: Optional[int] = None  # プランのステップ数（step_logs の件数と比べて進捗を確認できる）
+    mode: Optional[str] = None  # auto, memory, stream（処理開始後は実際に使ったモード）
+    parent_id: Optional[str] = None  # 一括実行の子の場合は親の実行ID
+    batch: Optional[BatchProgress] = None  # 一括実行の親の場合のみ
+    cancel_requested_at: Optional[datetime] = None  # 取り消しが要求された日時（POST /executions/{id}/cancel）
     created_at: datetime
+    started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
     
     class Config:
@@ -50,3 +90,46 @@ class ExecutionListResponse(BaseModel):
 class ExecuteRequest(BaseModel):
     """実行リクエスト"""
     csv_data: Optional[str] = None  # CSVデータ（オプション）
+    dataset_id: Optional[str] = None  # アップロード済みデータセットのID（オプション）
+    mode: str = "auto"  # auto（入力が大きく、全ステップがチャンク実行できる場合は stream）, memory, stream
+    preview: bool = False  # true の場合は入力の一部の行だけで同期的に実行し、実行履歴を保存しない
+    preview_rows: Optional[int] = None  # プレビューで実行する行数（省略時は EXECUTION_PREVIEW_ROWS）
+    preview_sample: str = "head"  # head（先頭の行）, random（ランダムに選んだ行）
+    preview_seed: Optional[int] = None  # random の乱数のシード（同じシードで同じ行を選ぶ）
+
+
+class PreviewStepResult(BaseModel):
+    """プレビューのステップごとの結果"""
+    order: int
+    name: str
+    status: str  # success, failed
+    execution_time: Optional[float] = None
+    error_message: Optional[str] = None
+    rows_before: Optional[int] = None
+    rows_after: Optional[int] = None
+    columns_before: Optional[int] = None
+    columns_after: Optional[int] = None
+    rows_delta: Optional[int] = None  # rows_after - rows_before
+    columns_delta: Optional[int] = None  # columns_after - columns_before
+
+
+class PlanPreviewResponse(BaseModel):
+    """プレビューレスポンス"""
+    plan_id: str
+    status: str  # completed, failed
+    sample: str  # head, random
+    rows: int  # 実行した行数
+    total_rows: Optional[int] = None  # 入力全体の行数（先頭の行だけを読み込んだ場合は None）
+    step_results: list[PreviewStepResult] = []
+    total_steps: int
+    columns: list[str] = []  # 実行結果のカラム
+    head: list[list[Any]] = []  # 実行結果の先頭の行（EXECUTION_PREVIEW_HEAD_ROWS 行）
+    execution_time: float
+    error_message: Optional[str] = None
+
+
+class BatchExecuteRequest(BaseModel):
+    """一括実行リクエスト"""
+    dataset_ids: list[str] = []  # アップロード済みデータセットのID
+    file_paths: list[str] = []  # サーバー上のCSVファイル（EXECUTION_BATCH_INPUT_DIR からの相対パス）
+    mode: str = "auto"  # auto, memory, stream
@@ -1,15 +1,20 @@
 from pydantic import BaseModel
 from datetime import datetime
 from uuid import UUID
-from typing import Optional
+from typing import Any, Optional
 
 
 class PlanStep(BaseModel):
-    """プランステップ"""
+    """プランステップ（code_snippet と operation のどちらかを指定する）
+    
+    保存済みのステップを返すためのスキーマで、内容は検査しない。ステップはキューに登録する前に
+    検査する（app/services/execution_service.py の _get_executable_plan。不正な場合は 400）。
+    """
     order: int
     name: str
     description: Optional[str] = None
-    code_snippet: str
+    code_snippet: Optional[str] = None
+    operation: Optional[dict[str, Any]] = None  # 構造化された操作（例: {"op": "standardize", "columns": ["age"]}）
     
     class Config:
         from_attributes = True
@@ -21,6 +26,7 @@ class PlanCreate(BaseModel):
     task_type: str  # classification, regression, clustering
     target_column: Optional[str] = None
     plan_name: Optional[str] = None
+    max_runtime: Optional[float] = None  # 1回の実行の実行時間の上限（秒。省略時は EXECUTION_MAX_RUNTIME）
 
 
 class PlanResponse(BaseModel):
@@ -31,6 +37,7 @@ class PlanResponse(BaseModel):
     target_column: Optional[str]
     name: Optional[str]
     steps: list[PlanStep]
+    max_runtime: Optional[float] = None
     created_at: datetime
     
     class Config:
@@ -43,6 +50,7 @@ class PlanSummary(BaseModel):
     name: Optional[str]
     dataset_id: str
     task_type: str
+    max_runtime: Optional[float] = None
     created_at: datetime
     
     class Config:
@@ -0,0 +1,84 @@
+"""プランステップの構造化された操作の定義と検証
+
+コードスニペットの代わりに、プランのステップは次の操作を JSON で指定できる
+（PlanStep.operation。例: {"op": "standardize", "columns": ["age", "income"]}）。
+操作の実行は app/services/plan_operators.py が行う。ここではパラメータの定義と検証だけを扱い、
+モデル・スキーマ・サービスのどの層からも参照できるよう app.services には依存しない。
+
+    drop_na        欠損値を含む行を削除（columns: 対象カラム、how: any / all）
+    fill_na        欠損値を補完（columns, strategy: mean / median / mode / constant, value）
+    standardize    平均0・標準偏差1に標準化
+    label_encode   文字列の昇順でラベルエンコーディング
+    one_hot        ワンホットエンコーディング（drop_first）
+    clip_outliers  外れ値を境界値に置き換え（method: iqr / zscore, factor）
+    cast           型変換（dtype: int / float / str / bool / category / datetime / numeric）
+    drop_columns   カラムを削除
+"""
+from typing import Any, Union
+
+# ステップの実行内容（コードスニペット、または構造化された操作）
+StepSource = Union[str, dict]
+
+# 操作ごとのパラメータ: 名前 -> (種類, 必須か, 既定値)
+OPERATIONS: dict[str, dict[str, tuple[str, bool, Any]]] = {
+    "drop_na": {"columns": ("columns", False, None), "how": ("choice:any,all", False, "any")},
+    "fill_na": {
+        "columns": ("columns", False, None),
+        "strategy": ("choice:mean,median,mode,constant", False, "mean"),
+        "value": ("scalar", False, None),
+    },
+    "standardize": {"columns": ("columns", True, None)},
+    "label_encode": {"columns": ("columns", True, None)},
+    "one_hot": {"columns": ("columns", True, None), "drop_first": ("bool", False, False)},
+    "clip_outliers": {
+        "columns": ("columns", True, None),
+        "method": ("choice:iqr,zscore", False, "iqr"),
+        "factor": ("number", False, None),
+    },
+    "cast": {
+        "columns": ("columns", True, None),
+        "dtype": ("choice:int,float,str,bool,category,datetime,numeric", True, None),
+    },
+    "drop_columns": {"columns": ("columns", True, None)},
+}
+
+
+def validate_operation(operation: Any) -> dict:
+    """操作を検証し、既定値を補った操作を返す（不正な場合は ValueError）"""
+    if not isinstance(operation, dict) or not isinstance(operation.get("op"), str):
+        raise ValueError("操作は op を含むオブジェクトで指定してください")
+    op = operation["op"]
+    params = OPERATIONS.get(op)
+    if params is None:
+        raise ValueError(f"未対応の操作です: {op}（{', '.join(OPERATIONS)} のいずれか）")
+    unknown = set(operation) - set(params) - {"op"}
+    if unknown:
+        raise ValueError(f"操作 {op} に不明なパラメータがあります: {', '.join(sorted(unknown))}")
+    normalized = {"op": op}
+    for name, (kind, required, default) in params.items():
+        value = operation.get(name)
+        if value is None:
+            if required:
+                raise ValueError(f"操作 {op} には {name} が必要です")
+            normalized[name] = default
+            continue
+        if not _is_valid(kind, value):
+            raise ValueError(f"操作 {op} の {name} が不正です: {value!r}")
+        normalized[name] = value
+    if op == "fill_na" and normalized["strategy"] == "constant" and normalized["value"] is None:
+        raise ValueError("操作 fill_na の strategy が constant の場合は value が必要です")
+    return normalized
+
+
+def _is_valid(kind: str, value: Any) -> bool:
+    if kind == "columns":
+        return isinstance(value, list) and bool(value) and all(isinstance(col, str) for col in value)
+    if kind == "bool":
+        return isinstance(value, bool)
+    if kind == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+    if kind == "scalar":
+        return isinstance(value, (str, int, float, bool))
+    if kind.startswith("choice:"):
+        return value in kind[len("choice:"):].split(",")
+    return False
@@ -24,6 +24,11 @@ class ColumnProfile(BaseModel):
     outliers_rate: Optional[float] = None
     # カテゴリ型の場合のみ
     top_values: Optional[dict[str, int]] = None
+    # 近似計算（streamモード）の場合のみ
+    # 分位点は正規化順位誤差、uniqueは相対標準誤差（厳密な場合は0）
+    error_bounds: Optional[dict[str, float]] = None
+    # サンプリング（sampleモード）の場合のみ。フィールド名 -> [下限, 上限]
+    confidence_intervals: Optional[dict[str, list[Optional[float]]]] = None
 
 
 class DataQualityIssue(BaseModel):
@@ -33,10 +38,14 @@ class DataQualityIssue(BaseModel):
     column: str
     message: str
     suggestion: str
+    uncertain: bool = False  # 推定値の信頼区間がしきい値をまたぐ場合True
 
 
 class DatasetProfile(BaseModel):
     """データセットプロファイル"""
+    mode: str = "exact"  # exact, stream, sample, incremental
+    sample_size: Optional[int] = None
+    confidence_level: Optional[float] = None
     rows: int
     columns: int
     missing_values: int
@@ -49,6 +58,9 @@ class DatasetProfile(BaseModel):
 
 
 class ProfileRequest(BaseModel):
-    """プロファイルリクエスト"""
-    csv_data: str
+    """プロファイルリクエスト（csv_data または dataset_id のいずれかを指定）"""
+    csv_data: Optional[str] = None
+    dataset_id: Optional[str] = None  # アップロード済みデータセットのID
+    mode: str = "exact"  # exact, stream, sample
+    sample_size: Optional[int] = None  # sampleモードのサンプルサイズ
 
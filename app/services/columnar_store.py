@@ -0,0 +1,343 @@
+"""カラム単位のバイナリ保存形式
+
+アップロードされたCSVを一度だけ解析し、カラムごとのバイナリファイルに変換して保存する。
+数値・真偽値カラムは生の配列、文字列カラムは辞書（カテゴリ）とint32のコードとして保存し、
+読み込み時はメモリマップするため、テキストの再解析や全カラムの読み込みが不要になる。
+辞書は可変長（開始位置の配列と値のバイト列）で保存するため、長い値が1つあっても
+辞書全体の大きさは値の合計の長さにしかならない。
+
+ディレクトリ構成:
+    schema.json              行数と各カラムの型・ファイル名
+    <i>.bin                  カラム i の値（数値・真偽値・日時）またはコード（文字列）
+    <i>.categories.bin       文字列カラム i の辞書の値（UTF-8のバイト列を連結したもの）
+    <i>.categories.offsets   文字列カラム i の辞書の各値の開始位置（int64、値の数+1個）
+    index.bin                整数のインデックス（write_frame で保存した、0からの連番でない場合のみ）
+"""
+import json
+import os
+import shutil
+import uuid
+from typing import Iterator, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+SCHEMA_FILE = "schema.json"
+FORMAT_VERSION = 1
+
+
+def convert_csv(csv_path: str, store_dir: str, chunksize: int) -> dict:
+    """CSVをカラム単位のバイナリ形式に変換
+
+    1パス目で全チャンクを通したカラムの型を決め、2パス目でその型を指定して
+    読み込みながら書き出す。メモリ使用量はチャンクサイズと文字列カラムの辞書のみに依存する。
+
+    Args:
+        csv_path: 変換元のCSVファイル
+        store_dir: 出力先ディレクトリ（既存の場合は置き換える）
+        chunksize: 1回に読み込む行数
+
+    Returns:
+        保存したスキーマ
+    """
+    kinds = _infer_column_kinds(csv_path, chunksize)
+    read_dtypes = {name: (str if kind == "string" else dtype) for name, (kind, dtype) in kinds.items()}
+
+    tmp_dir = store_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    names = list(kinds)
+    files = [open(os.path.join(tmp_dir, f"{i}.bin"), "wb") for i in range(len(names))]
+    categories: dict[int, dict[str, int]] = {i: {} for i, name in enumerate(names) if kinds[name][0] == "string"}
+    rows = 0
+    try:
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize, dtype=read_dtypes):
+            rows += len(chunk)
+            for i, name in enumerate(names):
+                series = chunk[name]
+                if i in categories:
+                    codes = _encode_strings(series, categories[i])
+                    files[i].write(codes.tobytes())
+                else:
+                    files[i].write(series.to_numpy(dtype=kinds[name][1]).tobytes())
+    finally:
+        for f in files:
+            f.close()
+
+    columns = []
+    for i, name in enumerate(names):
+        kind, dtype = kinds[name]
+        column = {"name": name, "kind": kind, "dtype": dtype, "file": f"{i}.bin"}
+        if kind == "string":
+            column["dtype"] = "int32"
+            _save_categories(tmp_dir, column, i, list(categories[i]))
+        columns.append(column)
+
+    schema = {"format_version": FORMAT_VERSION, "rows": rows, "columns": columns}
+    with open(os.path.join(tmp_dir, SCHEMA_FILE), "w", encoding="utf-8") as f:
+        json.dump(schema, f, ensure_ascii=False)
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_dir, store_dir)
+    return schema
+
+
+def append_csv(csv_path: str, store_dir: str, chunksize: int) -> dict:
+    """CSVの行を保存済みデータの末尾に追加
+
+    追加分は一時ファイルに書き出してから各カラムのファイルに連結するため、
+    保存済みの型で読み込めない場合（整数カラムに欠損が現れる等）は ValueError を送出し、
+    保存済みのデータは変更しない。
+
+    Args:
+        csv_path: 追加する行のCSVファイル（ヘッダは保存済みのカラムと一致すること）
+        store_dir: 保存先ディレクトリ
+        chunksize: 1回に読み込む行数
+
+    Returns:
+        更新後のスキーマ
+    """
+    schema = read_schema(store_dir)
+    columns = schema["columns"]
+    names = [column["name"] for column in columns]
+    read_dtypes = {column["name"]: (str if column["kind"] == "string" else column["dtype"]) for column in columns}
+    categories = {
+        i: {value: code for code, value in enumerate(_load_categories(store_dir, column))}
+        for i, column in enumerate(columns) if column["kind"] == "string"
+    }
+
+    part_paths = [os.path.join(store_dir, column["file"] + ".part") for column in columns]
+    parts = [open(path, "wb") for path in part_paths]
+    rows = 0
+    try:
+        try:
+            for chunk in pd.read_csv(csv_path, chunksize=chunksize, dtype=read_dtypes):
+                if list(chunk.columns) != names:
+                    raise ValueError("カラムが保存済みのデータと一致しません")
+                rows += len(chunk)
+                for i, column in enumerate(columns):
+                    if i in categories:
+                        parts[i].write(_encode_strings(chunk[column["name"]], categories[i]).tobytes())
+                    else:
+                        parts[i].write(chunk[column["name"]].to_numpy(dtype=column["dtype"]).tobytes())
+        finally:
+            for f in parts:
+                f.close()
+
+        for column, part_path in zip(columns, part_paths):
+            with open(os.path.join(store_dir, column["file"]), "ab") as out, open(part_path, "rb") as part:
+                shutil.copyfileobj(part, out)
+    finally:
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    # 読み込み中のプロセスが辞書を読んでいる場合があるため、書き換えずに置き換える
+    # （辞書は末尾に追加されるだけなので、古いスキーマで読み込んだコードも引き続き有効）
+    for i, column in enumerate(columns):
+        if i in categories:
+            _save_categories(store_dir, column, i, list(categories[i]))
+    schema["rows"] += rows
+    tmp_path = os.path.join(store_dir, SCHEMA_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(schema, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(store_dir, SCHEMA_FILE))
+    return schema
+
+
+def write_frame(df: pd.DataFrame, store_dir: str) -> dict:
+    """DataFrameをカラム単位のバイナリ形式で保存
+
+    数値・真偽値・日時カラムと、文字列のみのカラム（str または object）に対応する。
+    インデックスは0からの連番か整数のみに対応し、それ以外の型を含む場合は ValueError を送出する。
+
+    Args:
+        df: 保存するDataFrame
+        store_dir: 出力先ディレクトリ（既存の場合は置き換える）
+
+    Returns:
+        保存したスキーマ
+    """
+    if not all(isinstance(name, str) for name in df.columns) or not df.columns.is_unique:
+        raise ValueError("カラム名は重複のない文字列である必要があります")
+    index = df.index
+    save_index = not (isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1)
+    if save_index and not pd.api.types.is_integer_dtype(index.dtype):
+        raise ValueError(f"保存できないインデックスの型です: {index.dtype}")
+
+    tmp_dir = f"{store_dir}.{uuid.uuid4().hex}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        columns = []
+        for i, name in enumerate(df.columns):
+            series = df[name]
+            column = {"name": name, "file": f"{i}.bin"}
+            if pd.api.types.is_bool_dtype(series.dtype) and isinstance(series.dtype, np.dtype):
+                column.update(kind="bool", dtype="bool")
+            elif isinstance(series.dtype, np.dtype) and series.dtype.kind in "iufmM":
+                column.update(kind="numeric" if series.dtype.kind in "iuf" else "datetime", dtype=str(series.dtype))
+            elif pd.api.types.infer_dtype(series, skipna=True) in ("string", "empty") and (
+                series.dtype == object or pd.api.types.is_string_dtype(series.dtype)
+            ):
+                categories: dict[str, int] = {}
+                codes = _encode_strings(series, categories)
+                column.update(kind="string", dtype="int32", pandas_dtype="object" if series.dtype == object else "str")
+                _save_categories(tmp_dir, column, i, list(categories))
+                with open(os.path.join(tmp_dir, column["file"]), "wb") as f:
+                    f.write(codes.tobytes())
+                columns.append(column)
+                continue
+            else:
+                raise ValueError(f"保存できないカラムの型です: {name} ({series.dtype})")
+            with open(os.path.join(tmp_dir, column["file"]), "wb") as f:
+                f.write(series.to_numpy(dtype=column["dtype"]).tobytes())
+            columns.append(column)
+
+        schema = {"format_version": FORMAT_VERSION, "rows": len(df), "columns": columns}
+        if save_index:
+            schema["index"] = {"file": "index.bin", "dtype": "int64", "name": index.name}
+            with open(os.path.join(tmp_dir, "index.bin"), "wb") as f:
+                f.write(index.to_numpy(dtype="int64").tobytes())
+        with open(os.path.join(tmp_dir, SCHEMA_FILE), "w", encoding="utf-8") as f:
+            json.dump(schema, f, ensure_ascii=False)
+
+        shutil.rmtree(store_dir, ignore_errors=True)
+        os.replace(tmp_dir, store_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return schema
+
+
+def read_schema(store_dir: str) -> dict:
+    """保存済みのスキーマを読み込む"""
+    with open(os.path.join(store_dir, SCHEMA_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_frame(store_dir: str, columns: Optional[list[str]] = None) -> pd.DataFrame:
+    """保存済みのデータをDataFrameとして読み込む
+
+    数値・真偽値カラムはメモリマップした配列をコピーせずに使う（書き込みはプライベートな
+    コピーに対して行われ、ファイルは変更されない）。文字列カラムは辞書からデコードする。
+
+    Args:
+        store_dir: 保存先ディレクトリ
+        columns: 読み込むカラム（省略時は全カラム）
+    """
+    return _build_frame(store_dir, read_schema(store_dir), columns, slice(None))
+
+
+def load_rows(
+    store_dir: str, rows: Union[slice, np.ndarray], columns: Optional[list[str]] = None
+) -> pd.DataFrame:
+    """保存済みのデータの一部の行だけを読み込む
+
+    Args:
+        store_dir: 保存先ディレクトリ
+        rows: 読み込む行の範囲、または行の位置（昇順）の配列。配列の場合は該当する行だけをコピーする
+        columns: 読み込むカラム（省略時は全カラム）
+    """
+    return _build_frame(store_dir, read_schema(store_dir), columns, rows)
+
+
+def iter_chunks(store_dir: str, chunksize: int, columns: Optional[list[str]] = None) -> Iterator[pd.DataFrame]:
+    """保存済みのデータを行方向のチャンクとして順に読み込む"""
+    schema = read_schema(store_dir)
+    for start in range(0, schema["rows"], chunksize):
+        yield _build_frame(store_dir, schema, columns, slice(start, min(start + chunksize, schema["rows"])))
+
+
+def _build_frame(
+    store_dir: str, schema: dict, columns: Optional[list[str]], rows: Union[slice, np.ndarray]
+) -> pd.DataFrame:
+    selected = schema["columns"]
+    if columns is not None:
+        by_name = {column["name"]: column for column in selected}
+        missing = [name for name in columns if name not in by_name]
+        if missing:
+            raise KeyError(f"存在しないカラムです: {missing}")
+        selected = [by_name[name] for name in columns]
+
+    data = {}
+    for column in selected:
+        values = _map_column(store_dir, column, schema["rows"])[rows]
+        if column["kind"] == "string":
+            categories = _load_categories(store_dir, column)
+            decoded = pd.Categorical.from_codes(values, categories=pd.Index(categories, dtype="str"))
+            data[column["name"]] = pd.Series(decoded).astype(column.get("pandas_dtype", "str"))
+        else:
+            data[column["name"]] = pd.Series(values, copy=False)
+    df = pd.DataFrame(data, copy=False)
+    if "index" in schema:
+        index = _map_column(store_dir, schema["index"], schema["rows"])[rows]
+        df.index = pd.Index(index, name=schema["index"]["name"])
+    return df
+
+
+def _map_column(store_dir: str, column: dict, rows: int) -> np.ndarray:
+    if rows == 0:
+        return np.empty(0, dtype=column["dtype"])
+    mapped = np.memmap(os.path.join(store_dir, column["file"]), dtype=column["dtype"], mode="c", shape=(rows,))
+    # memmap のサブクラスが演算結果に伝播しないよう、同じメモリを参照する通常の配列として返す
+    return mapped.view(np.ndarray)
+
+
+def _save_categories(store_dir: str, column: dict, i: int, values: list[str]) -> None:
+    """文字列カラムの辞書を開始位置の配列と値のバイト列として保存し、カラムの情報に記録
+
+    既存の辞書は一時ファイルに書き出してから値・開始位置の順に置き換える。読み込みは
+    スキーマに記録した値の数までしか参照しないため、置き換えの途中に読み込んでも
+    （辞書は末尾に追加されるだけなので）参照する範囲は古いファイルと新しいファイルで一致する。
+    """
+    encoded = [value.encode("utf-8", "surrogatepass") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    column.update(
+        categories=f"{i}.categories.bin", category_offsets=f"{i}.categories.offsets", category_count=len(values)
+    )
+    for name, content in ((column["categories"], b"".join(encoded)), (column["category_offsets"], offsets.tobytes())):
+        path = os.path.join(store_dir, name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(content)
+        os.replace(path + ".tmp", path)
+
+
+def _load_categories(store_dir: str, column: dict) -> list[str]:
+    """文字列カラムの辞書を読み込む（固定長の配列で保存した旧形式にも対応）"""
+    if "category_offsets" not in column:
+        return np.load(os.path.join(store_dir, column["categories"])).tolist()
+    count = column["category_count"]
+    offsets = np.fromfile(os.path.join(store_dir, column["category_offsets"]), dtype=np.int64, count=count + 1)
+    with open(os.path.join(store_dir, column["categories"]), "rb") as f:
+        data = f.read(int(offsets[-1]))
+    bounds = offsets.tolist()
+    return [data[start:end].decode("utf-8", "surrogatepass") for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def _infer_column_kinds(csv_path: str, chunksize: int) -> dict[str, tuple[str, str]]:
+    """全チャンクを通したカラムの種類（numeric/bool/string）と保存する型を決める"""
+    seen: dict[str, list[np.dtype]] = {}
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        for name in chunk.columns:
+            seen.setdefault(name, []).append(chunk[name].dtype)
+
+    kinds = {}
+    for name, dtypes in seen.items():
+        if all(pd.api.types.is_bool_dtype(d) for d in dtypes):
+            kinds[name] = ("bool", "bool")
+        elif all(pd.api.types.is_numeric_dtype(d) and not pd.api.types.is_bool_dtype(d) for d in dtypes):
+            kinds[name] = ("numeric", str(np.result_type(*dtypes)))
+        else:
+            kinds[name] = ("string", "str")
+    return kinds
+
+
+def _encode_strings(series: pd.Series, categories: dict[str, int]) -> np.ndarray:
+    """文字列を辞書のコードに変換（欠損は-1）。新しい値は辞書に追加する"""
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    mapping = np.empty(len(uniques), dtype=np.int32)
+    for j, value in enumerate(uniques):
+        mapping[j] = categories.setdefault(value, len(categories))
+    return np.where(codes >= 0, mapping[codes] if len(mapping) else -1, -1).astype(np.int32)
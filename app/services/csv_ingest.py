@@ -0,0 +1,198 @@
+"""CSV読み込み層（スキーマの推定と再利用）
+
+プロファイリングと実行で共通に使うCSVの読み込み処理。
+先頭のサンプルからカラムの型を一度だけ推定してスキーマとして保存し、以降の読み込みでは
+明示的な dtype を指定して型推論を省く。カーディナリティの低い文字列カラムは category として
+読み込み、usecols で必要なカラムだけを解析する。pyarrow がインストールされていれば
+一括読み込みに pyarrow エンジンを使う。
+
+スキーマはサンプルからの推定なので、サンプル外の行と型が合わない場合（整数カラムに後から
+欠損が現れる等）は、一括読み込みでは dtype を指定せずに読み直し、チャンク単位の読み込みでは
+そのチャンクのカラムを推論した型のまま返す。
+
+データセットのCSVは追記でその場で伸びるため、スキーマに確定済みのバイト数（committed_bytes）が
+記録されている場合、パスから読み込むときはその位置で読み込みを打ち切る（書き込み途中の行を読まない）。
+"""
+import importlib.util
+import io
+import json
+import os
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional, TextIO, Union
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+
+SCHEMA_VERSION = 1
+
+PYARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+CsvSource = Union[str, TextIO]
+
+
+def infer_schema(source: CsvSource, sample_rows: Optional[int] = None) -> dict:
+    """CSVの先頭のサンプルからスキーマを推定
+
+    Args:
+        source: CSVファイルのパス、または先頭にシーク可能なテキストストリーム
+        sample_rows: 推定に使う行数（省略時は設定値）
+
+    Returns:
+        カラム名と dtype のリストを含むスキーマ
+    """
+    sample = pd.read_csv(_rewind(source), nrows=sample_rows or settings.INGEST_SCHEMA_SAMPLE_ROWS)
+    return schema_from_frame(sample)
+
+
+def schema_from_frame(df: pd.DataFrame) -> dict:
+    """読み込み済みのDataFrameからスキーマを生成"""
+    columns = []
+    for name in df.columns:
+        series = df[name]
+        if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            dtype = str(series.dtype)
+        elif _is_low_cardinality(series):
+            dtype = "category"
+        else:
+            dtype = "str"
+        columns.append({"name": name, "dtype": dtype})
+    return {"version": SCHEMA_VERSION, "columns": columns}
+
+
+def save_schema(path: str, schema: dict) -> None:
+    """スキーマをJSONとして保存"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(schema, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_schema(path: str) -> Optional[dict]:
+    """保存済みのスキーマを読み込む（存在しない・形式が古い場合は None）"""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        schema = json.load(f)
+    return schema if schema.get("version") == SCHEMA_VERSION else None
+
+
+def read_csv(
+    source: CsvSource,
+    schema: Optional[dict] = None,
+    usecols: Optional[list[str]] = None,
+    categories: bool = True,
+    nrows: Optional[int] = None,
+) -> pd.DataFrame:
+    """スキーマに従ってCSV全体（または先頭の nrows 行）を読み込む
+
+    Args:
+        source: CSVファイルのパス、または先頭にシーク可能なテキストストリーム
+        schema: 使用するスキーマ（省略時はその場でサンプルから推定する）
+        usecols: 読み込むカラム（省略時は全カラム）
+        categories: category と推定されたカラムを category 型で読み込むか。
+            False の場合は文字列として読み込む（カテゴリにない値を代入する処理のため）
+        nrows: 読み込む行数（省略時は全行）
+    """
+    if schema is None:
+        schema = infer_schema(source)
+    engine = "pyarrow" if PYARROW_AVAILABLE and settings.INGEST_USE_PYARROW else None
+    try:
+        with _open_source(source, schema) as f:
+            return pd.read_csv(
+                f, usecols=usecols, dtype=_dtypes(schema, usecols, categories), nrows=nrows,
+                engine=engine if nrows is None else None
+            )
+    except (ValueError, TypeError):
+        # サンプル外の行がスキーマと合わない場合は型推論に任せる
+        with _open_source(source, schema) as f:
+            return pd.read_csv(f, usecols=usecols, nrows=nrows)
+
+
+def iter_csv_chunks(
+    source: CsvSource,
+    chunksize: int,
+    schema: Optional[dict] = None,
+    usecols: Optional[list[str]] = None,
+) -> Iterator[pd.DataFrame]:
+    """スキーマに従ってCSVをチャンク単位で読み込む
+
+    チャンク間で category の辞書が揃わないため、文字列カラムは常に文字列として読み込む。
+    数値・真偽値カラムは型推論で解析してから、読み込んだチャンクのままスキーマの型に変換する
+    （サンプル外の行がスキーマと合わないチャンクでも読み直しが不要で、そのカラムは推論した型のまま返す）。
+    """
+    if schema is None:
+        yield from pd.read_csv(_rewind(source), chunksize=chunksize, usecols=usecols)
+        return
+    dtypes = _dtypes(schema, usecols, categories=False)
+    text_dtypes = {name: dtype for name, dtype in dtypes.items() if dtype == "str"}
+    typed = {name: pd.api.types.pandas_dtype(dtype) for name, dtype in dtypes.items() if dtype != "str"}
+    with _open_source(source, schema) as f:
+        for chunk in pd.read_csv(f, chunksize=chunksize, usecols=usecols, dtype=text_dtypes):
+            yield _cast_chunk(chunk, typed)
+
+
+def _cast_chunk(chunk: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    """推論した型のチャンクを、値を失わずに変換できるカラムだけスキーマの型に変換"""
+    casts = {
+        name: dtype for name, dtype in dtypes.items()
+        if name in chunk.columns and chunk[name].dtype != dtype
+        and isinstance(dtype, np.dtype) and isinstance(chunk[name].dtype, np.dtype)
+        and np.can_cast(chunk[name].dtype, dtype, casting="safe")
+    }
+    return chunk.astype(casts) if casts else chunk
+
+
+def _dtypes(schema: dict, usecols: Optional[list[str]], categories: bool) -> dict[str, str]:
+    """read_csv に渡す dtype の辞書を生成"""
+    selected = set(usecols) if usecols is not None else None
+    dtypes = {}
+    for column in schema["columns"]:
+        if selected is not None and column["name"] not in selected:
+            continue
+        dtype = column["dtype"]
+        dtypes[column["name"]] = "str" if dtype == "category" and not categories else dtype
+    return dtypes
+
+
+def _is_low_cardinality(series: pd.Series) -> bool:
+    count = int(series.count())
+    if count == 0:
+        return False
+    unique = int(series.nunique())
+    return unique <= settings.INGEST_CATEGORY_MAX_UNIQUE and unique / count <= settings.INGEST_CATEGORY_MAX_UNIQUE_RATE
+
+
+@contextmanager
+def _open_source(source: CsvSource, schema: dict) -> Iterator[Union[CsvSource, BinaryIO]]:
+    """読み込み元を開く（パスでスキーマに確定済みのバイト数があれば、その位置までだけを読むファイル）"""
+    size = schema.get("committed_bytes")
+    if not isinstance(source, str) or size is None:
+        yield _rewind(source)
+        return
+    with open(source, "rb") as f:
+        yield io.BufferedReader(_BoundedReader(f, size))
+
+
+class _BoundedReader(io.RawIOBase):
+    """ファイルの先頭から limit バイトまでだけを読むストリーム"""
+
+    def __init__(self, f: BinaryIO, limit: int):
+        self._f = f
+        self._remaining = limit
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer)[:self._remaining]
+        n = self._f.readinto(view)
+        self._remaining -= n
+        return n
+
+
+def _rewind(source: CsvSource) -> CsvSource:
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
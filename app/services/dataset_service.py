@@ -1,11 +1,24 @@
 """データセットサービス"""
 from sqlalchemy.orm import Session
-from typing import List
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, BinaryIO
+import fcntl
+import hashlib
+import json
+import shutil
+import os
+import tempfile
 import uuid
+import pandas as pd
 
+from app.core.config import settings
 from app.models.dataset import Dataset
 from app.schemas.dataset import DatasetSummary, DatasetCreate
 from app.repositories.dataset_repository import DatasetRepository
+from app.services import columnar_store, csv_ingest
+from app.services.profiling_service import profile_appended_chunks
+from app.services.upload_receiver import ReceivedFile
+from app.exceptions import ResourceNotFoundException, UnauthorizedAccessException, ValidationException
 
 
 def get_user_datasets(db: Session, user_id: str) -> List[DatasetSummary]:
@@ -17,6 +30,9 @@ def get_user_datasets(db: Session, user_id: str) -> List[DatasetSummary]:
             dataset_id=dataset.id,
             name=dataset.name,
             description=dataset.description,
+            has_file=dataset.file_path is not None,
+            rows=dataset.rows,
+            columns=dataset.columns,
             created_at=dataset.created_at
         )
         for dataset in datasets
@@ -33,3 +49,258 @@ def create_dataset(db: Session, user_id: str, dataset_data: DatasetCreate) -> Da
         description=dataset_data.description
     )
     return repo.create(new_dataset)
+
+
+def upload_dataset(
+    db: Session,
+    user_id: str,
+    dataset_id: str,
+    upload: ReceivedFile,
+    name: Optional[str] = None,
+    description: Optional[str] = None,
+) -> Dataset:
+    """保存済みのアップロードファイルからデータセットを作成
+    
+    ファイルは受信時に dataset_file_path(dataset_id) へ直接書き込まれている
+    （app/services/upload_receiver.py）。読み込み用のスキーマを推定して保存し、
+    カラム単位のバイナリ形式に一度だけ変換して行数・列数を記録する。
+    途中で失敗した場合はファイル・スキーマ・変換途中のバイナリ形式を削除する。
+    
+    Args:
+        db: データベースセッション
+        user_id: 所有者のユーザーID
+        dataset_id: 作成するデータセットID
+        upload: 受信したファイル
+        name: データセット名（省略時はファイル名）
+        description: 説明
+    
+    Returns:
+        作成されたデータセット
+    """
+    file_path = dataset_file_path(dataset_id)
+    store_dir = dataset_store_dir(dataset_id)
+    created = False
+    try:
+        name = name or upload.filename
+        if not name:
+            raise ValidationException("データセット名またはファイル名を指定してください")
+        
+        new_dataset = Dataset(
+            id=dataset_id,
+            user_id=user_id,
+            name=name,
+            description=description,
+            file_path=file_path,
+            content_hash=upload.content_hash
+        )
+        
+        try:
+            schema = csv_ingest.infer_schema(file_path)
+            csv_ingest.save_schema(
+                dataset_schema_path(dataset_id), {**schema, "committed_bytes": os.path.getsize(file_path)}
+            )
+            if settings.COLUMNAR_STORE_ENABLED:
+                schema = columnar_store.convert_csv(file_path, store_dir, settings.INGEST_CHUNK_SIZE)
+                new_dataset.store_path = store_dir
+                new_dataset.rows = schema["rows"]
+                new_dataset.columns = len(schema["columns"])
+        except (ValueError, pd.errors.ParserError) as e:
+            raise ValidationException(f"CSVファイルを解析できません: {e}")
+        
+        repo = DatasetRepository(db)
+        new_dataset = repo.create(new_dataset)
+        created = True
+        return new_dataset
+    finally:
+        if not created:
+            for path in (file_path, dataset_schema_path(dataset_id)):
+                if os.path.exists(path):
+                    os.remove(path)
+            shutil.rmtree(store_dir, ignore_errors=True)
+            shutil.rmtree(store_dir + ".tmp", ignore_errors=True)
+
+
+def append_dataset_rows(db: Session, dataset_id: str, user_id: str, file: BinaryIO) -> dict:
+    """アップロードされたCSVの行をデータセットの末尾に追加し、プロファイルを増分更新
+    
+    保存済みのプロファイル状態に追記分だけを加えるため、計算時間は追記分の行数に比例する
+    （状態が未保存の初回のみ既存データを一度読み込む）。カラム単位のバイナリ形式には追記分を
+    連結する。保存済みの型で追記できないカラムがある場合はバイナリ形式を破棄し、以降はCSVから読み込む。
+    
+    同じデータセットへの追記はデータセットごとのロックで1件ずつ処理する。CSVファイルには
+    追記分だけをその場で書き足し（既存の内容はコピーしない）、書き終えてから確定済みの
+    バイト数をスキーマに記録して公開する。読み込みはその位置で打ち切るため
+    （app/services/csv_ingest.py）、実行中の読み込みが書き込み途中の行を読むことはない。
+    途中で失敗した追記の残りは確定済みのバイト数まで切り詰める。
+    
+    内容ハッシュは前回のハッシュと追記分のハッシュから計算し直す（追記のたびに全体を読まない）。
+    
+    Args:
+        db: データベースセッション
+        dataset_id: 追記先のデータセットID
+        user_id: 所有者のユーザーID
+        file: 追記する行のCSV（ヘッダは既存のファイルと一致すること）
+    
+    Returns:
+        追記後のデータ全体のプロファイル情報の辞書
+    """
+    dataset = get_dataset_with_file(db, dataset_id, user_id)
+    directory = os.path.dirname(dataset.file_path)
+    with _dataset_lock(dataset.id):
+        # ロックを待つ間に他の追記が反映した内容ハッシュ・保存先を読み直す
+        db.refresh(dataset)
+        schema = get_dataset_schema(dataset)
+        committed = schema.get("committed_bytes", os.path.getsize(dataset.file_path))
+        delta = tempfile.NamedTemporaryFile(dir=directory, prefix=f"{dataset.id}.", suffix=".append", delete=False)
+        try:
+            with delta:
+                delta_hash = _write_upload(file, delta)
+            try:
+                delta_columns = list(pd.read_csv(delta.name, nrows=0).columns)
+            except (ValueError, pd.errors.ParserError) as e:
+                raise ValidationException(f"CSVファイルを解析できません: {e}")
+            if delta_columns != list(pd.read_csv(dataset.file_path, nrows=0).columns):
+                raise ValidationException("追記するCSVのカラムが既存のデータセットと一致しません")
+            
+            if dataset.store_path and os.path.exists(dataset.store_path):
+                make_history_chunks = lambda chunksize: columnar_store.iter_chunks(dataset.store_path, chunksize)
+            else:
+                make_history_chunks = lambda chunksize: csv_ingest.iter_csv_chunks(dataset.file_path, chunksize, schema)
+            state_path = dataset_profile_state_path(dataset.id)
+            state = None
+            if os.path.exists(state_path):
+                with open(state_path, encoding="utf-8") as f:
+                    state = json.load(f)
+            try:
+                profile, state = profile_appended_chunks(
+                    state,
+                    make_history_chunks,
+                    csv_ingest.iter_csv_chunks(delta.name, settings.PROFILING_CHUNK_SIZE, schema),
+                )
+            except (ValueError, pd.errors.ParserError) as e:
+                raise ValidationException(f"CSVファイルを解析できません: {e}")
+            
+            with open(dataset.file_path, "r+b") as out:
+                out.truncate(committed)
+                out.seek(committed)
+                _append_csv_rows(out, delta.name)
+                appended_bytes = out.tell()
+            if dataset.store_path and os.path.exists(dataset.store_path):
+                try:
+                    columnar_store.append_csv(delta.name, dataset.store_path, settings.INGEST_CHUNK_SIZE)
+                except ValueError:
+                    shutil.rmtree(dataset.store_path, ignore_errors=True)
+                    dataset.store_path = None
+            
+            tmp_path = state_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, state_path)
+            csv_ingest.save_schema(dataset_schema_path(dataset.id), {**schema, "committed_bytes": appended_bytes})
+            committed = appended_bytes
+        finally:
+            delta.close()
+            if os.path.exists(delta.name):
+                os.remove(delta.name)
+            if os.path.getsize(dataset.file_path) > committed:
+                os.truncate(dataset.file_path, committed)
+        
+        dataset.content_hash = hashlib.sha256(f"{dataset.content_hash}:{delta_hash}".encode()).hexdigest()
+        dataset.rows = profile["rows"]
+        dataset.columns = profile["columns"]
+        DatasetRepository(db).update(dataset)
+    return profile
+
+
+def get_dataset_with_file(db: Session, dataset_id: str, user_id: str) -> Dataset:
+    """CSVファイルがアップロード済みのデータセットを取得（所有権確認付き）"""
+    repo = DatasetRepository(db)
+    dataset = repo.find_by_id(dataset_id)
+    if not dataset:
+        raise ResourceNotFoundException("Dataset", dataset_id)
+    if dataset.user_id != user_id:
+        raise UnauthorizedAccessException("このデータセットへのアクセス権限がありません")
+    if not dataset.file_path or not os.path.exists(dataset.file_path):
+        raise ValidationException(f"データセットにファイルがアップロードされていません: {dataset_id}")
+    return dataset
+
+
+def load_dataset_frame(dataset: Dataset, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """データセットをDataFrameとして読み込む
+    
+    カラム単位のバイナリ形式に変換済みであればCSVを解析せずに必要なカラムだけを読み込む。
+    それ以外は保存済みのスキーマを使ってCSVを読み込む。文字列カラムは category にしない
+    （プランのステップがカテゴリにない値を代入できるように）。
+    """
+    if dataset.store_path and os.path.exists(dataset.store_path):
+        return columnar_store.load_frame(dataset.store_path, columns)
+    return csv_ingest.read_csv(dataset.file_path, get_dataset_schema(dataset), usecols=columns, categories=False)
+
+
+def get_dataset_schema(dataset: Dataset) -> dict:
+    """データセットの読み込み用スキーマを取得（未保存の場合は推定して保存する）"""
+    path = dataset_schema_path(dataset.id)
+    schema = csv_ingest.load_schema(path)
+    if schema is None:
+        schema = csv_ingest.infer_schema(dataset.file_path)
+        csv_ingest.save_schema(path, schema)
+    return schema
+
+
+@contextmanager
+def _dataset_lock(dataset_id: str) -> Iterator[None]:
+    """データセットごとの排他ロック（ファイルロックのため、別プロセス・別スレッドの間でも有効）"""
+    lock_path = os.path.join(settings.DATA_DIR, "datasets", f"{dataset_id}.lock")
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_upload(file: BinaryIO, out: BinaryIO) -> str:
+    """アップロードされたファイルをチャンク単位で書き込み、内容ハッシュ（SHA-256）を返す"""
+    hasher = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = file.read(settings.UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        hasher.update(chunk)
+        out.write(chunk)
+        size += len(chunk)
+    if size == 0:
+        raise ValidationException("アップロードされたファイルが空です")
+    return hasher.hexdigest()
+
+
+def _append_csv_rows(out: BinaryIO, delta_path: str) -> None:
+    """追記分のCSVのヘッダ行を除いた行を、ファイルの現在位置（確定済みの内容の末尾）に連結"""
+    if out.tell() > 0:
+        out.seek(-1, os.SEEK_CUR)
+        if out.read(1) != b"\n":
+            out.write(b"\n")
+    with open(delta_path, "rb") as delta:
+        delta.readline()
+        shutil.copyfileobj(delta, out)
+
+
+def dataset_file_path(dataset_id: str) -> str:
+    """データセットのCSVファイルの保存先パスを返す"""
+    return os.path.join(settings.DATA_DIR, "datasets", f"{dataset_id}.csv")
+
+
+def dataset_schema_path(dataset_id: str) -> str:
+    """データセットの読み込み用スキーマの保存先パスを返す"""
+    return os.path.join(settings.DATA_DIR, "datasets", f"{dataset_id}.schema.json")
+
+
+def dataset_profile_state_path(dataset_id: str) -> str:
+    """データセットの増分プロファイル用の状態の保存先パスを返す"""
+    return os.path.join(settings.DATA_DIR, "datasets", f"{dataset_id}.profile_state.json")
+
+
+def dataset_store_dir(dataset_id: str) -> str:
+    """データセットのカラム単位バイナリ形式の保存先ディレクトリを返す"""
+    return os.path.join(settings.DATA_DIR, "datasets", dataset_id)
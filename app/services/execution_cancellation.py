@@ -0,0 +1,133 @@
+"""実行の取り消しと実行時間の上限
+
+POST /executions/{id}/cancel は実行履歴の cancel_requested_at を設定するだけで、処理中の実行は
+ワーカー側のスレッド（ExecutionWatcher）が EXECUTION_CANCEL_CHECK_INTERVAL 秒ごとに確認する。
+ワーカーが別プロセス（python -m app.worker）で動いていても、データベース経由で取り消しを伝えられる。
+
+取り消しが要求された場合、またはプランの実行時間の上限（Plan.max_runtime、未設定の場合は
+EXECUTION_MAX_RUNTIME）を超えた場合は stop のイベントをセットする。実行はステップの間で
+これを確認して打ち切り、実行中のステップは sandbox のワーカーごと強制終了する
+（app/services/step_executor.py）。実行は cancelled になり、それまでのステップログは残る。
+
+同じスレッドが EXECUTION_HEARTBEAT_INTERVAL 秒ごとに実行履歴の heartbeat_at を更新する。
+中断を要求した後も、実行が終わって with を抜けるまで更新を続ける。
+ワーカーが停止して更新が途絶えた実行は、別のワーカーが回収する（app/services/execution_queue.py）。
+"""
+import logging
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core.config import settings
+from app.models.execution import Execution
+from app.repositories.execution_repository import ExecutionRepository
+
+logger = logging.getLogger(__name__)
+
+CANCELLED_MESSAGE = "実行が取り消されました"
+
+
+def max_runtime(execution: Execution) -> Optional[float]:
+    """実行に適用する実行時間の上限（秒、上限がなければ None）"""
+    limit = execution.plan.max_runtime or settings.EXECUTION_MAX_RUNTIME
+    return limit if limit and limit > 0 else None
+
+
+class ExecutionWatcher:
+    """実行の取り消し要求と実行時間の上限を監視するスレッド（with で開始・終了する）
+
+    取り消し要求の確認には実行のセッションとは別のセッションを使う（同じデータベースに接続する）。
+    """
+
+    def __init__(self, db: Session, execution: Execution, check_interval: Optional[float] = None):
+        self.execution_id = execution.id
+        self.worker_id = execution.worker_id
+        self.max_runtime = max_runtime(execution)
+        self.check_interval = (
+            settings.EXECUTION_CANCEL_CHECK_INTERVAL if check_interval is None else check_interval
+        )
+        self.heartbeat_interval = settings.EXECUTION_HEARTBEAT_INTERVAL
+        self.stop = threading.Event()
+        # 中断した理由（cancelled: 取り消し要求, timeout: 実行時間の上限）
+        self.reason: Optional[str] = None
+        self._session_factory = sessionmaker(bind=db.get_bind())
+        self._finished = threading.Event()
+        self._deadline: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "ExecutionWatcher":
+        if self.max_runtime is not None:
+            self._deadline = time.monotonic() + self.max_runtime
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name=f"execution-watcher-{self.execution_id[:8]}"
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._finished.set()
+        self._thread.join()
+
+    @property
+    def stopped(self) -> bool:
+        """実行を打ち切る必要があるか"""
+        return self.stop.is_set()
+
+    @property
+    def message(self) -> Optional[str]:
+        """実行履歴に記録するエラーメッセージ"""
+        if self.reason == "timeout":
+            return f"プランの実行時間の上限（{self.max_runtime:g}秒）を超えたため中断しました"
+        if self.reason == "cancelled":
+            return CANCELLED_MESSAGE
+        return None
+
+    def _run(self) -> None:
+        # 中断を要求した後も、実行が終わる（__exit__ が呼ばれる）まで生存の記録は続ける。
+        # 打ち切りはステップの間で行われるため、記録を止めると処理中の実行が回収され、
+        # 別のワーカーが同じ実行を重ねて処理してしまう
+        next_heartbeat = time.monotonic() + self.heartbeat_interval
+        while True:
+            if not self.stop.is_set():
+                if self._deadline is not None and time.monotonic() >= self._deadline:
+                    self._trigger("timeout")
+                elif self._cancel_requested():
+                    self._trigger("cancelled")
+            if self.worker_id is not None and time.monotonic() >= next_heartbeat:
+                self._touch_heartbeat()
+                next_heartbeat = time.monotonic() + self.heartbeat_interval
+            wait = max(next_heartbeat - time.monotonic(), 0.0)
+            if not self.stop.is_set():
+                wait = min(wait, self.check_interval)
+                if self._deadline is not None:
+                    wait = min(wait, max(self._deadline - time.monotonic(), 0.0))
+            if self._finished.wait(wait):
+                return
+
+    def _touch_heartbeat(self) -> None:
+        db = self._session_factory()
+        try:
+            if not ExecutionRepository(db).touch_heartbeat(self.execution_id, self.worker_id):
+                logger.warning("実行 %s は別のワーカーに回収されています", self.execution_id)
+        except SQLAlchemyError:
+            logger.exception("実行の生存を記録できません（%s）", self.execution_id)
+        finally:
+            db.close()
+
+    def _cancel_requested(self) -> bool:
+        db = self._session_factory()
+        try:
+            return ExecutionRepository(db).is_cancel_requested(self.execution_id)
+        except SQLAlchemyError:
+            # 確認に失敗しても実行は続け、次の確認で再試行する
+            logger.exception("実行の取り消し要求を確認できません（%s）", self.execution_id)
+            return False
+        finally:
+            db.close()
+
+    def _trigger(self, reason: str) -> None:
+        self.reason = reason
+        self.stop.set()
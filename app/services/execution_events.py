@@ -0,0 +1,175 @@
+"""実行の進捗イベント
+
+実行中のステップの開始・終了などのイベントを DATA_DIR/executions/<実行ID>.events.jsonl に
+1行1イベントのJSONとして追記する。ワーカーが別プロセス（python -m app.worker）で動いていても
+APIサーバーから読めるよう、キューに登録したCSVデータと同じくファイルで受け渡す。
+
+GET /executions/{id}/events はこのファイルを追いかけて Server-Sent Events として返す
+（データベースへの問い合わせは接続時の1回だけで、GET /executions/{id} のポーリングが不要になる）。
+配信は非同期ジェネレータで行い、待機中はスレッドを占有しない（ファイルの読み込みだけを
+1回ずつスレッドプールで行う）。購読者が多くても同期のエンドポイントのスレッドプールを使い切らない。
+
+イベントの種類:
+    started        実行の開始（total_steps）
+    step_started   ステップの開始（order, name）
+    step_finished  ステップの終了（order, name, status, execution_time, error_message と、
+                   計測できた場合は cpu_time・メモリ使用量・行数・カラム数）
+    progress       チャンク実行の進捗（pass: 何回目のパスか, passes: パスの数, rows: そのパスで処理した行数）
+    finished       実行の終了（status, execution_time, error_message）。最後のイベント
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Optional
+
+from anyio import to_thread
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.exceptions import ResourceNotFoundException, UnauthorizedAccessException, ValidationException
+from app.repositories.execution_repository import ExecutionRepository
+
+# 終了した実行の状態（finished のイベントを書き込んだ後の状態）
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+# 配信時に1回で読み込むイベントのファイルの上限（バイト）
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def events_path(execution_id: str) -> str:
+    """イベントの保存先パスを返す"""
+    return os.path.join(settings.DATA_DIR, "executions", f"{execution_id}.events.jsonl")
+
+
+class ExecutionEventLog:
+    """1回の実行のイベントをファイルに書き込む（EXECUTION_EVENTS_ENABLED が False の場合は何もしない）
+
+    実行を処理し直す場合はファイルを作り直す（読み込み側はファイルが短くなったことで検知する）。
+    append が True の場合は既存のイベントの後に追記する（停止したワーカーの実行を終了させる場合）。
+    """
+
+    def __init__(self, execution_id: str, append: bool = False):
+        self._file = None
+        self._last_id = 0
+        if settings.EXECUTION_EVENTS_ENABLED:
+            path = events_path(execution_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if append and os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    self._last_id = sum(1 for line in f if line.endswith("\n"))
+            self._file = open(path, "a" if append else "w", encoding="utf-8")
+
+    def emit(self, event: str, **data: Any) -> None:
+        """イベントを追記（読み込み側がすぐに読めるよう、1件ごとにフラッシュする）"""
+        if self._file is None:
+            return
+        self._last_id += 1
+        record = {"id": self._last_id, "event": event, "time": time.time(), **data}
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def open_event_stream(
+    db: Session, execution_id: str, user_id: str, last_event_id: int = 0
+) -> AsyncIterator[str]:
+    """実行のイベントを Server-Sent Events の形式で返すイテレータを取得
+
+    終了済みでイベントが保存されていない実行（イベントの導入前の実行など）は、実行履歴から
+    作った finished のイベントだけを返す。
+
+    Args:
+        db: データベースセッション
+        execution_id: 実行ID
+        user_id: ユーザーID（プランの所有者のみ購読できる）
+        last_event_id: 再接続時に受け取り済みの最後のイベントID（Last-Event-ID ヘッダ）
+    """
+    execution = ExecutionRepository(db).find_by_id(execution_id)
+    if not execution:
+        raise ResourceNotFoundException("Execution", execution_id)
+    if execution.plan.user_id != user_id:
+        raise UnauthorizedAccessException("この実行履歴へのアクセス権限がありません")
+    if execution.children:
+        raise ValidationException("一括実行の親にはイベントがありません。子の実行のイベントを購読してください")
+    if not os.path.exists(events_path(execution_id)):
+        if execution.status in FINISHED_STATUSES:
+            record = {
+                "id": last_event_id + 1,
+                "event": "finished",
+                "status": execution.status,
+                "execution_time": execution.execution_time,
+                "error_message": execution.error_message,
+            }
+            return _single_event(format_event(record))
+        if not settings.EXECUTION_EVENTS_ENABLED:
+            raise ValidationException("進捗イベントは有効になっていません（EXECUTION_EVENTS_ENABLED）")
+    return iter_events(execution_id, last_event_id)
+
+
+async def _single_event(message: str) -> AsyncIterator[str]:
+    yield message
+
+
+def _read_from(path: str, offset: int, size: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+async def iter_events(
+    execution_id: str,
+    last_event_id: int = 0,
+    poll_interval: Optional[float] = None,
+    heartbeat_interval: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """イベントのファイルを追いかけ、追記されたイベントを順に返す（finished のイベントで終了）
+
+    ファイルはまだ存在しなくてもよい（pending の実行はワーカーが取得するまで待つ）。新しいイベントがない間は
+    heartbeat_interval 秒ごとにコメント行を返し、プロキシなどに接続を切られないようにする。
+    待機は asyncio.sleep で行い、追記された部分の読み込み（READ_CHUNK_SIZE バイトずつ）だけを
+    スレッドプールで行う。
+    """
+    path = events_path(execution_id)
+    poll_interval = settings.EXECUTION_EVENTS_POLL_INTERVAL if poll_interval is None else poll_interval
+    heartbeat_interval = settings.EXECUTION_EVENTS_HEARTBEAT_INTERVAL if heartbeat_interval is None else heartbeat_interval
+    offset = 0
+    partial = b""
+    last_sent = time.monotonic()
+    while True:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        if size < offset:
+            # 実行が処理し直され、ファイルが作り直された
+            offset, partial, last_event_id = 0, b"", 0
+        if size > offset:
+            chunk = await to_thread.run_sync(_read_from, path, offset, min(size - offset, READ_CHUNK_SIZE))
+            data = partial + chunk
+            offset += len(chunk)
+            *lines, partial = data.split(b"\n")
+            for line in lines:
+                record = json.loads(line)
+                if record["id"] <= last_event_id:
+                    continue
+                last_event_id = record["id"]
+                last_sent = time.monotonic()
+                yield format_event(record)
+                if record["event"] == "finished":
+                    return
+        elif time.monotonic() - last_sent >= heartbeat_interval:
+            last_sent = time.monotonic()
+            yield ": keep-alive\n\n"
+        else:
+            await asyncio.sleep(poll_interval)
+
+
+def format_event(record: dict) -> str:
+    """イベントを Server-Sent Events のメッセージに変換"""
+    data = json.dumps(record, ensure_ascii=False, default=str)
+    return f"id: {record['id']}\nevent: {record['event']}\ndata: {data}\n\n"
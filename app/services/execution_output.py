@@ -0,0 +1,143 @@
+"""実行結果（前処理後のデータ）の保存とダウンロード
+
+実行が完了すると、前処理後のDataFrameを DATA_DIR/executions/<実行ID>.output.<拡張子> に保存し、
+Execution.output_path に記録する。形式は EXECUTION_OUTPUT_FORMAT で選ぶ（csv、または pyarrow が
+インストールされていれば parquet）。チャンク実行の出力は常に CSV。
+
+ダウンロード（GET /executions/{id}/output）はファイルをメモリに読み込まず、チャンク単位で返す。
+Range ヘッダ（単一の範囲）による部分取得と、送信時の gzip 圧縮に対応する。
+
+保存した実行結果は completed の実行にだけ残す。実行の開始時（再実行で以前の試行の結果を
+上書きする場合を含む）と、失敗・中断した実行（停止したワーカーの実行を含む）では、記録前に
+書き出したファイルも含めて remove_output で削除する。completed の実行結果と進捗イベントの
+ファイル（app/services/execution_events.py）は実行履歴と同じ期間保持する（実行履歴を削除する
+処理はないため、不要になったファイルは DATA_DIR/executions から実行IDごとに削除する）。
+"""
+import os
+import zlib
+from typing import Iterator, Optional
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.exceptions import ResourceNotFoundException, UnauthorizedAccessException
+from app.models.execution import Execution
+from app.repositories.execution_repository import ExecutionRepository
+from app.services.csv_ingest import PYARROW_AVAILABLE
+
+OUTPUT_FORMATS = ("csv", "parquet")
+MEDIA_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+
+class RangeNotSatisfiable(Exception):
+    """Range ヘッダの範囲がファイルの外にある"""
+
+
+def output_format() -> str:
+    """保存する形式（parquet は pyarrow がなければ csv にする）"""
+    if settings.EXECUTION_OUTPUT_FORMAT == "parquet" and PYARROW_AVAILABLE:
+        return "parquet"
+    return "csv"
+
+
+def output_path(execution_id: str, fmt: str = "csv") -> str:
+    """実行結果の保存先パスを返す"""
+    return os.path.join(settings.DATA_DIR, "executions", f"{execution_id}.output.{fmt}")
+
+
+def write_output(df: pd.DataFrame, path: str, fmt: str) -> int:
+    """DataFrameを保存し、ファイルサイズを返す（途中で失敗したファイルは残さない）
+
+    ステップ実行バックエンドのワーカー上で呼ばれるため、モジュールレベルの関数にしている。
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".part"
+    try:
+        if fmt == "parquet":
+            df.to_parquet(tmp_path, index=False)
+        else:
+            df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return os.path.getsize(path)
+
+
+def get_output_file(db: Session, execution_id: str, user_id: str) -> tuple[str, str]:
+    """ダウンロードする実行結果のパスと形式を返す（実行結果がなければ ResourceNotFoundException）"""
+    execution = ExecutionRepository(db).find_by_id(execution_id)
+    if not execution:
+        raise ResourceNotFoundException("Execution", execution_id)
+    if execution.plan.user_id != user_id:
+        raise UnauthorizedAccessException("この実行履歴へのアクセス権限がありません")
+    if not execution.output_path or not os.path.isfile(execution.output_path):
+        raise ResourceNotFoundException("Execution output", execution_id)
+    fmt = "parquet" if execution.output_path.endswith(".parquet") else "csv"
+    return execution.output_path, fmt
+
+
+def remove_output(execution: Execution) -> None:
+    """保存した実行結果を削除（output_path に記録する前に失敗した実行が書き出したファイルも削除する）"""
+    paths = {output_path(execution.id, fmt) for fmt in OUTPUT_FORMATS}
+    if execution.output_path:
+        paths.add(execution.output_path)
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+    execution.output_path = None
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """Range ヘッダを (開始位置, 終了位置（含む）) に変換
+
+    ヘッダがない、単一のバイト範囲でない（複数の範囲など）、または終了位置が開始位置より前の
+    （構文として無効な）場合は None を返し、ファイル全体を返す。
+    開始位置がファイルの外にある場合は RangeNotSatisfiable。
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, sep, end_text = header[len("bytes="):].strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if start_text == "":
+            # 末尾の n バイト
+            length = int(end_text)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else None
+    except ValueError:
+        return None
+    if end is not None and end < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, size - 1 if end is None else min(end, size - 1)
+
+
+def iter_file(path: str, start: int, end: int, chunk_size: Optional[int] = None) -> Iterator[bytes]:
+    """ファイルの start から end（含む）までをチャンク単位で返す"""
+    chunk_size = chunk_size or settings.EXECUTION_OUTPUT_CHUNK_SIZE
+    remaining = end - start + 1
+    with open(path, "rb") as f:
+        f.seek(start)
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def iter_gzip(path: str, chunk_size: Optional[int] = None) -> Iterator[bytes]:
+    """ファイル全体を gzip 形式で圧縮しながらチャンク単位で返す"""
+    compressor = zlib.compressobj(settings.EXECUTION_OUTPUT_GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in iter_file(path, 0, os.path.getsize(path) - 1, chunk_size):
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,257 @@
+"""プラン実行キューのワーカー
+
+POST /plans/{plan_id}/execute は pending の実行履歴を作成するだけで、処理はワーカーが行う。
+ワーカーはデータベースから pending の実行を条件付きUPDATEで1件ずつ取得するため、
+アプリ内のワーカースレッドと、別プロセスのワーカー（python -m app.worker）を同時に動かせる。
+一括実行の子は通常の実行の後に取得し、1つの一括実行で同時に処理する子は
+EXECUTION_BATCH_MAX_CONCURRENCY 件までにする（大きな一括実行がワーカーを占有しないように）。
+
+ワーカーが処理の途中で停止した（プロセスが終了した、ホストが落ちた）実行は running のまま残るため、
+各ワーカーが EXECUTION_SWEEP_INTERVAL 秒ごとに回収する（sweep_stale_executions）。
+回収した実行は取得した回数が EXECUTION_MAX_ATTEMPTS 未満なら pending に戻し、そうでなければ failed にする。
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.execution import Execution
+from app.repositories.execution_repository import ExecutionRepository
+from app.services import execution_events, execution_output, step_executor
+from app.services.execution_cancellation import CANCELLED_MESSAGE
+from app.services.execution_service import run_execution, update_batch_parent
+
+logger = logging.getLogger(__name__)
+
+# ワーカーID（ホスト名:プロセスID:プロセスごとのトークン:スレッド名）のトークン。
+# プロセスIDが再利用された場合も、以前のプロセスのワーカーと区別できる
+_PROCESS_TOKEN = uuid.uuid4().hex[:12]
+
+# このプロセスのワーカーが処理中の実行（ワーカーID → 実行ID、取得中は None）
+_active_claims: dict[str, Optional[str]] = {}
+_claims_lock = threading.Lock()
+
+_sweep_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+class ExecutionWorker(threading.Thread):
+    """pending の実行を取得して処理するワーカースレッド"""
+
+    def __init__(self, name: str, wakeup: threading.Event, stop: threading.Event, poll_interval: float):
+        super().__init__(name=name, daemon=True)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{_PROCESS_TOKEN}:{name}"
+        self._wakeup = wakeup
+        self._stop_event = stop
+        self.poll_interval = poll_interval
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                maybe_sweep()
+            except Exception:
+                logger.exception("停止したワーカーの実行を回収できません（%s）", self.worker_id)
+            try:
+                processed = self.process_next()
+            except Exception:
+                logger.exception("実行キューの処理に失敗しました（%s）", self.worker_id)
+                processed = False
+            if not processed:
+                # 新しい実行の登録（notify）か、ポーリング間隔の経過まで待つ
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def process_next(self) -> bool:
+        """pending の実行を1件処理（なければ False）"""
+        db = SessionLocal()
+        # 取得をコミットしてから記録するまでの間に、回収の対象にならないようにする
+        with _claims_lock:
+            _active_claims[self.worker_id] = None
+        try:
+            execution = ExecutionRepository(db).claim_next_pending(
+                self.worker_id, settings.EXECUTION_BATCH_MAX_CONCURRENCY
+            )
+            if execution is None:
+                return False
+            with _claims_lock:
+                _active_claims[self.worker_id] = execution.id
+            execution = run_execution(db, execution)
+            if execution.parent_id:
+                update_batch_parent(db, execution.parent_id)
+            return True
+        finally:
+            with _claims_lock:
+                _active_claims.pop(self.worker_id, None)
+            db.close()
+
+
+def _worker_is_dead(execution: Execution) -> Optional[bool]:
+    """実行を取得したワーカーが停止しているか（判断できない場合は None）
+
+    同じホストのワーカーについてだけ、プロセスの有無とこのプロセスのワーカーの処理状況で判断する。
+    """
+    parts = (execution.worker_id or "").split(":", 3)
+    if len(parts) != 4 or parts[0] != socket.gethostname():
+        return None
+    _, pid, token, _ = parts
+    if token == _PROCESS_TOKEN:
+        with _claims_lock:
+            return execution.worker_id not in _active_claims or _active_claims[execution.worker_id] not in (
+                None, execution.id
+            )
+    try:
+        pid = int(pid)
+    except ValueError:
+        return None
+    if pid == os.getpid():
+        # 同じプロセスIDの以前のプロセス
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return None
+    return None
+
+
+def _is_stale(execution: Execution, now: datetime) -> bool:
+    """生存の記録が EXECUTION_STALE_TIMEOUT 秒以上途絶えているか"""
+    if settings.EXECUTION_STALE_TIMEOUT <= 0:
+        return False
+    last_seen = execution.heartbeat_at or execution.started_at
+    if last_seen is None:
+        return True
+    return now - last_seen.replace(tzinfo=None) > timedelta(seconds=settings.EXECUTION_STALE_TIMEOUT)
+
+
+def sweep_stale_executions(db: Session) -> int:
+    """停止したワーカーが取得したまま running で残っている実行を回収し、回収した件数を返す
+
+    同じホストでプロセスが終了しているワーカーの実行と、生存の記録（heartbeat_at）が
+    EXECUTION_STALE_TIMEOUT 秒以上途絶えている実行が対象。取得した回数が EXECUTION_MAX_ATTEMPTS 未満なら
+    pending に戻し（途中までのステップログは削除する）、そうでなければ failed にする
+    （取り消しが要求されていれば cancelled）。複数のワーカーが同時に回収しても、
+    条件付きUPDATEにより1回だけ反映される。
+    """
+    exec_repo = ExecutionRepository(db)
+    now = datetime.utcnow()
+    swept = 0
+    for execution in exec_repo.find_running():
+        dead = _worker_is_dead(execution)
+        if dead is False or (dead is None and not _is_stale(execution, now)):
+            continue
+        execution_id, worker_id, parent_id = execution.id, execution.worker_id, execution.parent_id
+        if execution.cancel_requested_at is None and (execution.attempts or 0) < settings.EXECUTION_MAX_ATTEMPTS:
+            if exec_repo.requeue_claim(execution_id, worker_id):
+                logger.warning("停止したワーカー（%s）の実行 %s を pending に戻しました", worker_id, execution_id)
+                swept += 1
+            continue
+        if execution.cancel_requested_at is not None:
+            status, message = "cancelled", CANCELLED_MESSAGE
+        else:
+            status, message = "failed", "実行を処理していたワーカーが停止しました"
+        if not exec_repo.finish_claim(execution_id, worker_id, status, message):
+            continue
+        logger.warning("停止したワーカー（%s）の実行 %s を %s にしました", worker_id, execution_id, status)
+        swept += 1
+        input_path = execution.input_path
+        if input_path and os.path.exists(input_path):
+            os.remove(input_path)
+        # 停止したワーカーが記録前に書き出した実行結果を残さない
+        execution_output.remove_output(execution)
+        events = execution_events.ExecutionEventLog(execution_id, append=True)
+        events.emit("finished", status=status, execution_time=None, error_message=message)
+        events.close()
+        if parent_id:
+            update_batch_parent(db, parent_id)
+    return swept
+
+
+def maybe_sweep() -> int:
+    """前回から EXECUTION_SWEEP_INTERVAL 秒経過していれば sweep_stale_executions を実行（プロセス内で1つだけ）"""
+    global _last_sweep
+    if settings.EXECUTION_SWEEP_INTERVAL <= 0 or time.monotonic() - _last_sweep < settings.EXECUTION_SWEEP_INTERVAL:
+        return 0
+    if not _sweep_lock.acquire(blocking=False):
+        return 0
+    try:
+        _last_sweep = time.monotonic()
+        db = SessionLocal()
+        try:
+            return sweep_stale_executions(db)
+        finally:
+            db.close()
+    finally:
+        _sweep_lock.release()
+
+
+class ExecutionWorkerPool:
+    """ワーカースレッドのプール"""
+
+    def __init__(self, workers: int, poll_interval: float):
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self.workers = [
+            ExecutionWorker(f"execution-worker-{i}", self._wakeup, self._stop_event, poll_interval)
+            for i in range(workers)
+        ]
+
+    def start(self) -> None:
+        for worker in self.workers:
+            worker.start()
+
+    def notify(self) -> None:
+        """待機中のワーカーを起こす"""
+        self._wakeup.set()
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """ワーカーを停止（処理中の実行は完了まで待つ）"""
+        self._stop_event.set()
+        self._wakeup.set()
+        for worker in self.workers:
+            worker.join(timeout)
+
+
+_pool: Optional[ExecutionWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def start_workers(workers: Optional[int] = None) -> Optional[ExecutionWorkerPool]:
+    """設定に基づくアプリ内のワーカーを起動（0以下の場合は起動しない）
+
+    ステップ実行用のワーカープロセス（app/services/step_executor.py）も合わせて事前に起動する。
+    """
+    global _pool
+    workers = settings.EXECUTION_WORKERS if workers is None else workers
+    with _pool_lock:
+        if _pool is None and workers > 0:
+            step_executor.start_pool()
+            _pool = ExecutionWorkerPool(workers, settings.EXECUTION_POLL_INTERVAL)
+            _pool.start()
+        return _pool
+
+
+def notify_workers() -> None:
+    """新しい実行が登録されたことをアプリ内のワーカーに通知"""
+    with _pool_lock:
+        if _pool is not None:
+            _pool.notify()
+
+
+def shutdown_workers(timeout: Optional[float] = None) -> None:
+    """アプリ内のワーカーとステップ実行用のワーカープロセスを停止"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(timeout)
+    step_executor.shutdown_pool()
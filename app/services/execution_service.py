@@ -1,131 +1,1033 @@
 """実行サービス"""
+import hashlib
+import io
 import json
+import logging
+import os
 import time
 import uuid
 from datetime import datetime
-from typing import Optional
+from typing import Callable, Iterator, Optional
 from sqlalchemy.orm import Session
+import numpy as np
 import pandas as pd
-from io import StringIO
 
+from app.core.code_cache import compile_step
+from app.core.config import settings
+from app.models.dataset import Dataset
 from app.models.execution import Execution, ExecutionStepLog
 from app.models.plan import Plan
 from app.repositories.execution_repository import ExecutionRepository
 from app.repositories.plan_repository import PlanRepository
-from app.exceptions import ResourceNotFoundException
+from app.repositories.dataset_repository import DatasetRepository
+from app.schemas.plan_operation import validate_operation
+from app.services.dataset_service import get_dataset_schema, get_dataset_with_file, load_dataset_frame
+from app.services import (
+    columnar_store,
+    csv_ingest,
+    execution_cancellation,
+    execution_events,
+    execution_output,
+    step_cache,
+    step_dependencies,
+    step_executor,
+    streaming_execution,
+)
+from app.exceptions import ResourceNotFoundException, UnauthorizedAccessException, ValidationException
+
+logger = logging.getLogger(__name__)
+
+# 実行モード（app/services/streaming_execution.py）
+EXECUTION_MODES = ("auto", "memory", "stream")
+# プレビューで実行する行の選び方
+PREVIEW_SAMPLES = ("head", "random")
 
 
 def generate_data_summary(df: pd.DataFrame) -> dict:
     """データフレームのサマリを生成"""
+    return summarize_columns(df)[0]
+
+
+def summarize_columns(
+    df: pd.DataFrame,
+    previous_summary: Optional[dict] = None,
+    previous_fingerprints: Optional[dict] = None,
+) -> tuple[dict, dict]:
+    """データフレームのサマリと、カラムごとのフィンガープリントを生成
+    
+    以前のサマリとフィンガープリントを渡した場合、フィンガープリント（型・行数・値のハッシュ）が
+    一致するカラムは以前の統計量を再利用し、変更されたカラムだけをまとめて計算する。
+    
+    Returns:
+        (サマリ, カラム名 -> フィンガープリント)
+    """
+    fingerprints = {col: _column_fingerprint(df[col]) for col in df.columns}
+    previous_info = (previous_summary or {}).get("column_info", {})
+    reused = {
+        col for col, fingerprint in fingerprints.items()
+        if fingerprint is not None
+        and previous_fingerprints is not None
+        and previous_fingerprints.get(col) == fingerprint
+        and col in previous_info
+    }
+    changed = [col for col in df.columns if col not in reused]
+    
+    column_info = _summarize_columns(df[changed]) if changed else {}
     summary = {
         "rows": len(df),
         "columns": len(df.columns),
-        "missing_values": int(df.isnull().sum().sum()),
+        "missing_values": 0,
         "column_info": {}
     }
+    for col in df.columns:
+        summary["column_info"][col] = previous_info[col] if col in reused else column_info[col]
+        summary["missing_values"] += summary["column_info"][col]["missing"]
+    return summary, fingerprints
+
+
+def generate_after_summary(df: pd.DataFrame, before_summary: dict, before_fingerprints: dict) -> dict:
+    """実行後のサマリを生成（変更されていないカラムは実行前のサマリを再利用）
     
+    ステップ実行バックエンドのワーカー上で呼ばれるため、モジュールレベルの関数にしている。
+    """
+    return summarize_columns(df, before_summary, before_fingerprints)[0]
+
+
+def _summarize_columns(df: pd.DataFrame) -> dict:
+    """カラムごとの統計量をまとめて計算"""
+    missing = df.isna().sum()
+    unique = df.nunique()
+    numeric_cols = [col for col in df.columns if pd.api.types.is_numeric_dtype(df[col])]
+    stats = df[numeric_cols].agg(["mean", "std", "min", "max"]) if numeric_cols else None
+    
+    column_info = {}
     for col in df.columns:
         col_info = {
             "dtype": str(df[col].dtype),
-            "missing": int(df[col].isnull().sum()),
-            "unique": int(df[col].nunique())
+            "missing": int(missing[col]),
+            "unique": int(unique[col])
         }
         
         # 数値列の場合は統計情報を追加
-        if pd.api.types.is_numeric_dtype(df[col]):
-            col_info["mean"] = float(df[col].mean()) if not df[col].isnull().all() else None
-            col_info["std"] = float(df[col].std()) if not df[col].isnull().all() else None
-            col_info["min"] = float(df[col].min()) if not df[col].isnull().all() else None
-            col_info["max"] = float(df[col].max()) if not df[col].isnull().all() else None
+        if col in numeric_cols:
+            all_missing = missing[col] == len(df)
+            for stat in ("mean", "std", "min", "max"):
+                col_info[stat] = None if all_missing else float(stats.at[stat, col])
         
-        summary["column_info"][col] = col_info
-    
-    return summary
+        column_info[col] = col_info
+    return column_info
+
+
+def _column_fingerprint(series: pd.Series) -> Optional[str]:
+    """カラムの型・行数・値のハッシュ（ハッシュできない値を含む場合は None）"""
+    try:
+        hashed = pd.util.hash_pandas_object(series, index=False).to_numpy()
+    except TypeError:
+        return None
+    return f"{series.dtype}:{len(series)}:{int(hashed.sum(dtype='uint64')):016x}"
 
 
-def execute_plan(db: Session, plan_id: str, user_id: str, csv_data: Optional[str] = None) -> Execution:
-    """プランを実行
+def execute_plan(
+    db: Session,
+    plan_id: str,
+    user_id: str,
+    csv_data: Optional[str] = None,
+    dataset_id: Optional[str] = None,
+    mode: str = "auto",
+) -> Execution:
+    """プランを同期的に実行（キューに登録してすぐにこのスレッドで実行する）
     
     Args:
         db: データベースセッション
         plan_id: 実行するプランのID
         user_id: 実行ユーザーのID
-        csv_data: CSVデータ（文字列形式）。Noneの場合はサンプルデータを使用
+        csv_data: CSVデータ（文字列形式）
+        dataset_id: アップロード済みデータセットのID。
+            csv_data と dataset_id のどちらもNoneの場合はサンプルデータを使用
+        mode: 実行モード（auto, memory, stream）
     
     Returns:
         実行履歴
     """
-    plan_repo = PlanRepository(db)
+    execution = enqueue_execution(db, plan_id, user_id, csv_data, dataset_id, mode)
+    execution.status = "running"
+    execution.started_at = datetime.utcnow()
+    ExecutionRepository(db).update(execution)
+    return run_execution(db, execution)
+
+
+def enqueue_execution(
+    db: Session,
+    plan_id: str,
+    user_id: str,
+    csv_data: Optional[str] = None,
+    dataset_id: Optional[str] = None,
+    mode: str = "auto",
+) -> Execution:
+    """プランの実行をキューに登録（pending の実行履歴を作成）
+    
+    csv_data はワーカーが読み込めるようにディスクに保存する。
+    実際の処理はワーカー（app/services/execution_queue.py）が run_execution で行う。
+    
+    Args:
+        db: データベースセッション
+        plan_id: 実行するプランのID
+        user_id: 実行ユーザーのID
+        csv_data: CSVデータ（文字列形式）
+        dataset_id: アップロード済みデータセットのID。
+            csv_data と dataset_id のどちらもNoneの場合はサンプルデータを使用
+        mode: 実行モード。auto は入力ファイルが EXECUTION_STREAM_MIN_BYTES 以上で、
+            すべてのステップがチャンク実行できる場合にチャンク実行する。
+            stream はチャンク実行できないステップがあれば 400 エラーにする
+    
+    Returns:
+        pending の実行履歴
+    """
+    _get_executable_plan(db, plan_id, user_id, mode)
     exec_repo = ExecutionRepository(db)
     
-    # プランの取得と権限確認
-    plan = plan_repo.find_by_id_and_user(plan_id, user_id)
-    if not plan:
-        raise ResourceNotFoundException("Plan", plan_id)
+    if dataset_id:
+        get_dataset_with_file(db, dataset_id, user_id)
     
-    # 実行履歴を作成
     execution = Execution(
         id=str(uuid.uuid4()),
         plan_id=plan_id,
-        status="running"
+        status="pending",
+        dataset_id=dataset_id or None,
+        mode=mode
     )
-    exec_repo.create(execution)
+    if csv_data and not dataset_id:
+        execution.input_path = execution_input_path(execution.id)
+        os.makedirs(os.path.dirname(execution.input_path), exist_ok=True)
+        with open(execution.input_path, "w", encoding="utf-8") as f:
+            f.write(csv_data)
+    return exec_repo.create(execution)
+
+
+def preview_plan(
+    db: Session,
+    plan_id: str,
+    user_id: str,
+    csv_data: Optional[str] = None,
+    dataset_id: Optional[str] = None,
+    rows: Optional[int] = None,
+    sample: str = "head",
+    seed: Optional[int] = None,
+) -> dict:
+    """入力の一部の行だけでプランを同期的に実行（プレビュー）
     
-    # データフレームを準備
-    if csv_data:
-        df = pd.read_csv(StringIO(csv_data))
-    else:
-        # サンプルデータを生成
+    実行履歴・ステップログ・中間結果キャッシュ・実行結果は保存しない。ステップは
+    プレビュー用のワーカー（app/services/step_executor.py の open_executor(preview=True)）で
+    プランの順に実行し、失敗したステップで打ち切る。
+    
+    Args:
+        db: データベースセッション
+        plan_id: 実行するプランのID
+        user_id: 実行ユーザーのID
+        csv_data: CSVデータ（文字列形式）
+        dataset_id: アップロード済みデータセットのID。
+            csv_data と dataset_id のどちらもNoneの場合はサンプルデータを使用
+        rows: 実行する行数（省略時は EXECUTION_PREVIEW_ROWS）
+        sample: head は先頭の行、random は入力全体から一様にランダムに選んだ行（元の順序を保つ）
+        seed: random の乱数のシード
+    
+    Returns:
+        PlanPreviewResponse に対応する辞書
+    """
+    rows = settings.EXECUTION_PREVIEW_ROWS if rows is None else rows
+    if not 1 <= rows <= settings.EXECUTION_PREVIEW_MAX_ROWS:
+        raise ValidationException(
+            f"プレビューの行数は1以上 {settings.EXECUTION_PREVIEW_MAX_ROWS} 以下で指定してください: {rows}"
+        )
+    if sample not in PREVIEW_SAMPLES:
+        raise ValidationException(f"不正なサンプリング方法です: {sample}（{', '.join(PREVIEW_SAMPLES)} のいずれか）")
+    plan = _get_executable_plan(db, plan_id, user_id, "memory")
+    steps = list(plan.steps)
+    dataset = get_dataset_with_file(db, dataset_id, user_id) if dataset_id else None
+    
+    start_time = time.time()
+    df, total_rows = _load_preview_input(dataset, csv_data, rows, sample, np.random.default_rng(seed))
+    preview = {
+        "plan_id": plan_id,
+        "status": "completed",
+        "sample": sample,
+        "rows": len(df),
+        "total_rows": total_rows,
+        "step_results": [],
+        "total_steps": len(steps),
+        "columns": [],
+        "head": [],
+        "error_message": None,
+    }
+    with step_executor.open_executor(preview=True) as executor:
+        executor.load(df)
+        del df
+        for step in steps:
+            step_start_time = time.time()
+            status, error_message, metrics = executor.run_step(step.source)
+            result = {
+                "order": step.order,
+                "name": step.name,
+                "status": status,
+                "execution_time": time.time() - step_start_time,
+                "error_message": error_message,
+            }
+            for axis in ("rows", "columns"):
+                before, after = metrics.get(f"{axis}_before"), metrics.get(f"{axis}_after")
+                result[f"{axis}_before"], result[f"{axis}_after"] = before, after
+                result[f"{axis}_delta"] = after - before if before is not None and after is not None else None
+            preview["step_results"].append(result)
+            if status == "failed":
+                preview["status"] = "failed"
+                preview["error_message"] = f"ステップ {step.order}（{step.name}）が失敗しました: {error_message}"
+                break
+        # ワーカーが強制終了された場合はデータが失われているため先頭の行は返さない
+        if executor.alive:
+            preview["columns"], preview["head"] = executor.call(preview_head, settings.EXECUTION_PREVIEW_HEAD_ROWS)
+    preview["execution_time"] = time.time() - start_time
+    return preview
+
+
+def preview_head(df: pd.DataFrame, n: int) -> tuple[list[str], list[list]]:
+    """DataFrameの先頭 n 行をJSONに変換できる値で返す（欠損値は None、日時は ISO 形式）
+    
+    ステップ実行バックエンドのワーカー上で呼ばれるため、モジュールレベルの関数にしている。
+    """
+    if df is None:
+        return [], []
+    split = json.loads(df.head(n).to_json(orient="split", index=False, date_format="iso"))
+    return [str(col) for col in split["columns"]], split["data"]
+
+
+def _load_preview_input(
+    dataset: Optional[Dataset], csv_data: Optional[str], rows: int, sample: str, rng: np.random.Generator
+) -> tuple[pd.DataFrame, Optional[int]]:
+    """プレビューの入力を読み込む（読み込んだDataFrameと入力全体の行数）
+    
+    head はカラム単位のバイナリ形式から必要な範囲だけ、またはCSVの先頭の行だけを読み込む。
+    random はカラム単位のバイナリ形式であれば選んだ行だけを読み込み、CSVは1回走査して選ぶ。
+    """
+    if dataset is not None and dataset.store_path and os.path.exists(dataset.store_path):
+        total_rows = columnar_store.read_schema(dataset.store_path)["rows"]
+        if sample == "head":
+            return columnar_store.load_rows(dataset.store_path, slice(0, rows)), total_rows
+        return columnar_store.load_rows(dataset.store_path, _sample_positions(total_rows, rows, rng)), total_rows
+    if dataset is None and not csv_data:
         df = _generate_sample_data()
+        if sample == "head":
+            return df.head(rows), len(df)
+        return df.iloc[_sample_positions(len(df), rows, rng)].reset_index(drop=True), len(df)
+    if dataset is not None:
+        source, schema = dataset.file_path, get_dataset_schema(dataset)
+    else:
+        source = io.StringIO(csv_data)
+        schema = csv_ingest.infer_schema(source)
+    if sample == "head":
+        return csv_ingest.read_csv(source, schema, categories=False, nrows=rows), None
+    return _sample_csv_rows(source, schema, rows, rng)
+
+
+def _sample_positions(total_rows: int, rows: int, rng: np.random.Generator) -> np.ndarray:
+    """total_rows 行から rows 行を非復元抽出した位置（昇順）"""
+    return np.sort(rng.choice(total_rows, size=min(rows, total_rows), replace=False))
+
+
+def _sample_csv_rows(
+    source: csv_ingest.CsvSource, schema: dict, rows: int, rng: np.random.Generator
+) -> tuple[pd.DataFrame, int]:
+    """CSVをチャンク単位で1回走査し、rows 行を一様にランダムに選ぶ
     
-    # Before サマリを記録
-    before_summary = generate_data_summary(df)
-    execution.before_summary_json = json.dumps(before_summary, ensure_ascii=False)
+    各行に乱数のキーを付け、キーが小さい rows 行だけを保持する（メモリ使用量は rows 行とチャンク1つ分）。
+    """
+    kept: Optional[pd.DataFrame] = None
+    kept_keys = np.empty(0)
+    total_rows = 0
+    for chunk in csv_ingest.iter_csv_chunks(source, settings.EXECUTION_STREAM_CHUNK_SIZE, schema):
+        chunk.index = pd.RangeIndex(total_rows, total_rows + len(chunk))
+        total_rows += len(chunk)
+        frame = chunk if kept is None else pd.concat([kept, chunk])
+        keys = np.concatenate([kept_keys, rng.random(len(chunk))])
+        if len(frame) > rows:
+            # 元の行の順序を保つため、選んだ位置を昇順に並べる
+            selected = np.sort(np.argpartition(keys, rows - 1)[:rows])
+            frame, keys = frame.iloc[selected], keys[selected]
+        kept, kept_keys = frame, keys
+    if kept is None:
+        return csv_ingest.read_csv(source, schema, categories=False, nrows=0), 0
+    return kept.reset_index(drop=True), total_rows
+
+
+def enqueue_batch_execution(
+    db: Session,
+    plan_id: str,
+    user_id: str,
+    dataset_ids: Optional[list[str]] = None,
+    file_paths: Optional[list[str]] = None,
+    mode: str = "auto",
+) -> Execution:
+    """1つのプランを複数の入力に対して実行するようキューに登録
     
-    total_start_time = time.time()
-    error_occurred = False
+    親の実行履歴（status: running）と、入力ごとの子の実行履歴（status: pending）を
+    1つのトランザクションで作成する。子の実行はワーカーが並列に処理し、最後の子の実行が
+    終わった時点で親の実行履歴を完了にする（update_batch_parent）。
+    
+    Args:
+        db: データベースセッション
+        plan_id: 実行するプランのID
+        user_id: 実行ユーザーのID
+        dataset_ids: アップロード済みデータセットのIDのリスト
+        file_paths: サーバー上のCSVファイルのパスのリスト（EXECUTION_BATCH_INPUT_DIR 配下のみ）
+        mode: 実行モード（auto, memory, stream）
+    
+    Returns:
+        親の実行履歴
+    """
+    dataset_ids = dataset_ids or []
+    file_paths = file_paths or []
+    _get_executable_plan(db, plan_id, user_id, mode)
+    total = len(dataset_ids) + len(file_paths)
+    if total == 0:
+        raise ValidationException("dataset_ids または file_paths を指定してください")
+    if total > settings.EXECUTION_BATCH_MAX_INPUTS:
+        raise ValidationException(f"一度に実行できる入力は {settings.EXECUTION_BATCH_MAX_INPUTS} 件までです")
+    
+    for dataset_id in dataset_ids:
+        get_dataset_with_file(db, dataset_id, user_id)
+    source_paths = [_resolve_batch_file(path) for path in file_paths]
     
-    # 各ステップを実行
+    parent = Execution(
+        id=str(uuid.uuid4()),
+        plan_id=plan_id,
+        status="running",
+        mode=mode,
+        started_at=datetime.utcnow()
+    )
+    children = [
+        Execution(id=str(uuid.uuid4()), plan_id=plan_id, status="pending", mode=mode,
+                  parent_id=parent.id, dataset_id=dataset_id)
+        for dataset_id in dataset_ids
+    ] + [
+        Execution(id=str(uuid.uuid4()), plan_id=plan_id, status="pending", mode=mode,
+                  parent_id=parent.id, source_path=source_path)
+        for source_path in source_paths
+    ]
+    return ExecutionRepository(db).create_batch(parent, children)
+
+
+def update_batch_parent(db: Session, parent_id: str) -> Optional[Execution]:
+    """すべての子の実行が終わっていれば一括実行の親を完了にする
+    
+    子の実行の完了をコミットした後に呼ぶため、並列に終わった子のうち少なくとも最後の1つは
+    すべての子の完了を確認できる（複数回呼ばれても結果は同じ）。
+    """
+    exec_repo = ExecutionRepository(db)
+    parent = exec_repo.find_by_id(parent_id)
+    if parent is None:
+        return None
+    counts = exec_repo.count_children_by_status(parent_id)
+    if counts.get("pending", 0) or counts.get("running", 0):
+        return parent
+    failed = counts.get("failed", 0)
+    cancelled = counts.get("cancelled", 0)
+    if parent.cancel_requested_at is not None:
+        parent.status = "cancelled"
+    else:
+        parent.status = "failed" if failed else "completed"
+    messages = []
+    if failed:
+        messages.append(f"{failed}件の入力の処理に失敗しました")
+    if cancelled:
+        messages.append(f"{cancelled}件の入力の処理を取り消しました")
+    parent.error_message = "、".join(messages) or None
+    parent.completed_at = datetime.utcnow()
+    if parent.started_at is not None:
+        parent.execution_time = (parent.completed_at - parent.started_at.replace(tzinfo=None)).total_seconds()
+    return exec_repo.update(parent)
+
+
+def get_batch_progress(execution: Execution) -> Optional[dict]:
+    """一括実行の親について、子の実行の集計と入力ごとの結果を返す（親でなければ None）"""
+    children = execution.children
+    if not children:
+        return None
+    statuses = [child.status for child in children]
+    results = []
+    rows = 0
+    for child in children:
+        child_rows = json.loads(child.before_summary_json)["rows"] if child.before_summary_json else None
+        if child.status == "completed" and child_rows is not None:
+            rows += child_rows
+        results.append({
+            "execution_id": child.id,
+            "dataset_id": child.dataset_id,
+            "file_path": child.source_path,
+            "status": child.status,
+            "rows": child_rows,
+            "execution_time": child.execution_time,
+            "error_message": child.error_message,
+        })
+    
+    elapsed = None
+    if execution.started_at is not None:
+        end = execution.completed_at or datetime.utcnow()
+        elapsed = (end.replace(tzinfo=None) - execution.started_at.replace(tzinfo=None)).total_seconds()
+    finished = statuses.count("completed") + statuses.count("failed") + statuses.count("cancelled")
+    return {
+        "total": len(children),
+        "pending": statuses.count("pending"),
+        "running": statuses.count("running"),
+        "completed": statuses.count("completed"),
+        "failed": statuses.count("failed"),
+        "cancelled": statuses.count("cancelled"),
+        "rows": rows,
+        "elapsed_seconds": elapsed,
+        "rows_per_second": rows / elapsed if elapsed else None,
+        "files_per_second": finished / elapsed if elapsed else None,
+        "results": results,
+    }
+
+
+def _get_executable_plan(db: Session, plan_id: str, user_id: str, mode: str) -> Plan:
+    """実行をキューに登録する前にプランの権限・ステップ・実行モードを確認"""
+    if mode not in EXECUTION_MODES:
+        raise ValidationException(f"不正な実行モードです: {mode}（{', '.join(EXECUTION_MODES)} のいずれか）")
+    plan_repo = PlanRepository(db)
+    
+    # プランの取得と権限確認
+    plan = plan_repo.find_by_id_and_user(plan_id, user_id)
+    if not plan:
+        raise ResourceNotFoundException("Plan", plan_id)
+    
+    # 不正な操作・構文エラーのステップがあれば入力データを読み込む前に拒否する
+    # （ステップを保存する処理はなく、保存時には検査しないため、ここが唯一の検査になる）
     for step in plan.steps:
-        step_start_time = time.time()
-        step_log = ExecutionStepLog(
-            id=str(uuid.uuid4()),
-            execution_id=execution.id,
-            step_order=step.order,
-            step_name=step.name,
-            status="running"
+        if step.source is None:
+            raise ValidationException(f"ステップ {step.order}（{step.name}）にコードも操作も指定されていません")
+        if step.operation is not None:
+            try:
+                validate_operation(step.operation)
+            except ValueError as e:
+                raise ValidationException(f"ステップ {step.order}（{step.name}）の操作が不正です: {e}")
+            continue
+        try:
+            compile_step(step.code_snippet)
+        except SyntaxError as e:
+            raise ValidationException(
+                f"ステップ {step.order}（{step.name}）のコードに構文エラーがあります（{e.lineno}行目）: {e.msg}"
+            )
+    
+    if mode == "stream":
+        _, unsupported = streaming_execution.analyze_plan([step.source for step in plan.steps])
+        if unsupported:
+            names = "、".join(f"{plan.steps[i].order}（{plan.steps[i].name}）" for i in unsupported)
+            raise ValidationException(f"チャンク実行できないステップがあります: {names}")
+    return plan
+
+
+def _resolve_batch_file(path: str) -> str:
+    """一括実行で指定されたファイルのパスを検証して絶対パスを返す"""
+    if not settings.EXECUTION_BATCH_INPUT_DIR:
+        raise ValidationException("ファイルパスによる入力の指定は有効になっていません（EXECUTION_BATCH_INPUT_DIR）")
+    base_dir = os.path.realpath(settings.EXECUTION_BATCH_INPUT_DIR)
+    resolved = os.path.realpath(os.path.join(base_dir, path))
+    if os.path.commonpath([base_dir, resolved]) != base_dir:
+        raise ValidationException(f"入力ディレクトリ外のファイルは指定できません: {path}")
+    if not os.path.isfile(resolved):
+        raise ValidationException(f"ファイルが見つかりません: {path}")
+    return resolved
+
+
+def run_execution(db: Session, execution: Execution) -> Execution:
+    """取得済み（running）の実行を処理
+    
+    ステップログはバッファし、EXECUTION_STEP_LOG_FLUSH_STEPS ステップごと、前回から
+    EXECUTION_STEP_LOG_FLUSH_INTERVAL 秒経過したステップ、失敗したステップでまとめてコミットする
+    （実行中も GET /executions/{id} で進捗を確認できる）。実行履歴の変更も同じトランザクションで
+    コミットするため、処理が中断された場合もコミット済みのステップログと実行履歴は一致する。
+    最後のステップログは実行結果の更新と同じコミットで書き込む。入力の読み込みに失敗した場合も
+    実行は failed として記録する。
+    
+    中間結果キャッシュ（app/services/step_cache.py）が有効な場合は、各ステップ実行後の
+    DataFrameを保存し、先頭から一致するステップの結果が保存済みであれば入力を読み込まずに
+    そこから再開する（再開したステップは status が cached のステップログとして記録する）。
+    
+    読み書きするカラムが重ならない連続したステップ（app/services/step_dependencies.py）は、
+    EXECUTION_PARALLEL_STEPS ステップまで同時に実行する。中間結果はグループごとに保存する。
+    
+    ステップの開始・終了などの進捗はイベント（app/services/execution_events.py）として書き出し、
+    GET /executions/{id}/events で配信する。finished のイベントは実行結果のコミット後に書き込む。
+    
+    取り消しが要求された場合、またはプランの実行時間の上限を超えた場合
+    （app/services/execution_cancellation.py）は、ステップの間で打ち切り（sandbox では実行中の
+    ステップも強制終了する）、実行を cancelled にする。それまでのステップログは残す。
+    
+    処理中に想定外の例外が発生した場合は、コミットしていない変更を破棄して実行を failed にする
+    （running のまま残さない）。例外は呼び出し元に伝えない。
+    
+    Args:
+        db: データベースセッション
+        execution: status が running の実行履歴
+    
+    Returns:
+        更新後の実行履歴
+    """
+    steps = list(execution.plan.steps)
+    events = execution_events.ExecutionEventLog(execution.id)
+    events.emit("started", total_steps=len(steps))
+    try:
+        # 再実行（停止したワーカーから戻された実行）では以前の試行の実行結果を上書きする
+        execution_output.remove_output(execution)
+        with execution_cancellation.ExecutionWatcher(db, execution) as watcher:
+            stream_steps = _streaming_steps(db, execution, steps)
+            if stream_steps is not None:
+                execution = _run_streaming_execution(db, execution, steps, stream_steps, events, watcher)
+            else:
+                execution = _run_memory_execution(db, execution, steps, events, watcher)
+        events.emit(
+            "finished",
+            status=execution.status,
+            execution_time=execution.execution_time,
+            error_message=execution.error_message,
+        )
+    except Exception as e:
+        logger.exception("実行の処理に失敗しました（%s）", execution.id)
+        execution = _fail_execution(db, execution, f"実行の処理に失敗しました: {e}")
+        events.emit(
+            "finished",
+            status=execution.status,
+            execution_time=execution.execution_time,
+            error_message=execution.error_message,
         )
+    finally:
+        events.close()
+    return execution
+
+
+def _fail_execution(db: Session, execution: Execution, message: str) -> Execution:
+    """処理中に例外が発生した実行を failed にする（すでに終了していればそのまま返す）"""
+    db.rollback()
+    db.refresh(execution)
+    if execution.status != "running":
+        return execution
+    execution.status = "failed"
+    execution.error_message = message
+    execution.completed_at = datetime.utcnow()
+    if execution.started_at is not None:
+        execution.execution_time = (
+            execution.completed_at - execution.started_at.replace(tzinfo=None)
+        ).total_seconds()
+    _remove_execution_input(execution)
+    execution_output.remove_output(execution)
+    return ExecutionRepository(db).update(execution)
+
+
+def _run_memory_execution(
+    db: Session,
+    execution: Execution,
+    steps: list,
+    events: execution_events.ExecutionEventLog,
+    watcher: execution_cancellation.ExecutionWatcher,
+) -> Execution:
+    """入力全体をワーカー上のメモリに読み込んでステップを実行"""
+    exec_repo = ExecutionRepository(db)
+    execution.mode = "memory"
+    
+    total_start_time = time.time()
+    cache = step_cache.get_step_cache()
+    
+    with step_executor.open_executor() as executor:
+        executor.stop = watcher.stop
+        try:
+            resumed = 0
+            before_summary = None
+            input_hash = _execution_input_hash(db, execution) if cache is not None else None
+            if input_hash is None:
+                cache = None
+            else:
+                root_key, keys = step_cache.chain_keys(input_hash, [step.source for step in steps])
+                resumed = cache.longest_prefix(keys)
+                saved_summary = cache.get_summary(root_key) if resumed else None
+                df = None
+                if saved_summary is not None:
+                    before_summary, before_fingerprints = saved_summary
+                    try:
+                        df = cache.load(keys[resumed - 1])
+                    except (OSError, ValueError, KeyError):
+                        df = None
+                if df is None:
+                    resumed = 0
+            if resumed == 0:
+                df = _load_execution_input(db, execution)
+                # Before サマリを記録
+                before_summary, before_fingerprints = summarize_columns(df)
+                if cache is not None:
+                    cache.put_summary(root_key, before_summary, before_fingerprints)
+            executor.load(df)
+            del df
+        except Exception as e:
+            execution.status = "failed"
+            execution.error_message = f"入力データを読み込めません: {e}"
+            execution.execution_time = time.time() - total_start_time
+            execution.completed_at = datetime.utcnow()
+            _remove_execution_input(execution)
+            return exec_repo.update(execution)
+        
+        # 最初のステップログと同じコミットで書き込む
+        execution.before_summary_json = json.dumps(before_summary, ensure_ascii=False)
+        
+        error_occurred = False
+        cancelled = False
+        pending_logs: list[ExecutionStepLog] = []
         
         try:
-            # コードスニペットを実行
-            exec_globals = {"df": df, "pd": pd}
-            exec(step.code_snippet, exec_globals)
-            df = exec_globals.get("df", df)
-            
-            step_log.status = "success"
-            step_log.execution_time = time.time() - step_start_time
+            error_occurred, cancelled = _run_memory_steps(
+                db, execution, steps, resumed, executor, events, watcher, cache,
+                keys if cache is not None else None, pending_logs
+            )
             
+            # After サマリを記録（変更されていないカラムは Before サマリを再利用する。
+            # ワーカーが強制終了された場合はデータが失われているため記録しない。
+            # 中断した実行はこれ以上CPUを使わないよう記録しない）
+            if executor.alive and not cancelled:
+                after_summary = executor.call(generate_after_summary, before_summary, before_fingerprints)
+                execution.after_summary_json = json.dumps(after_summary, ensure_ascii=False)
         except Exception as e:
-            step_log.status = "failed"
-            step_log.error_message = str(e)
-            step_log.execution_time = time.time() - step_start_time
+            logger.exception("実行 %s のステップを処理できません", execution.id)
             error_occurred = True
-            exec_repo.add_step_log(step_log)
-            break
+            execution.error_message = f"実行を処理できません: {e}"
         
-        exec_repo.add_step_log(step_log)
+        # 前処理後のデータを保存（GET /executions/{id}/output でダウンロードできる）
+        if not error_occurred and not cancelled and settings.EXECUTION_OUTPUT_ENABLED:
+            fmt = execution_output.output_format()
+            output_path = execution_output.output_path(execution.id, fmt)
+            try:
+                executor.call(execution_output.write_output, output_path, fmt)
+                execution.output_path = output_path
+            except Exception as e:
+                error_occurred = True
+                execution.error_message = f"実行結果を保存できません: {e}"
+    
+    # 実行結果を更新（まだコミットしていないステップログも同じコミットで書き込む）
+    if cancelled:
+        execution.status = "cancelled"
+        execution.error_message = watcher.message
+    else:
+        execution.status = "failed" if error_occurred else "completed"
+    execution.execution_time = time.time() - total_start_time
+    execution.completed_at = datetime.utcnow()
+    
+    _remove_execution_input(execution)
+    exec_repo.add_step_logs(pending_logs)
+    
+    return execution
+
+
+def _run_memory_steps(
+    db: Session,
+    execution: Execution,
+    steps: list,
+    resumed: int,
+    executor: "step_executor.InProcessStepExecutor | step_executor.SandboxStepExecutor",
+    events: execution_events.ExecutionEventLog,
+    watcher: execution_cancellation.ExecutionWatcher,
+    cache: Optional[step_cache.StepCache],
+    keys: Optional[list[str]],
+    pending_logs: list[ExecutionStepLog],
+) -> tuple[bool, bool]:
+    """_run_memory_execution のステップを実行し、(失敗したか, 中断したか) を返す
+    
+    ステップログは pending_logs に追加し、まとめてコミットしたものは取り除く
+    （例外で中断した場合も、残りは呼び出し元が実行結果と同じコミットで書き込む）。
+    """
+    exec_repo = ExecutionRepository(db)
+    error_occurred = False
+    cancelled = False
+    last_flush_time = time.time()
     
-    # After サマリを記録
-    after_summary = generate_data_summary(df)
-    execution.after_summary_json = json.dumps(after_summary, ensure_ascii=False)
+    # 各ステップを実行（タイムアウト・メモリ上限超過も失敗として記録する）
+    for step in steps[:resumed]:
+        pending_logs.append(ExecutionStepLog(
+            id=str(uuid.uuid4()),
+            execution_id=execution.id,
+            step_order=step.order,
+            step_name=step.name,
+            status="cached",
+            execution_time=0.0
+        ))
+        events.emit("step_finished", order=step.order, name=step.name, status="cached", execution_time=0.0)
+    # 依存関係のない連続したステップは同時に実行する
+    columns = [step_dependencies.analyze_columns(step.source) for step in steps[resumed:]]
+    for group in step_dependencies.schedule(columns, max(settings.EXECUTION_PARALLEL_STEPS, 1)):
+        # 取り消し・実行時間の上限はステップの間で確認する
+        if watcher.stopped:
+            cancelled = True
+            break
+        group_steps = [steps[resumed + i] for i in group]
+        for step in group_steps:
+            events.emit("step_started", order=step.order, name=step.name)
+        if len(group) == 1:
+            step_start_time = time.time()
+            status, error_message, metrics = executor.run_step(group_steps[0].source)
+            results = [(status, error_message, metrics, time.time() - step_start_time)]
+        else:
+            results = executor.run_steps(
+                [step.source for step in group_steps], [columns[i] for i in group]
+            )
+        for step, (status, error_message, metrics, elapsed) in zip(group_steps, results):
+            pending_logs.append(ExecutionStepLog(
+                id=str(uuid.uuid4()),
+                execution_id=execution.id,
+                step_order=step.order,
+                step_name=step.name,
+                status=status,
+                error_message=error_message,
+                execution_time=elapsed,
+                **metrics
+            ))
+            events.emit(
+                "step_finished", order=step.order, name=step.name, status=status,
+                execution_time=elapsed, error_message=error_message, **metrics
+            )
+            if status == "failed":
+                error_occurred = True
+            elif status == "cancelled":
+                cancelled = True
+        if (
+            error_occurred
+            or cancelled
+            or len(pending_logs) >= settings.EXECUTION_STEP_LOG_FLUSH_STEPS
+            or time.time() - last_flush_time >= settings.EXECUTION_STEP_LOG_FLUSH_INTERVAL
+        ):
+            exec_repo.add_step_logs(pending_logs)
+            pending_logs.clear()
+            last_flush_time = time.time()
+        if error_occurred or cancelled:
+            break
+        # グループの途中の状態は残らないため、グループの最後のステップの結果だけを保存する
+        # （保存に失敗した場合は実行を続け、以降の中間結果は保存しない）
+        if cache is not None:
+            try:
+                if executor.call(
+                    step_cache.write_checkpoint, cache.cache_dir, keys[resumed + group[-1]], cache.max_bytes
+                ):
+                    cache.evict()
+            except Exception:
+                logger.exception("実行 %s の中間結果を保存できません", execution.id)
+                cache = None
     
-    # 実行結果を更新
-    execution.status = "failed" if error_occurred else "completed"
+    return error_occurred, cancelled
+
+
+def _streaming_steps(db: Session, execution: Execution, steps: list) -> Optional[list]:
+    """チャンク実行する場合は変換したステップを返す（メモリ上で実行する場合は None）"""
+    if execution.mode not in ("auto", "stream"):
+        return None
+    input_path = _execution_input_file(db, execution)
+    if input_path is None:
+        # サンプルデータは小さいためメモリ上で実行する
+        return None
+    if execution.mode == "auto" and os.path.getsize(input_path) < settings.EXECUTION_STREAM_MIN_BYTES:
+        return None
+    stream_steps, _ = streaming_execution.analyze_plan([step.source for step in steps])
+    return stream_steps
+
+
+def _run_streaming_execution(
+    db: Session,
+    execution: Execution,
+    steps: list,
+    stream_steps: list,
+    events: execution_events.ExecutionEventLog,
+    watcher: execution_cancellation.ExecutionWatcher,
+) -> Execution:
+    """入力をチャンク単位で処理して出力ファイルに書き出す（app/services/streaming_execution.py）
+    
+    ステップはチャンクごとに交互に適用されるため、進捗はチャンクごとの progress のイベントで通知し、
+    ステップごとの step_finished のイベントは最後にまとめて書き込む。取り消し・実行時間の上限は
+    チャンクの間で確認し、中断した場合はすべてのステップを cancelled として記録する。
+    """
+    exec_repo = ExecutionRepository(db)
+    total_start_time = time.time()
+    execution.mode = "stream"
+    output_path = execution_output.output_path(execution.id, "csv")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    
+    try:
+        result = streaming_execution.run_chunked(
+            _execution_input_chunks(db, execution, settings.EXECUTION_STREAM_CHUNK_SIZE), stream_steps, output_path,
+            on_progress=lambda pass_index, passes, rows: events.emit(
+                "progress", **{"pass": pass_index, "passes": passes, "rows": rows}
+            ),
+            stop=watcher.stop
+        )
+    except Exception as e:
+        execution.status = "failed"
+        execution.error_message = f"入力データを読み込めません: {e}"
+        execution.execution_time = time.time() - total_start_time
+        execution.completed_at = datetime.utcnow()
+        _remove_execution_input(execution)
+        execution_output.remove_output(execution)
+        return exec_repo.update(execution)
+    
+    failed_step = result["failed_step"]
+    cancelled = result["cancelled"]
+    step_logs = []
+    # 失敗したステップより後のステップは記録しない（メモリ上での実行と同じ）
+    for i, step in enumerate(steps if failed_step is None else steps[:failed_step + 1]):
+        if cancelled:
+            status = "cancelled"
+        else:
+            status = "failed" if i == failed_step else "success"
+        step_logs.append(ExecutionStepLog(
+            id=str(uuid.uuid4()),
+            execution_id=execution.id,
+            step_order=step.order,
+            step_name=step.name,
+            status=status,
+            error_message=result["error_message"] if i == failed_step else None,
+            execution_time=result["step_times"][i],
+            cpu_time=result["step_cpu_times"][i]
+        ))
+        log = step_logs[-1]
+        events.emit(
+            "step_finished", order=log.step_order, name=log.step_name, status=log.status,
+            execution_time=log.execution_time, error_message=log.error_message, cpu_time=log.cpu_time
+        )
+    
+    if result["before_summary"] is not None:
+        execution.before_summary_json = json.dumps(result["before_summary"], ensure_ascii=False)
+    if result["after_summary"] is not None:
+        execution.after_summary_json = json.dumps(result["after_summary"], ensure_ascii=False)
+    if failed_step is None and not cancelled:
+        execution.output_path = output_path
+    else:
+        execution_output.remove_output(execution)
+    if cancelled:
+        execution.status = "cancelled"
+        execution.error_message = watcher.message
+    else:
+        execution.status = "failed" if failed_step is not None else "completed"
     execution.execution_time = time.time() - total_start_time
     execution.completed_at = datetime.utcnow()
     
-    exec_repo.update(execution)
+    _remove_execution_input(execution)
+    exec_repo.add_step_logs(step_logs)
+    return execution
+
+
+def _execution_input_file(db: Session, execution: Execution) -> Optional[str]:
+    """実行の入力ファイル（サンプルデータの場合は None）"""
+    if execution.dataset_id:
+        dataset = DatasetRepository(db).find_by_id(execution.dataset_id)
+        if dataset is None:
+            raise ResourceNotFoundException("Dataset", execution.dataset_id)
+        return dataset.file_path
+    return _input_csv_path(execution)
+
+
+def _execution_input_chunks(
+    db: Session, execution: Execution, chunksize: int
+) -> Callable[[], Iterator[pd.DataFrame]]:
+    """実行の入力をチャンク単位で読み込むイテレータを返す関数（読み込み方法は _load_execution_input と同じ）"""
+    if execution.dataset_id:
+        dataset = DatasetRepository(db).find_by_id(execution.dataset_id)
+        if dataset is None:
+            raise ResourceNotFoundException("Dataset", execution.dataset_id)
+        if dataset.store_path and os.path.exists(dataset.store_path):
+            return lambda: columnar_store.iter_chunks(dataset.store_path, chunksize)
+        schema = get_dataset_schema(dataset)
+        return lambda: csv_ingest.iter_csv_chunks(dataset.file_path, chunksize, schema)
+    input_path = _input_csv_path(execution)
+    schema = csv_ingest.infer_schema(input_path)
+    return lambda: csv_ingest.iter_csv_chunks(input_path, chunksize, schema)
+
+
+def _load_execution_input(db: Session, execution: Execution) -> pd.DataFrame:
+    """実行の入力データを読み込む"""
+    if execution.dataset_id:
+        dataset = DatasetRepository(db).find_by_id(execution.dataset_id)
+        if dataset is None:
+            raise ResourceNotFoundException("Dataset", execution.dataset_id)
+        return load_dataset_frame(dataset)
+    if _input_csv_path(execution):
+        return csv_ingest.read_csv(_input_csv_path(execution), categories=False)
+    # サンプルデータを生成
+    return _generate_sample_data()
+
+
+def _execution_input_hash(db: Session, execution: Execution) -> Optional[str]:
+    """中間結果キャッシュのキーに使う入力データのハッシュ（計算できない場合は None）
+    
+    データセットは読み込み方法（カラム単位のバイナリ形式かCSVか）で型が変わりうるため区別する。
+    """
+    if execution.dataset_id:
+        dataset = DatasetRepository(db).find_by_id(execution.dataset_id)
+        if dataset is None:
+            raise ResourceNotFoundException("Dataset", execution.dataset_id)
+        if not dataset.content_hash:
+            return None
+        source = "store" if dataset.store_path and os.path.exists(dataset.store_path) else "csv"
+        return f"dataset:{source}:{dataset.content_hash}"
+    if _input_csv_path(execution):
+        hasher = hashlib.sha256()
+        with open(_input_csv_path(execution), "rb") as f:
+            for chunk in iter(lambda: f.read(settings.UPLOAD_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        return f"csv:{hasher.hexdigest()}"
+    return "sample"
+
+
+def _input_csv_path(execution: Execution) -> Optional[str]:
+    """実行の入力のCSVファイル（保存したCSVデータ、または一括実行で指定されたファイル）"""
+    return execution.input_path or execution.source_path
+
+
+def _remove_execution_input(execution: Execution) -> None:
+    if execution.input_path and os.path.exists(execution.input_path):
+        os.remove(execution.input_path)
+
+
+def execution_input_path(execution_id: str) -> str:
+    """キューに登録したCSVデータの保存先パスを返す"""
+    return os.path.join(settings.DATA_DIR, "executions", f"{execution_id}.csv")
+
+
+def cancel_execution(db: Session, execution_id: str, user_id: str) -> Execution:
+    """実行の取り消しを要求
+    
+    pending の実行はすぐに cancelled にする。running の実行は取り消しを要求し、処理中のワーカーが
+    EXECUTION_CANCEL_CHECK_INTERVAL 秒以内に中断して cancelled にする（app/services/execution_cancellation.py）。
+    一括実行の親の場合は、未処理の子を cancelled にし、処理中の子に取り消しを要求する。
+    
+    Returns:
+        更新後の実行履歴
+    """
+    exec_repo = ExecutionRepository(db)
+    execution = get_execution(db, execution_id)
+    if execution.plan.user_id != user_id:
+        raise UnauthorizedAccessException("この実行履歴へのアクセス権限がありません")
+    if execution.status in execution_events.FINISHED_STATUSES:
+        raise ValidationException(f"終了した実行は取り消せません（status: {execution.status}）")
     
+    targets = list(execution.children) or [execution]
+    if execution.children:
+        exec_repo.request_cancel(execution.id)
+    for target in targets:
+        if exec_repo.cancel_pending(target.id, execution_cancellation.CANCELLED_MESSAGE):
+            _remove_execution_input(target)
+            # ワーカーが処理しないため、購読中のクライアントへの終了のイベントはここで書き込む
+            events = execution_events.ExecutionEventLog(target.id)
+            events.emit(
+                "finished", status="cancelled", execution_time=None,
+                error_message=execution_cancellation.CANCELLED_MESSAGE
+            )
+            events.close()
+        else:
+            exec_repo.request_cancel(target.id)
+    parent_id = execution.id if execution.children else execution.parent_id
+    if parent_id:
+        update_batch_parent(db, parent_id)
+    db.refresh(execution)
     return execution
 
 
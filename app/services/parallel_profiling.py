@@ -0,0 +1,288 @@
+"""カラム並列プロファイリング
+
+カラムを連続した範囲のシャードに分割し、プロセスプールで並列にプロファイリングする。
+数値カラムは元の型の配列（nullable 型は値とマスク）のまま、NUMERIC_BLOCK_BYTES を超えない
+ブロック単位で共有メモリに書き込み、各ワーカーはブロックをコピーせずに参照する。共有メモリに
+書き込んだブロックの合計が上限を超えないよう、同時に処理するブロックの数を制限し、処理が
+終わったブロックから破棄する（共有メモリの破棄は親プロセスが行う）。
+数値以外のカラム（文字列など）と、共有メモリに置けない数値の拡張型のカラムは、
+シャードごとにSeriesをそのままワーカーに渡す（pickle でシャードのカラム全体がコピーされる。
+メモリの上限は制御しないため、文字列カラムが大きい場合はワーカー数だけコピーが同時に存在しうる）。
+
+ワーカープロセスが異常終了してプールが使えなくなった場合（BrokenProcessPool）は、
+プールを破棄して作り直し、1回だけやり直す。やり直しでも失敗した場合は逐次処理で計算する。
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.services import profiling_service
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# 共有メモリ上の各配列の先頭の境界（バイト）
+_ALIGNMENT = 64
+# nullable 型（値とマスクで表現される拡張型）の配列
+_MASKED_ARRAYS = (pd.arrays.IntegerArray, pd.arrays.FloatingArray, pd.arrays.BooleanArray)
+
+
+class _SharedColumn(NamedTuple):
+    """共有メモリのブロック内の1カラム"""
+    position: int
+    dtype: str
+    dtype_category: str
+    values_dtype: str
+    values_offset: int
+    # nullable 型の場合の欠損マスクの位置（それ以外は None）
+    mask_offset: Optional[int]
+
+
+def parallel_enabled(n_columns: int) -> bool:
+    """設定とカラム数から並列プロファイリングを使うか判定"""
+    return settings.PROFILING_PARALLEL_WORKERS > 0 and n_columns >= settings.PROFILING_PARALLEL_MIN_COLUMNS
+
+
+def profile_columns_parallel(df: pd.DataFrame, numeric_positions: list[int]) -> dict[int, dict]:
+    """全カラムをシャード単位で並列にプロファイリング
+
+    Args:
+        df: 分析対象のDataFrame
+        numeric_positions: 数値カラムの位置
+
+    Returns:
+        カラム位置をキーとするカラムプロファイルの辞書（逐次処理と同じ内容）
+    """
+    for attempt in range(2):
+        executor = _get_executor()
+        try:
+            return _profile_with_executor(executor, df, numeric_positions)
+        except BrokenProcessPool:
+            logger.warning("並列プロファイリングのプロセスプールが停止しました（%d回目）", attempt + 1, exc_info=True)
+            _discard_executor(executor)
+    return _profile_serial(df, numeric_positions)
+
+
+def _profile_with_executor(
+    executor: ProcessPoolExecutor, df: pd.DataFrame, numeric_positions: list[int]
+) -> dict[int, dict]:
+    """プロセスプールで全カラムをシャード単位にプロファイリング（プールが停止した場合は BrokenProcessPool）"""
+    n_columns = df.shape[1]
+    shard_count = settings.PROFILING_PARALLEL_SHARDS or settings.PROFILING_PARALLEL_WORKERS * 4
+    shard_count = max(1, min(shard_count, n_columns))
+    # 同時に共有メモリに置くブロックの数と、1ブロックあたりの上限
+    max_in_flight = settings.PROFILING_PARALLEL_WORKERS * 2
+    block_bytes = max(profiling_service.NUMERIC_BLOCK_BYTES // max_in_flight, 1)
+
+    numeric = set(numeric_positions)
+    tasks: list[tuple[list[int], dict[int, pd.Series]]] = []
+    for shard in np.array_split(np.arange(n_columns), shard_count):
+        shared = [pos for pos in shard.tolist() if pos in numeric and _shareable(df.iloc[:, pos])]
+        others = {pos: df.iloc[:, pos] for pos in shard.tolist() if pos not in shared}
+        blocks = _split_blocks(df, shared, block_bytes) or [[]]
+        tasks.append((blocks[0], others))
+        tasks.extend((block, {}) for block in blocks[1:])
+
+    profiles: dict[int, dict] = {}
+    in_flight: dict[Future, Optional[shared_memory.SharedMemory]] = {}
+    try:
+        for block, others in tasks:
+            if len(in_flight) >= max_in_flight:
+                _collect(in_flight, profiles, FIRST_COMPLETED)
+            shm, columns = _share_block(df, block) if block else (None, [])
+            in_flight[executor.submit(
+                _profile_shard, shm.name if shm else None, len(df), columns, others
+            )] = shm
+        while in_flight:
+            _collect(in_flight, profiles, FIRST_COMPLETED)
+        return profiles
+    finally:
+        for future in in_flight:
+            future.cancel()
+        wait(in_flight)
+        for shm in in_flight.values():
+            _release(shm)
+
+
+def _profile_serial(df: pd.DataFrame, numeric_positions: list[int]) -> dict[int, dict]:
+    """プロセスプールを使わずに全カラムをプロファイリング"""
+    profiles = profiling_service._profile_numeric_columns(df, numeric_positions)
+    for pos in range(df.shape[1]):
+        if pos not in profiles:
+            profiles[pos] = profiling_service._profile_column(df.iloc[:, pos])
+    return profiles
+
+
+def _shareable(series: pd.Series) -> bool:
+    """共有メモリに置ける数値カラムか（NumPy の型、または nullable 型）"""
+    return isinstance(series.dtype, np.dtype) or isinstance(series.array, _MASKED_ARRAYS)
+
+
+def _column_nbytes(series: pd.Series) -> int:
+    """ブロックの大きさを決める際の1カラムのサイズ（ワーカーで float64 に変換した後のサイズで数える）"""
+    return len(series) * (8 if isinstance(series.dtype, np.dtype) else 9)
+
+
+def _split_blocks(df: pd.DataFrame, positions: list[int], block_bytes: int) -> list[list[int]]:
+    """カラムを合計サイズが block_bytes 以下の連続したブロックに分ける（1カラムで超える場合は単独のブロック）"""
+    blocks: list[list[int]] = []
+    size = 0
+    for pos in positions:
+        nbytes = _column_nbytes(df.iloc[:, pos]) + 2 * _ALIGNMENT
+        if not blocks or size + nbytes > block_bytes:
+            blocks.append([])
+            size = 0
+        blocks[-1].append(pos)
+        size += nbytes
+    return blocks
+
+
+def _share_block(df: pd.DataFrame, positions: list[int]) -> tuple[shared_memory.SharedMemory, list[_SharedColumn]]:
+    """ブロックのカラムを元の型のまま共有メモリに書き込む"""
+    arrays = []
+    for pos in positions:
+        series = df.iloc[:, pos]
+        if isinstance(series.dtype, np.dtype):
+            arrays.append((pos, series, series.to_numpy(), None))
+        else:
+            values = series.array.to_numpy(dtype=series.dtype.numpy_dtype, na_value=0)
+            arrays.append((pos, series, values, series.isna().to_numpy()))
+
+    offset = 0
+    layout = []
+    for pos, series, values, mask in arrays:
+        values_offset = offset
+        offset = _aligned(offset + values.nbytes)
+        mask_offset = None
+        if mask is not None:
+            mask_offset = offset
+            offset = _aligned(offset + mask.nbytes)
+        layout.append(_SharedColumn(
+            pos, str(series.dtype), profiling_service._get_dtype_category(series),
+            values.dtype.str, values_offset, mask_offset,
+        ))
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    try:
+        for column, (_, _, values, mask) in zip(layout, arrays):
+            target = np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf, offset=column.values_offset)
+            target[:] = values
+            if mask is not None:
+                target = np.ndarray(mask.shape, dtype=np.bool_, buffer=shm.buf, offset=column.mask_offset)
+                target[:] = mask
+            del target
+    except BaseException:
+        _release(shm)
+        raise
+    return shm, layout
+
+
+def _collect(in_flight: dict, profiles: dict[int, dict], return_when: str) -> None:
+    """完了したタスクの結果を取り出し、そのブロックの共有メモリを破棄する"""
+    done, _ = wait(in_flight, return_when=return_when)
+    for future in done:
+        shm = in_flight.pop(future)
+        _release(shm)
+        profiles.update(future.result())
+
+
+def _release(shm: Optional[shared_memory.SharedMemory]) -> None:
+    if shm is not None:
+        shm.close()
+        shm.unlink()
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _profile_shard(
+    shm_name: Optional[str],
+    n_rows: int,
+    columns: list[_SharedColumn],
+    others: dict[int, pd.Series],
+) -> dict[int, dict]:
+    """ワーカープロセスで1ブロック分の数値カラムと、シャードの数値以外のカラムをプロファイリング"""
+    profiles: dict[int, dict] = {}
+    if columns:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            profiles.update(_profile_shared_block(shm, n_rows, columns))
+        finally:
+            shm.close()
+
+    for pos, series in others.items():
+        profiles[pos] = profiling_service._profile_column(series)
+    return profiles
+
+
+def _profile_shared_block(
+    shm: shared_memory.SharedMemory, n_rows: int, columns: list[_SharedColumn]
+) -> dict[int, dict]:
+    """共有メモリ上のブロックから元の型のSeriesを組み立ててプロファイリング
+
+    ユニーク数は元の型のSeriesで数える（float64 に変換すると大きな整数が同じ値になりうるため）。
+    ここで作った共有メモリへの参照は、戻るときにすべて破棄される。
+    """
+    values = np.empty((n_rows, len(columns)), dtype=np.float64, order="F")
+    unique_counts = []
+    for j, column in enumerate(columns):
+        data = np.ndarray(n_rows, dtype=np.dtype(column.values_dtype), buffer=shm.buf, offset=column.values_offset)
+        if column.mask_offset is None:
+            series = pd.Series(data, copy=False)
+        else:
+            mask = np.ndarray(n_rows, dtype=np.bool_, buffer=shm.buf, offset=column.mask_offset)
+            array_type = pd.api.types.pandas_dtype(column.dtype).construct_array_type()
+            series = pd.Series(array_type(data, mask), copy=False)
+        values[:, j] = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        unique_counts.append(int(series.nunique()))
+    block_profiles = profiling_service._numeric_block_profiles(
+        values,
+        [column.dtype for column in columns],
+        [column.dtype_category for column in columns],
+        unique_counts,
+    )
+    return dict(zip((column.position for column in columns), block_profiles))
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """設定に基づく共有プロセスプールを取得
+
+    スレッドを持つサーバープロセスからの fork を避けるため spawn で起動する。
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.PROFILING_PARALLEL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor) -> None:
+    """停止したプロセスプールを破棄する（次の _get_executor で作り直す）"""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_executor() -> None:
+    """共有プロセスプールを停止"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
@@ -7,7 +7,7 @@ from app.models.plan import Plan
 from app.schemas.plan import PlanSummary, PlanCreate
 from app.repositories.plan_repository import PlanRepository
 from app.repositories.dataset_repository import DatasetRepository
-from app.exceptions import ResourceNotFoundException, UnauthorizedAccessException
+from app.exceptions import ResourceNotFoundException, UnauthorizedAccessException, ValidationException
 
 
 def get_user_plans(db: Session, user_id: str) -> List[PlanSummary]:
@@ -20,6 +20,7 @@ def get_user_plans(db: Session, user_id: str) -> List[PlanSummary]:
             name=plan.name,
             dataset_id=plan.dataset_id,
             task_type=plan.task_type,
+            max_runtime=plan.max_runtime,
             created_at=plan.created_at
         )
         for plan in plans
@@ -40,6 +41,9 @@ def create_plan(db: Session, user_id: str, plan_in: PlanCreate) -> Plan:
     if dataset.user_id != user_id:
         raise UnauthorizedAccessException("このデータセットへのアクセス権限がありません")
     
+    if plan_in.max_runtime is not None and plan_in.max_runtime <= 0:
+        raise ValidationException(f"実行時間の上限は0より大きい秒数で指定してください: {plan_in.max_runtime}")
+    
     # プランを作成
     new_plan = Plan(
         id=str(uuid.uuid4()),
@@ -47,6 +51,7 @@ def create_plan(db: Session, user_id: str, plan_in: PlanCreate) -> Plan:
         dataset_id=plan_in.dataset_id,
         name=plan_in.plan_name,
         task_type=plan_in.task_type,
-        target_column=plan_in.target_column
+        target_column=plan_in.target_column,
+        max_runtime=plan_in.max_runtime
     )
     return plan_repo.create(new_plan)
@@ -0,0 +1,555 @@
+"""マージ可能なプロファイル統計量
+
+CSVをチャンク単位で読みながらプロファイルを作るための累積器。
+いずれもチャンク同士・累積器同士をマージでき、メモリ使用量はデータ量に依存しない。
+
+- 平均・分散: Welford法（並列版のChanらの更新式）
+- 分位点: KLLスケッチ
+- ユニーク数: HyperLogLog（少数の場合は厳密に数える）
+"""
+import base64
+import math
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# 厳密なユニーク数・頻度を保持するユニーク値の上限（top_values の出力条件と同じ）
+EXACT_DISTINCT_LIMIT = 20
+
+
+class KLLSketch:
+    """KLL分位点スケッチ
+
+    レベル h の要素は重み 2^h を持つ。容量を超えたレベルはソートして
+    1つおきに上位レベルへ昇格させる（重みの総和は常に n と一致する）。
+    要素数が奇数の場合に現レベルに残す1つは最小値と最大値を交互に選び、分位点が偏らないようにする。
+    """
+
+    MIN_CAPACITY = 8
+
+    def __init__(self, k: int = 200):
+        self.k = k
+        self.n = 0
+        self.levels: list[np.ndarray] = [np.empty(0)]
+        self._offset = 0
+        self._keep_last = 0
+
+    def update(self, values: np.ndarray) -> None:
+        """欠損を含まない数値配列を追加"""
+        if len(values) == 0:
+            return
+        self.levels[0] = np.concatenate([self.levels[0], np.asarray(values, dtype=np.float64)])
+        self.n += len(values)
+        self._compress()
+
+    def merge(self, other: "KLLSketch") -> None:
+        """別のスケッチをマージ"""
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self._compress()
+
+    def quantiles(self, qs) -> np.ndarray:
+        """分位点を推定"""
+        if self.n == 0:
+            return np.full(len(qs), np.nan)
+        if self.levels_are_exact():
+            # 圧縮前は全要素を保持しているため厳密な分位点（線形補間）を返す
+            return np.quantile(self.levels[0], qs)
+        items, cumulative = self._sorted_view()
+        targets = np.asarray(qs, dtype=np.float64) * cumulative[-1]
+        idx = np.searchsorted(cumulative, targets, side="left")
+        return items[np.clip(idx, 0, len(items) - 1)]
+
+    def rank(self, value: float, inclusive: bool = False) -> float:
+        """value 未満（inclusive=True の場合は以下）の要素の割合を推定"""
+        if self.n == 0:
+            return 0.0
+        side = "right" if inclusive else "left"
+        if self.levels_are_exact():
+            return float(np.searchsorted(np.sort(self.levels[0]), value, side=side) / self.n)
+        items, cumulative = self._sorted_view()
+        idx = np.searchsorted(items, value, side=side)
+        return float(cumulative[idx - 1] / cumulative[-1]) if idx > 0 else 0.0
+
+    def rank_error(self) -> float:
+        """単一分位点に対する正規化順位誤差の目安（約99%信頼）
+
+        Apache DataSketches の KLL 実装で用いられている経験式。
+        """
+        if self.levels_are_exact():
+            return 0.0
+        return 2.296 / self.k ** 0.9723
+
+    def levels_are_exact(self) -> bool:
+        """まだ一度も圧縮されていない（厳密な値を保持している）か"""
+        return len(self.levels) == 1
+
+    def to_dict(self) -> dict:
+        return {
+            "k": self.k,
+            "n": self.n,
+            "levels": [items.tolist() for items in self.levels],
+            "offset": self._offset,
+            "keep_last": self._keep_last,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "KLLSketch":
+        sketch = cls(data["k"])
+        sketch.n = data["n"]
+        sketch.levels = [np.asarray(items, dtype=np.float64) for items in data["levels"]]
+        sketch._offset = data.get("offset", 0)
+        sketch._keep_last = data.get("keep_last", 0)
+        return sketch
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(int(math.ceil(self.k * (2 / 3) ** depth)), self.MIN_CAPACITY)
+
+    def _compress(self) -> None:
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) <= self._capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(items)
+            # 偶数個だけを圧縮し、端数の1つは現レベルに残す（最小値・最大値を交互に残す）
+            if len(items) % 2 == 0:
+                keep = items[:0]
+            elif self._keep_last:
+                keep, items = items[-1:], items[:-1]
+            else:
+                keep, items = items[:1], items[1:]
+            if len(keep):
+                self._keep_last ^= 1
+            promoted = items[self._offset::2]
+            self._offset ^= 1
+            self.levels[level] = keep
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            # レベルが増えると下位レベルの容量が変わるため先頭から確認し直す
+            level = 0
+
+    def _sorted_view(self) -> tuple[np.ndarray, np.ndarray]:
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([
+            np.full(len(level_items), 2 ** level, dtype=np.int64)
+            for level, level_items in enumerate(self.levels)
+        ])
+        order = np.argsort(items, kind="stable")
+        return items[order], np.cumsum(weights[order])
+
+
+class HyperLogLog:
+    """HyperLogLogによるユニーク数の推定"""
+
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, values: np.ndarray) -> None:
+        """欠損を含まない値の配列を追加"""
+        if len(values) == 0:
+            return
+        hashes = pd.util.hash_array(np.asarray(values))
+        p = self.precision
+        idx = (hashes >> np.uint64(64 - p)).astype(np.int64)
+        remainder = hashes << np.uint64(p)
+        # 残りのビット列の先頭の0の数 + 1（全て0の場合は 64 - p + 1）
+        _, exponent = np.frexp(remainder.astype(np.float64))
+        rank = np.where(remainder == 0, 64 - p + 1, np.clip(65 - exponent, 1, 64 - p + 1))
+        np.maximum.at(self.registers, idx, rank.astype(np.uint8))
+
+    def merge(self, other: "HyperLogLog") -> None:
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> float:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros > 0:
+            # 小さい範囲では Linear Counting に切り替える
+            return m * math.log(m / zeros)
+        return float(raw)
+
+    def relative_error(self) -> float:
+        """推定値の相対標準誤差"""
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def to_dict(self) -> dict:
+        return {
+            "precision": self.precision,
+            "registers": base64.b64encode(self.registers.tobytes()).decode("ascii"),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HyperLogLog":
+        hll = cls(data["precision"])
+        hll.registers = np.frombuffer(base64.b64decode(data["registers"]), dtype=np.uint8).copy()
+        return hll
+
+
+class ColumnAccumulator:
+    """1カラム分のマージ可能な統計量"""
+
+    def __init__(self, quantile_k: int = 200, hll_precision: int = 12):
+        self.dtypes: list[str] = []
+        self.numeric = True
+        self.rows = 0
+        self.missing = 0
+        # Welford法の状態（非欠損の数値のみ）
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = KLLSketch(quantile_k)
+        self.distinct = HyperLogLog(hll_precision)
+        # ユニーク値が少ない間だけ厳密な頻度を保持する（超えたら None）
+        self.value_counts: Optional[dict[str, int]] = {}
+        # 数値と数値以外の値が混在するカラムか。混在する場合は数値として読める値を
+        # 数値の列と同じキー（float の repr、HyperLogLog には float64）で数える
+        self.mixed = False
+
+    def update(self, series: pd.Series) -> None:
+        """チャンク内の1カラムを追加"""
+        dtype = str(series.dtype)
+        if dtype not in self.dtypes:
+            self.dtypes.append(dtype)
+        self.rows += len(series)
+
+        if self.numeric and pd.api.types.is_numeric_dtype(series.dtype):
+            values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            non_null = values[~np.isnan(values)]
+            self.missing += len(values) - len(non_null)
+            self._update_moments(non_null)
+            self.sketch.update(non_null)
+            self._update_numbers(non_null)
+            return
+
+        if self.numeric:
+            # 途中で数値以外の値が現れたカラムはカテゴリ列として扱う
+            self.numeric = False
+            self.mixed = self.n > 0
+            self.n, self.mean, self.m2 = 0, 0.0, 0.0
+            self.min, self.max = math.inf, -math.inf
+            self.sketch = KLLSketch(self.sketch.k)
+        elif pd.api.types.is_numeric_dtype(series.dtype) and not self.mixed:
+            self._start_mixed()
+        non_null = series.dropna()
+        self.missing += len(series) - len(non_null)
+        if self.mixed and not pd.api.types.is_datetime64_any_dtype(series.dtype):
+            # 数値のチャンクで数えた '1.0' と文字列の '1' を別の値として二重に数えないようにする
+            numbers = pd.to_numeric(non_null, errors="coerce")
+            is_number = numbers.notna().to_numpy()
+            self._update_numbers(numbers.to_numpy(dtype=np.float64)[is_number])
+            non_null = non_null[~is_number]
+        self.distinct.update(non_null.to_numpy(dtype=object))
+        if self.value_counts is not None:
+            counts = non_null.value_counts()
+            if len(counts) > EXACT_DISTINCT_LIMIT:
+                self.value_counts = None
+            else:
+                self._update_value_counts({str(k): int(v) for k, v in counts.items()})
+
+    def merge(self, other: "ColumnAccumulator") -> None:
+        """別の累積器をマージ"""
+        for dtype in other.dtypes:
+            if dtype not in self.dtypes:
+                self.dtypes.append(dtype)
+        self.rows += other.rows
+        self.missing += other.missing
+        other_counts = other.value_counts
+        if self.numeric and other.numeric:
+            self._merge_moments(other.n, other.mean, other.m2)
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self.sketch.merge(other.sketch)
+        elif self.numeric or other.numeric or self.mixed != other.mixed:
+            # 数値と数値以外の値が混在するカラムになる場合は、頻度のキーを数値のキーに揃える
+            # （HyperLogLog のレジスタはキーを揃え直せないため、数値として読める文字列の
+            # ユニーク数は厳密な頻度を保持していない場合に多めに推定されうる）
+            if (self.numeric and self.n > 0) or (other.numeric and other.n > 0) or self.mixed or other.mixed:
+                self._start_mixed()
+                if other_counts is not None:
+                    other_counts = _numeric_keys(other_counts)
+            self.numeric = False
+            self.n, self.mean, self.m2 = 0, 0.0, 0.0
+            self.min, self.max = math.inf, -math.inf
+            self.sketch = KLLSketch(self.sketch.k)
+        self.distinct.merge(other.distinct)
+        if self.value_counts is not None and other_counts is not None:
+            self._update_value_counts(other_counts)
+        else:
+            self.value_counts = None
+
+    def finalize(self) -> dict:
+        """カラムプロファイル（_profile_column と同じ形式）を生成"""
+        rows = self.rows
+        if self.value_counts is not None:
+            unique = len(self.value_counts)
+            unique_error = 0.0
+        else:
+            unique = int(round(self.distinct.estimate()))
+            unique_error = self.distinct.relative_error()
+        count = rows - self.missing
+        unique = min(unique, count)
+
+        dtype = self._resolve_dtype()
+        profile = {
+            "dtype": dtype,
+            "dtype_category": "numeric" if self.numeric else _dtype_category_from_name(dtype),
+            "count": count,
+            "missing": self.missing,
+            "missing_rate": float(self.missing / rows) if rows > 0 else 0,
+            "unique": unique,
+            "unique_rate": float(unique / rows) if rows > 0 else 0,
+        }
+        error_bounds = {"unique": unique_error}
+
+        if self.numeric and self.n > 0:
+            q1, median, q3 = self.sketch.quantiles((0.25, 0.5, 0.75))
+            profile.update({
+                "mean": float(self.mean),
+                "std": float(math.sqrt(self.m2 / (self.n - 1))) if self.n > 1 else 0,
+                "min": float(self.min),
+                "max": float(self.max),
+                "median": float(median),
+                "q1": float(q1),
+                "q3": float(q3),
+            })
+            rank_error = self.sketch.rank_error()
+            error_bounds.update({"median": rank_error, "q1": rank_error, "q3": rank_error})
+
+        if not self.numeric and self.value_counts is not None and unique <= EXACT_DISTINCT_LIMIT:
+            top = sorted(self.value_counts.items(), key=lambda item: item[1], reverse=True)[:10]
+            profile["top_values"] = dict(top)
+
+        profile["error_bounds"] = error_bounds
+        return profile
+
+    def to_dict(self) -> dict:
+        return {
+            "dtypes": self.dtypes,
+            "numeric": self.numeric,
+            "rows": self.rows,
+            "missing": self.missing,
+            "n": self.n,
+            "mean": self.mean,
+            "m2": self.m2,
+            "min": self.min if self.n > 0 else None,
+            "max": self.max if self.n > 0 else None,
+            "sketch": self.sketch.to_dict(),
+            "distinct": self.distinct.to_dict(),
+            "value_counts": self.value_counts,
+            "mixed": self.mixed,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ColumnAccumulator":
+        acc = cls()
+        acc.dtypes = list(data["dtypes"])
+        acc.numeric = data["numeric"]
+        acc.rows = data["rows"]
+        acc.missing = data["missing"]
+        acc.n = data["n"]
+        acc.mean = data["mean"]
+        acc.m2 = data["m2"]
+        acc.min = data["min"] if data["min"] is not None else math.inf
+        acc.max = data["max"] if data["max"] is not None else -math.inf
+        acc.sketch = KLLSketch.from_dict(data["sketch"])
+        acc.distinct = HyperLogLog.from_dict(data["distinct"])
+        acc.value_counts = data["value_counts"]
+        acc.mixed = data.get("mixed", False)
+        return acc
+
+    def _update_moments(self, values: np.ndarray) -> None:
+        if len(values) == 0:
+            return
+        mean = float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+        self._merge_moments(len(values), mean, m2)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def _merge_moments(self, n: int, mean: float, m2: float) -> None:
+        if n == 0:
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.n = total
+
+    def _update_numbers(self, values: np.ndarray) -> None:
+        """欠損を含まない数値をユニーク数・頻度に追加"""
+        self.distinct.update(values)
+        if self.value_counts is not None:
+            uniques, counts = np.unique(values, return_counts=True)
+            if len(uniques) > EXACT_DISTINCT_LIMIT:
+                self.value_counts = None
+            else:
+                self._update_value_counts({repr(float(v)): int(c) for v, c in zip(uniques, counts)})
+
+    def _start_mixed(self) -> None:
+        """数値と数値以外の値が混在するカラムとして数え始める"""
+        self.mixed = True
+        if self.value_counts is not None:
+            self.value_counts = _numeric_keys(self.value_counts)
+
+    def _update_value_counts(self, counts: dict[str, int]) -> None:
+        for key, count in counts.items():
+            self.value_counts[key] = self.value_counts.get(key, 0) + count
+        if len(self.value_counts) > EXACT_DISTINCT_LIMIT:
+            self.value_counts = None
+
+    def _resolve_dtype(self) -> str:
+        if self.numeric:
+            try:
+                return str(np.result_type(*[np.dtype(d) for d in self.dtypes]))
+            except TypeError:
+                # 拡張型（Int64など）が混ざる場合は最後に現れた型を採用する
+                return self.dtypes[-1] if self.dtypes else "float64"
+        non_numeric = [d for d in self.dtypes if not _is_numeric_dtype_name(d)]
+        return non_numeric[0] if non_numeric else "object"
+
+
+class ProfileAccumulator:
+    """データセット全体のマージ可能なプロファイル状態"""
+
+    def __init__(self, quantile_k: int = 200, hll_precision: int = 12):
+        self.quantile_k = quantile_k
+        self.hll_precision = hll_precision
+        self.rows = 0
+        self.columns: dict[str, ColumnAccumulator] = {}
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        """チャンクを追加"""
+        self.rows += len(chunk)
+        for col in chunk.columns:
+            if col not in self.columns:
+                self.columns[col] = ColumnAccumulator(self.quantile_k, self.hll_precision)
+            self.columns[col].update(chunk[col])
+
+    def merge(self, other: "ProfileAccumulator") -> None:
+        """別の累積器をマージ"""
+        self.rows += other.rows
+        for col, acc in other.columns.items():
+            if col in self.columns:
+                self.columns[col].merge(acc)
+            else:
+                self.columns[col] = acc
+
+    def finalize(self) -> dict:
+        """プロファイル（profile_dataframe と同じ形式）を生成"""
+        profile = {
+            "rows": self.rows,
+            "columns": len(self.columns),
+            "missing_values": 0,
+            "missing_rate": 0,
+            "numeric_columns": [],
+            "categorical_columns": [],
+            "datetime_columns": [],
+            "column_profiles": {},
+        }
+        for col, acc in self.columns.items():
+            col_profile = acc.finalize()
+            profile["column_profiles"][col] = col_profile
+            profile["missing_values"] += col_profile["missing"]
+            if col_profile["dtype_category"] == "numeric":
+                profile["numeric_columns"].append(col)
+            elif col_profile["dtype_category"] == "datetime":
+                profile["datetime_columns"].append(col)
+            else:
+                profile["categorical_columns"].append(col)
+        if self.rows > 0 and self.columns:
+            profile["missing_rate"] = float(profile["missing_values"] / (self.rows * len(self.columns)))
+        return profile
+
+    def to_dict(self) -> dict:
+        return {
+            "quantile_k": self.quantile_k,
+            "hll_precision": self.hll_precision,
+            "rows": self.rows,
+            "columns": {col: acc.to_dict() for col, acc in self.columns.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ProfileAccumulator":
+        acc = cls(data["quantile_k"], data["hll_precision"])
+        acc.rows = data["rows"]
+        acc.columns = {col: ColumnAccumulator.from_dict(state) for col, state in data["columns"].items()}
+        return acc
+
+
+def outlier_fences(profile: dict) -> dict[str, tuple[float, float]]:
+    """プロファイルの四分位点からIQR法の外れ値フェンスを求める"""
+    fences = {}
+    for col, col_profile in profile["column_profiles"].items():
+        if "q1" in col_profile:
+            iqr = col_profile["q3"] - col_profile["q1"]
+            fences[col] = (col_profile["q1"] - 1.5 * iqr, col_profile["q3"] + 1.5 * iqr)
+    return fences
+
+
+def count_outliers(chunk: pd.DataFrame, fences: dict[str, tuple[float, float]]) -> dict[str, int]:
+    """チャンク内でフェンスの外側にある値をカラムごとに数える"""
+    counts = {}
+    for col, (lower, upper) in fences.items():
+        if col in chunk.columns and pd.api.types.is_numeric_dtype(chunk[col].dtype):
+            values = chunk[col].to_numpy(dtype=np.float64, na_value=np.nan)
+            counts[col] = int(((values < lower) | (values > upper)).sum())
+    return counts
+
+
+def estimate_outliers(accumulator: ProfileAccumulator, profile: dict) -> None:
+    """フェンスの外側にある値の数をKLLスケッチの順位から推定してプロファイルに書き込む
+
+    データを読み直さずに外れ値を数えるため、追記による増分更新で使う。
+    推定の誤差は下側・上側の順位誤差の和で、error_bounds の outliers_rate に格納する。
+    """
+    for col, (lower, upper) in outlier_fences(profile).items():
+        sketch = accumulator.columns[col].sketch
+        col_profile = profile["column_profiles"][col]
+        outside = sketch.rank(lower) + 1.0 - sketch.rank(upper, inclusive=True)
+        count = int(round(outside * col_profile["count"]))
+        col_profile["outliers_count"] = count
+        col_profile["outliers_rate"] = float(count / col_profile["count"]) if col_profile["count"] > 0 else 0
+        col_profile.setdefault("error_bounds", {})["outliers_rate"] = 2 * sketch.rank_error()
+
+
+def _numeric_keys(counts: dict[str, int]) -> dict[str, int]:
+    """頻度のキーのうち数値として読めるものを数値の列と同じキー（float の repr）に揃える"""
+    numbers = pd.to_numeric(pd.Series(list(counts), dtype=object), errors="coerce")
+    rekeyed: dict[str, int] = {}
+    for (key, count), number in zip(counts.items(), numbers):
+        if not pd.isna(number):
+            key = repr(float(number))
+        rekeyed[key] = rekeyed.get(key, 0) + count
+    return rekeyed
+
+
+def _is_numeric_dtype_name(dtype: str) -> bool:
+    try:
+        return pd.api.types.is_numeric_dtype(pd.api.types.pandas_dtype(dtype))
+    except TypeError:
+        return False
+
+
+def _dtype_category_from_name(dtype: str) -> str:
+    try:
+        resolved = pd.api.types.pandas_dtype(dtype)
+    except TypeError:
+        return "categorical"
+    if pd.api.types.is_datetime64_any_dtype(resolved):
+        return "datetime"
+    if pd.api.types.is_bool_dtype(resolved):
+        return "boolean"
+    return "categorical"
@@ -0,0 +1,171 @@
+"""プロファイルキャッシュ
+
+CSVの内容ハッシュとプロファイラのバージョンをキーに、プロファイル結果を保持する。
+メモリ上のLRU（合計サイズで追い出し）と、任意のSQLiteによるディスク層の2段構成。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from app.core.config import settings
+
+# ハッシュ計算時に一度にエンコードする文字数
+_HASH_SLICE_CHARS = 16 * 1024 * 1024
+
+
+def content_hash(csv_data: str) -> str:
+    """CSV文字列の内容ハッシュを計算（全体のバイト列コピーを作らずに分割して処理）
+
+    SHA-256 は多くのCPUでハードウェア命令により高速に計算できる。
+    """
+    hasher = hashlib.sha256()
+    for start in range(0, len(csv_data), _HASH_SLICE_CHARS):
+        hasher.update(csv_data[start:start + _HASH_SLICE_CHARS].encode("utf-8"))
+    return hasher.hexdigest()
+
+
+class ProfileCache:
+    """2段構成のプロファイルキャッシュ
+
+    get で返す辞書はキャッシュ内のオブジェクトそのものなので、呼び出し側で変更しないこと。
+    """
+
+    def __init__(self, max_bytes: int, db_path: Optional[str] = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, tuple[dict, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "disk_evictions": 0}
+        if db_path:
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS profile_cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+                )
+
+    def get(self, key: str) -> Optional[dict]:
+        """キャッシュからプロファイルを取得（なければ None）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return entry[0]
+
+        if self.db_path:
+            with self._connect() as conn:
+                row = conn.execute("SELECT value FROM profile_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE profile_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            if row is not None:
+                profile = json.loads(row[0])
+                with self._lock:
+                    self._counters["disk_hits"] += 1
+                    self._put_memory(key, profile, len(row[0]))
+                return profile
+
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def put(self, key: str, profile: dict) -> None:
+        """プロファイルをキャッシュに登録"""
+        serialized = json.dumps(profile, ensure_ascii=False)
+        size = len(serialized)
+        with self._lock:
+            self._put_memory(key, profile, size)
+
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO profile_cache (key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, serialized, size, time.time()),
+                )
+                self._evict_disk(conn)
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """指定キー（省略時は全エントリ）を無効化"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._bytes = 0
+            elif key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+
+        if self.db_path:
+            with self._connect() as conn:
+                if key is None:
+                    conn.execute("DELETE FROM profile_cache")
+                else:
+                    conn.execute("DELETE FROM profile_cache WHERE key = ?", (key,))
+
+    def stats(self) -> dict:
+        """ヒット・ミス・追い出しの件数と使用量を取得"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes})
+        if self.db_path:
+            with self._connect() as conn:
+                entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM profile_cache").fetchone()
+            stats.update({"disk_entries": entries, "disk_bytes": size})
+        return stats
+
+    def _put_memory(self, key: str, profile: dict, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (profile, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._counters["evictions"] += 1
+
+    def _evict_disk(self, conn: sqlite3.Connection) -> None:
+        if self.disk_max_bytes <= 0:
+            return
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM profile_cache").fetchone()[0]
+        rows = conn.execute("SELECT key, size FROM profile_cache ORDER BY accessed_at").fetchall()
+        for key, size in rows:
+            if total <= self.disk_max_bytes:
+                break
+            conn.execute("DELETE FROM profile_cache WHERE key = ?", (key,))
+            total -= size
+            with self._lock:
+                self._counters["disk_evictions"] += 1
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+
+_cache: Optional[ProfileCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_profile_cache() -> Optional[ProfileCache]:
+    """設定に基づく共有キャッシュを取得（無効化されている場合は None）"""
+    global _cache
+    if not settings.PROFILE_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ProfileCache(
+                max_bytes=settings.PROFILE_CACHE_MAX_BYTES,
+                db_path=settings.PROFILE_CACHE_DB_PATH,
+                disk_max_bytes=settings.PROFILE_CACHE_DISK_MAX_BYTES,
+            )
+        return _cache
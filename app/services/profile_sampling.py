@@ -0,0 +1,160 @@
+"""サンプリングによる高速プロファイリング
+
+固定サイズのリザーバサンプルをプロファイリングし、母集団の値を
+信頼区間付きで推定する。プロファイル計算のコストはサンプルサイズのみに依存する。
+"""
+import math
+from statistics import NormalDist
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+def reservoir_sample(chunks: Iterable[pd.DataFrame], size: int, seed: Optional[int] = None) -> tuple[pd.DataFrame, int]:
+    """チャンクの列から一様なリザーバサンプルを抽出
+
+    各行に一様乱数のキーを割り当て、キーが小さい順に size 行を保持する
+    （ボトムkサンプリング。Algorithm R と同じ分布になる）。
+
+    Returns:
+        (サンプルのDataFrame, 全行数)
+    """
+    rng = np.random.default_rng(seed)
+    sample: Optional[pd.DataFrame] = None
+    keys = np.empty(0)
+    total_rows = 0
+
+    for chunk in chunks:
+        total_rows += len(chunk)
+        chunk_keys = rng.random(len(chunk))
+        if sample is None:
+            sample, keys = chunk.iloc[:0], np.empty(0)
+        candidates = pd.concat([sample, chunk], ignore_index=True)
+        candidate_keys = np.concatenate([keys, chunk_keys])
+        if len(candidates) > size:
+            keep = np.sort(np.argpartition(candidate_keys, size - 1)[:size])
+            candidates = candidates.iloc[keep].reset_index(drop=True)
+            candidate_keys = candidate_keys[keep]
+        sample, keys = candidates, candidate_keys
+
+    if sample is None:
+        sample = pd.DataFrame()
+    return sample, total_rows
+
+
+def extrapolate_profile(profile: dict, sample: pd.DataFrame, total_rows: int, confidence: float) -> dict:
+    """サンプルのプロファイルを母集団の推定値に変換し、信頼区間を付与
+
+    Args:
+        profile: サンプルに対する profile_dataframe の結果（上書きされる）
+        sample: プロファイル対象のサンプル
+        total_rows: 母集団の行数
+        confidence: 信頼水準（例: 0.95）
+
+    Returns:
+        推定値と信頼区間を含むプロファイル
+    """
+    n = len(sample)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    fpc = _finite_population_correction(n, total_rows)
+    scale = total_rows / n if n > 0 else 0
+
+    profile["missing_values"] = 0
+    for i, col in enumerate(sample.columns):
+        col_profile = profile["column_profiles"][col]
+        intervals = {}
+
+        # 欠損率とそれに基づく件数
+        missing_rate = col_profile["missing_rate"]
+        low, high = _proportion_interval(missing_rate, n, z, fpc)
+        intervals["missing_rate"] = [low, high]
+        col_profile["missing"] = int(round(missing_rate * total_rows))
+        col_profile["count"] = total_rows - col_profile["missing"]
+        intervals["missing"] = [low * total_rows, high * total_rows]
+        intervals["count"] = [(1 - high) * total_rows, (1 - low) * total_rows]
+        profile["missing_values"] += col_profile["missing"]
+
+        # ユニーク数（Haas-StokesのDuj1推定量。下限は観測値、上限はサンプル中で
+        # 1回だけ現れた値がそれぞれ母集団で別の値を代表している場合）
+        series = sample.iloc[:, i]
+        counts = series.value_counts()
+        distinct = len(counts)
+        singletons = int((counts == 1).sum())
+        if 0 < n < total_rows:
+            unique = n * distinct / (n - singletons + singletons * n / total_rows)
+            unique_upper = scale * singletons + distinct - singletons
+        else:
+            unique = unique_upper = distinct
+        col_profile["unique"] = int(round(min(unique, col_profile["count"])))
+        col_profile["unique_rate"] = float(col_profile["unique"] / total_rows) if total_rows > 0 else 0
+        intervals["unique"] = [float(distinct), float(min(unique_upper, col_profile["count"]))]
+        intervals["unique_rate"] = [v / total_rows if total_rows > 0 else 0 for v in intervals["unique"]]
+
+        if "mean" in col_profile:
+            values = np.sort(series.to_numpy(dtype=np.float64, na_value=np.nan))
+            values = values[~np.isnan(values)]
+            m = len(values)
+            value_fpc = _finite_population_correction(m, col_profile["count"])
+            std = col_profile["std"]
+            mean_half = z * std / math.sqrt(m) * value_fpc
+            intervals["mean"] = [col_profile["mean"] - mean_half, col_profile["mean"] + mean_half]
+            std_half = z * std / math.sqrt(2 * (m - 1)) * value_fpc if m > 1 else 0
+            intervals["std"] = [max(std - std_half, 0.0), std + std_half]
+            for key, q in (("q1", 0.25), ("median", 0.5), ("q3", 0.75)):
+                intervals[key] = _quantile_interval(values, q, z, value_fpc)
+            # サンプルの最小/最大は母集団の最小の上界・最大の下界
+            intervals["min"] = [None if m < col_profile["count"] else col_profile["min"], col_profile["min"]]
+            intervals["max"] = [col_profile["max"], None if m < col_profile["count"] else col_profile["max"]]
+
+            if "outliers_rate" in col_profile:
+                rate = col_profile["outliers_rate"]
+                low, high = _proportion_interval(rate, m, z, value_fpc)
+                intervals["outliers_rate"] = [low, high]
+                col_profile["outliers_count"] = int(round(rate * col_profile["count"]))
+                intervals["outliers_count"] = [low * col_profile["count"], high * col_profile["count"]]
+
+        if "top_values" in col_profile:
+            col_profile["top_values"] = {k: int(round(v * scale)) for k, v in col_profile["top_values"].items()}
+
+        col_profile["missing_rate"] = float(missing_rate)
+        col_profile["confidence_intervals"] = intervals
+
+    profile["rows"] = total_rows
+    cells = total_rows * len(sample.columns)
+    profile["missing_rate"] = float(profile["missing_values"] / cells) if cells > 0 else 0
+    profile["sample_size"] = n
+    profile["confidence_level"] = confidence
+    return profile
+
+
+def _finite_population_correction(n: int, population: int) -> float:
+    """有限母集団修正係数（全数の場合は0）"""
+    if population <= 1 or n >= population:
+        return 0.0
+    return math.sqrt((population - n) / (population - 1))
+
+
+def _proportion_interval(p: float, n: int, z: float, fpc: float) -> tuple[float, float]:
+    """比率のWilson信頼区間（有限母集団修正を実効サンプルサイズで反映）"""
+    if n == 0:
+        return 0.0, 1.0
+    if fpc == 0:
+        return p, p
+    n_eff = n / (fpc * fpc)
+    denominator = 1 + z * z / n_eff
+    center = (p + z * z / (2 * n_eff)) / denominator
+    half = z / denominator * math.sqrt(p * (1 - p) / n_eff + z * z / (4 * n_eff * n_eff))
+    return max(center - half, 0.0), min(center + half, 1.0)
+
+
+def _quantile_interval(sorted_values: np.ndarray, q: float, z: float, fpc: float) -> list[float]:
+    """順序統計量による分布に依存しない分位点の信頼区間"""
+    m = len(sorted_values)
+    if fpc == 0:
+        value = float(np.quantile(sorted_values, q))
+        return [value, value]
+    half = z * math.sqrt(m * q * (1 - q)) * fpc
+    lower = int(max(math.floor(m * q - half), 0))
+    upper = int(min(math.ceil(m * q + half), m - 1))
+    return [float(sorted_values[lower]), float(sorted_values[upper])]
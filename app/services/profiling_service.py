@@ -1,45 +1,353 @@
 """データプロファイリングサービス"""
+import warnings
+import numpy as np
 import pandas as pd
 from io import StringIO
-from typing import Optional
+from typing import Callable, Iterable, Optional, Union, TextIO
 
+from app.core.config import settings
+from app.exceptions import ValidationException
+from app.services.profile_accumulators import (
+    ProfileAccumulator, outlier_fences, count_outliers, estimate_outliers
+)
+from app.services.profile_sampling import reservoir_sample, extrapolate_profile
+from app.services.profile_cache import content_hash, get_profile_cache
+from app.services import columnar_store, csv_ingest, parallel_profiling
 
-def profile_csv_data(csv_data: str) -> dict:
+# 数値ブロック1つあたりのメモリ上限（バイト）
+NUMERIC_BLOCK_BYTES = 256 * 1024 * 1024
+# 一括計算する分位点（q1, median, q3）
+QUANTILES = (0.25, 0.5, 0.75)
+
+
+# プロファイル結果の形式・計算方法を変更した場合は更新する（キャッシュキーに含まれる）
+PROFILER_VERSION = "3"
+
+# プロファイリングモード
+PROFILE_MODES = ("exact", "stream", "sample")
+
+# 品質問題のしきい値
+MISSING_RATE_THRESHOLDS = (0.1, 0.5)
+OUTLIERS_RATE_THRESHOLD = 0.1
+UNIQUE_RATE_THRESHOLD = 0.9
+
+
+def profile_csv_data(
+    csv_data: str,
+    mode: str = "exact",
+    sample_size: Optional[int] = None,
+    use_cache: bool = True,
+) -> dict:
     """CSVデータをプロファイリング
     
+    同じ内容・同じモードのCSVは、プロファイルキャッシュから結果を返す。
+    キャッシュから返される辞書は共有されるため、呼び出し側で変更しないこと。
+    
     Args:
         csv_data: CSV形式の文字列データ
+        mode: exact（全件を読み込んで厳密に計算）、stream（チャンク単位で近似計算）、
+            sample（固定サイズのサンプルから信頼区間付きで推定）
+        sample_size: sampleモードのサンプルサイズ（省略時は設定値）
+        use_cache: プロファイルキャッシュを使用するか
+    
+    Returns:
+        プロファイル情報の辞書
+    """
+    return _profile_source(
+        lambda: csv_ingest.read_csv(StringIO(csv_data)),
+        lambda chunksize: _read_csv_chunks(StringIO(csv_data), chunksize),
+        lambda: content_hash(csv_data),
+        mode, sample_size, use_cache
+    )
+
+
+def profile_csv_file(
+    file_path: str,
+    data_hash: Optional[str] = None,
+    mode: str = "exact",
+    sample_size: Optional[int] = None,
+    use_cache: bool = True,
+    store_dir: Optional[str] = None,
+    schema: Optional[dict] = None,
+) -> dict:
+    """ディスク上のCSVファイルをプロファイリング
+    
+    Args:
+        file_path: CSVファイルのパス
+        data_hash: ファイル内容のSHA-256（アップロード時に計算済みの値）。
+            省略時はキャッシュを使用しない
+        mode: profile_csv_data と同じ
+        sample_size: sampleモードのサンプルサイズ（省略時は設定値）
+        use_cache: プロファイルキャッシュを使用するか
+        store_dir: カラム単位のバイナリ形式に変換済みの場合はその保存先。
+            指定時はCSVを解析せずにこちらから読み込む
+        schema: 保存済みの読み込み用スキーマ（app/services/csv_ingest.py）。
+            省略時は読み込みのたびにサンプルから推定する
+    
+    Returns:
+        プロファイル情報の辞書
+    """
+    if store_dir:
+        read_frame = lambda: columnar_store.load_frame(store_dir)
+        make_chunks = lambda chunksize: columnar_store.iter_chunks(store_dir, chunksize)
+    else:
+        read_frame = lambda: csv_ingest.read_csv(file_path, schema)
+        make_chunks = lambda chunksize: _read_csv_chunks(file_path, chunksize, schema)
+    return _profile_source(
+        read_frame, make_chunks, lambda: data_hash, mode, sample_size, use_cache and data_hash is not None
+    )
+
+
+def _profile_source(
+    read_frame: Callable[[], pd.DataFrame],
+    make_chunks: Callable[[int], Iterable[pd.DataFrame]],
+    compute_hash: Callable[[], Optional[str]],
+    mode: str,
+    sample_size: Optional[int],
+    use_cache: bool,
+) -> dict:
+    """モードに応じてCSVをプロファイリングし、結果をキャッシュする"""
+    if mode not in PROFILE_MODES:
+        raise ValidationException(f"不正なプロファイリングモードです: {mode}")
+    
+    cache = get_profile_cache() if use_cache else None
+    key = None
+    if cache is not None:
+        key = _profile_cache_key(compute_hash(), mode, sample_size)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    
+    if mode == "stream":
+        profile = profile_chunks_stream(make_chunks)
+    elif mode == "sample":
+        profile = profile_chunks_sample(make_chunks, sample_size)
+    else:
+        df = read_frame()
+        profile = profile_dataframe(df)
+        profile["mode"] = "exact"
+    
+    if cache is not None:
+        cache.put(key, profile)
+    return profile
+
+
+def _profile_cache_key(data_hash: str, mode: str, sample_size: Optional[int]) -> str:
+    """プロファイルキャッシュのキーを生成（結果に影響する設定値も含める）"""
+    parts = [PROFILER_VERSION, data_hash, mode]
+    if mode == "stream":
+        parts += [settings.PROFILING_QUANTILE_SKETCH_K, settings.PROFILING_HLL_PRECISION]
+    elif mode == "sample":
+        parts += [
+            sample_size or settings.PROFILING_SAMPLE_SIZE,
+            settings.PROFILING_SAMPLE_SEED,
+            settings.PROFILING_CONFIDENCE_LEVEL,
+            settings.PROFILING_CHUNK_SIZE,
+        ]
+    return ":".join(str(part) for part in parts)
+
+
+def profile_csv_stream(source: Union[str, TextIO], chunksize: Optional[int] = None) -> dict:
+    """CSVをチャンク単位で読みながらプロファイリング
+    
+    1パス目でマージ可能な統計量（Welford法の平均・分散、最小/最大、欠損数、
+    KLLスケッチによる分位点、HyperLogLogによるユニーク数）を集計し、
+    2パス目で近似四分位点から求めたフェンスを使って外れ値を数える。
+    メモリ使用量はチャンクサイズとスケッチの大きさのみに依存する。
+    
+    Args:
+        source: CSVファイルのパス、または先頭にシーク可能なテキストストリーム
+        chunksize: 1回に読み込む行数（省略時は設定値）
+    
+    Returns:
+        プロファイル情報の辞書。近似値を含むフィールドの誤差は
+        各カラムの error_bounds に格納される
+    """
+    return profile_chunks_stream(lambda size: _read_csv_chunks(source, size), chunksize)
+
+
+def profile_chunks_stream(
+    make_chunks: Callable[[int], Iterable[pd.DataFrame]],
+    chunksize: Optional[int] = None,
+) -> dict:
+    """チャンクの列をストリーミングでプロファイリング（profile_csv_stream の本体）
+    
+    Args:
+        make_chunks: チャンクサイズを受け取り、先頭からのチャンクのイテレータを返す関数
+            （外れ値の集計のため2回呼ばれる）
+        chunksize: 1回に読み込む行数（省略時は設定値）
+    """
+    chunksize = chunksize or settings.PROFILING_CHUNK_SIZE
+    accumulator = ProfileAccumulator(
+        quantile_k=settings.PROFILING_QUANTILE_SKETCH_K,
+        hll_precision=settings.PROFILING_HLL_PRECISION,
+    )
+    for chunk in make_chunks(chunksize):
+        accumulator.update(chunk)
+    profile = accumulator.finalize()
+    
+    # 外れ値の検出（近似四分位点によるIQR法の2パス目）
+    fences = outlier_fences(profile)
+    if fences:
+        outliers = dict.fromkeys(fences, 0)
+        for chunk in make_chunks(chunksize):
+            for col, count in count_outliers(chunk, fences).items():
+                outliers[col] += count
+        for col, count in outliers.items():
+            col_profile = profile["column_profiles"][col]
+            col_profile["outliers_count"] = count
+            col_profile["outliers_rate"] = float(count / col_profile["count"]) if col_profile["count"] > 0 else 0
+    
+    profile["mode"] = "stream"
+    return profile
+
+
+def profile_csv_sample(
+    source: Union[str, TextIO],
+    sample_size: Optional[int] = None,
+    chunksize: Optional[int] = None,
+) -> dict:
+    """CSVのリザーバサンプルをプロファイリング
+    
+    プロファイル計算はサンプルに対してのみ行うため、行数が増えても
+    計算時間はほぼ一定になる。各フィールドは母集団の推定値に変換され、
+    confidence_intervals に信頼区間（[下限, 上限]、片側のみの場合は null）が付与される。
+    
+    Args:
+        source: CSVファイルのパス、または先頭にシーク可能なテキストストリーム
+        sample_size: サンプルサイズ（省略時は設定値）
+        chunksize: 1回に読み込む行数（省略時は設定値）
     
     Returns:
         プロファイル情報の辞書
     """
-    df = pd.read_csv(StringIO(csv_data))
-    return profile_dataframe(df)
+    return profile_chunks_sample(lambda size: _read_csv_chunks(source, size), sample_size, chunksize)
+
+
+def profile_chunks_sample(
+    make_chunks: Callable[[int], Iterable[pd.DataFrame]],
+    sample_size: Optional[int] = None,
+    chunksize: Optional[int] = None,
+) -> dict:
+    """チャンクの列のリザーバサンプルをプロファイリング（profile_csv_sample の本体）"""
+    sample_size = sample_size or settings.PROFILING_SAMPLE_SIZE
+    if sample_size <= 0:
+        raise ValidationException("sample_size は1以上を指定してください")
+    chunksize = chunksize or settings.PROFILING_CHUNK_SIZE
+    
+    sample, total_rows = reservoir_sample(
+        make_chunks(chunksize), sample_size, seed=settings.PROFILING_SAMPLE_SEED
+    )
+    profile = extrapolate_profile(
+        profile_dataframe(sample), sample, total_rows, settings.PROFILING_CONFIDENCE_LEVEL
+    )
+    profile["mode"] = "sample"
+    return profile
+
+
+def profile_appended_chunks(
+    state: Optional[dict],
+    make_history_chunks: Callable[[int], Iterable[pd.DataFrame]],
+    delta_chunks: Iterable[pd.DataFrame],
+    chunksize: Optional[int] = None,
+) -> tuple[dict, dict]:
+    """保存済みのプロファイル状態に追記分のチャンクだけを加えてプロファイリング
+    
+    状態は streamモードと同じマージ可能な累積器で、追記分だけを集計してマージするため
+    計算時間は追記分の行数に比例する。外れ値は既存データを読み直さずに
+    KLLスケッチの順位から推定する（error_bounds の outliers_rate が誤差）。
+    状態が未保存、またはプロファイラのバージョン・スケッチの設定が異なる場合は、
+    既存データを一度だけ読み込んで状態を作り直す。
+    
+    Args:
+        state: 前回保存したプロファイル状態（未保存の場合は None）
+        make_history_chunks: チャンクサイズを受け取り、既存データのチャンクのイテレータを返す関数
+        delta_chunks: 追記分のチャンク
+        chunksize: 既存データを読み込む際の行数（省略時は設定値）
+    
+    Returns:
+        (プロファイル情報の辞書, 保存する更新後のプロファイル状態)
+    """
+    accumulator = _load_profile_state(state)
+    if accumulator is None:
+        accumulator = ProfileAccumulator(
+            quantile_k=settings.PROFILING_QUANTILE_SKETCH_K,
+            hll_precision=settings.PROFILING_HLL_PRECISION,
+        )
+        for chunk in make_history_chunks(chunksize or settings.PROFILING_CHUNK_SIZE):
+            accumulator.update(chunk)
+    
+    for chunk in delta_chunks:
+        accumulator.update(chunk)
+    
+    profile = accumulator.finalize()
+    estimate_outliers(accumulator, profile)
+    profile["mode"] = "incremental"
+    new_state = {"profiler_version": PROFILER_VERSION, "accumulator": accumulator.to_dict()}
+    return profile, new_state
+
+
+def _load_profile_state(state: Optional[dict]) -> Optional[ProfileAccumulator]:
+    """保存済みのプロファイル状態を復元（現在の設定で使えない場合は None）"""
+    if not state or state.get("profiler_version") != PROFILER_VERSION:
+        return None
+    data = state["accumulator"]
+    if (data["quantile_k"], data["hll_precision"]) != (
+        settings.PROFILING_QUANTILE_SKETCH_K, settings.PROFILING_HLL_PRECISION
+    ):
+        return None
+    return ProfileAccumulator.from_dict(data)
+
+
+def _read_csv_chunks(source: Union[str, TextIO], chunksize: int, schema: Optional[dict] = None):
+    """CSVをチャンク単位で読み込むイテレータを返す（スキーマ省略時はサンプルから推定する）"""
+    if schema is None:
+        schema = csv_ingest.infer_schema(source)
+    return csv_ingest.iter_csv_chunks(source, chunksize, schema)
 
 
 def profile_dataframe(df: pd.DataFrame) -> dict:
     """DataFrameをプロファイリング
     
+    数値カラムは2次元配列にまとめ、欠損・モーメント・最小/最大・分位点を
+    ブロック単位で一括計算する。それ以外のカラムは _profile_column で処理する。
+    カラム数が多い場合は設定に応じてシャード単位でプロセス並列に処理する。
+    
     Args:
         df: 分析対象のDataFrame
     
     Returns:
         プロファイル情報の辞書
     """
+    n_rows = len(df)
+    n_columns = len(df.columns)
+    
+    numeric_positions = [
+        i for i in range(n_columns) if pd.api.types.is_numeric_dtype(df.dtypes.iloc[i])
+    ]
+    if parallel_profiling.parallel_enabled(n_columns):
+        column_profiles = parallel_profiling.profile_columns_parallel(df, numeric_positions)
+    else:
+        column_profiles = _profile_numeric_columns(df, numeric_positions)
+        for i, col in enumerate(df.columns):
+            if i not in column_profiles:
+                column_profiles[i] = _profile_column(df.iloc[:, i])
+    
     profile = {
-        "rows": len(df),
-        "columns": len(df.columns),
-        "missing_values": int(df.isnull().sum().sum()),
-        "missing_rate": float(df.isnull().sum().sum() / (len(df) * len(df.columns))) if len(df) > 0 else 0,
+        "rows": n_rows,
+        "columns": n_columns,
+        "missing_values": 0,
+        "missing_rate": 0,
         "numeric_columns": [],
         "categorical_columns": [],
         "datetime_columns": [],
         "column_profiles": {}
     }
     
-    for col in df.columns:
-        col_profile = _profile_column(df[col])
+    for i, col in enumerate(df.columns):
+        col_profile = column_profiles[i]
         profile["column_profiles"][col] = col_profile
+        profile["missing_values"] += col_profile["missing"]
         
         # カラムの分類
         if col_profile["dtype_category"] == "numeric":
@@ -49,19 +357,136 @@ def profile_dataframe(df: pd.DataFrame) -> dict:
         else:
             profile["categorical_columns"].append(col)
     
+    if n_rows > 0 and n_columns > 0:
+        profile["missing_rate"] = float(profile["missing_values"] / (n_rows * n_columns))
+    
     return profile
 
 
+def _profile_numeric_columns(df: pd.DataFrame, positions: list[int]) -> dict[int, dict]:
+    """数値カラムをブロック単位でまとめてプロファイリング
+    
+    Returns:
+        カラム位置をキーとするカラムプロファイルの辞書
+    """
+    profiles = {}
+    if not positions:
+        return profiles
+    
+    n_rows = len(df)
+    # 1ブロックあたりのメモリ使用量が上限を超えないようにカラム数を決める
+    block_width = max(1, NUMERIC_BLOCK_BYTES // max(n_rows * 8, 1))
+    
+    for start in range(0, len(positions), block_width):
+        block_positions = positions[start:start + block_width]
+        values = df.iloc[:, block_positions].to_numpy(dtype=np.float64, na_value=np.nan)
+        columns = [df.iloc[:, pos] for pos in block_positions]
+        block_profiles = _numeric_block_profiles(
+            values,
+            [str(series.dtype) for series in columns],
+            [_get_dtype_category(series) for series in columns],
+            [int(series.nunique()) for series in columns],
+        )
+        profiles.update(zip(block_positions, block_profiles))
+    
+    return profiles
+
+
+def _numeric_block_profiles(
+    values: np.ndarray,
+    dtypes: list[str],
+    dtype_categories: list[str],
+    unique_counts: list[int],
+) -> list[dict]:
+    """数値ブロック（行×カラムの2次元配列）からカラムプロファイルを生成
+    
+    dtype などの元のカラムの情報は呼び出し側から渡す（プロセス間でSeriesを渡さずに済むように）。
+    """
+    n_rows = values.shape[0]
+    stats = _numeric_block_stats(values)
+    profiles = []
+    for j in range(values.shape[1]):
+        count = int(stats["count"][j])
+        missing = n_rows - count
+        unique = unique_counts[j]
+        profile = {
+            "dtype": dtypes[j],
+            "dtype_category": dtype_categories[j],
+            "count": count,
+            "missing": missing,
+            "missing_rate": float(missing / n_rows) if n_rows > 0 else 0,
+            "unique": unique,
+            "unique_rate": float(unique / n_rows) if n_rows > 0 else 0,
+        }
+        if count > 0:
+            profile.update({
+                "mean": float(stats["mean"][j]),
+                "std": float(stats["std"][j]) if count > 1 else 0,
+                "min": float(stats["min"][j]),
+                "max": float(stats["max"][j]),
+                "median": float(stats["median"][j]),
+                "q1": float(stats["q1"][j]),
+                "q3": float(stats["q3"][j]),
+                "outliers_count": int(stats["outliers_count"][j]),
+                "outliers_rate": float(stats["outliers_count"][j] / count),
+            })
+        profiles.append(profile)
+    
+    return profiles
+
+
+def _numeric_block_stats(values: np.ndarray) -> dict[str, np.ndarray]:
+    """数値ブロック（行×カラムの2次元配列）の統計量をカラムごとに一括計算
+    
+    欠損はNaNで表現されている前提。非欠損値が0件のカラムの統計量はNaNになる。
+    """
+    null_mask = np.isnan(values)
+    count = values.shape[0] - null_mask.sum(axis=0)
+    
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        # 全欠損カラムに対する "All-NaN slice" / "Mean of empty slice" 警告を抑制
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nansum(values, axis=0) / count
+        squared_dev = np.nansum((values - mean) ** 2, axis=0)
+        std = np.sqrt(squared_dev / (count - 1))
+        if values.shape[0] > 0:
+            q1, median, q3 = np.nanquantile(values, QUANTILES, axis=0)
+        else:
+            q1 = median = q3 = np.full(values.shape[1], np.nan)
+        min_values = np.nanmin(values, axis=0, initial=np.inf)
+        max_values = np.nanmax(values, axis=0, initial=-np.inf)
+    
+    # 外れ値の検出（IQR法）。NaNとの比較は常にFalseになる
+    iqr = q3 - q1
+    lower_bound = q1 - 1.5 * iqr
+    upper_bound = q3 + 1.5 * iqr
+    outliers_count = ((values < lower_bound) | (values > upper_bound)).sum(axis=0)
+    
+    return {
+        "count": count,
+        "mean": mean,
+        "std": std,
+        "min": min_values,
+        "max": max_values,
+        "median": median,
+        "q1": q1,
+        "q3": q3,
+        "outliers_count": outliers_count,
+    }
+
+
 def _profile_column(series: pd.Series) -> dict:
     """単一カラムをプロファイリング"""
+    missing = int(series.isnull().sum())
+    unique = int(series.nunique())
     profile = {
         "dtype": str(series.dtype),
         "dtype_category": _get_dtype_category(series),
-        "count": int(series.count()),
-        "missing": int(series.isnull().sum()),
-        "missing_rate": float(series.isnull().sum() / len(series)) if len(series) > 0 else 0,
-        "unique": int(series.nunique()),
-        "unique_rate": float(series.nunique() / len(series)) if len(series) > 0 else 0,
+        "count": len(series) - missing,
+        "missing": missing,
+        "missing_rate": float(missing / len(series)) if len(series) > 0 else 0,
+        "unique": unique,
+        "unique_rate": float(unique / len(series)) if len(series) > 0 else 0,
     }
     
     # 数値型の場合
@@ -109,6 +534,9 @@ def _get_dtype_category(series: pd.Series) -> str:
 def detect_data_quality_issues(profile: dict) -> list[dict]:
     """データ品質の問題を検出
     
+    sampleモードのプロファイルでは、信頼区間がしきい値をまたぐ問題を
+    uncertain=True として返す（推定値がしきい値未満でも検出対象に含める）。
+    
     Args:
         profile: プロファイル情報
     
@@ -120,47 +548,62 @@ def detect_data_quality_issues(profile: dict) -> list[dict]:
     # 欠損値の多いカラム
     for col, col_profile in profile.get("column_profiles", {}).items():
         missing_rate = col_profile.get("missing_rate", 0)
-        if missing_rate > 0.5:
+        uncertain = _is_near_threshold(col_profile, "missing_rate", MISSING_RATE_THRESHOLDS)
+        if missing_rate > MISSING_RATE_THRESHOLDS[1]:
             issues.append({
                 "type": "high_missing_rate",
                 "severity": "high",
                 "column": col,
                 "message": f"カラム '{col}' の欠損率が {missing_rate:.1%} と高いです",
-                "suggestion": "削除または適切な補完を検討してください"
+                "suggestion": "削除または適切な補完を検討してください",
+                "uncertain": uncertain
             })
-        elif missing_rate > 0.1:
+        elif missing_rate > MISSING_RATE_THRESHOLDS[0] or uncertain:
             issues.append({
                 "type": "moderate_missing_rate",
                 "severity": "medium",
                 "column": col,
                 "message": f"カラム '{col}' に {missing_rate:.1%} の欠損があります",
-                "suggestion": "補完方法を検討してください"
+                "suggestion": "補完方法を検討してください",
+                "uncertain": uncertain
             })
     
     # 外れ値の多いカラム
     for col, col_profile in profile.get("column_profiles", {}).items():
         outliers_rate = col_profile.get("outliers_rate", 0)
-        if outliers_rate > 0.1:
+        uncertain = _is_near_threshold(col_profile, "outliers_rate", (OUTLIERS_RATE_THRESHOLD,))
+        if outliers_rate > OUTLIERS_RATE_THRESHOLD or uncertain:
             issues.append({
                 "type": "high_outliers",
                 "severity": "medium",
                 "column": col,
                 "message": f"カラム '{col}' に {outliers_rate:.1%} の外れ値があります",
-                "suggestion": "外れ値の処理を検討してください"
+                "suggestion": "外れ値の処理を検討してください",
+                "uncertain": uncertain
             })
     
     # 高カーディナリティのカテゴリ列
     for col in profile.get("categorical_columns", []):
         col_profile = profile.get("column_profiles", {}).get(col, {})
         unique_rate = col_profile.get("unique_rate", 0)
-        if unique_rate > 0.9:
+        uncertain = _is_near_threshold(col_profile, "unique_rate", (UNIQUE_RATE_THRESHOLD,))
+        if unique_rate > UNIQUE_RATE_THRESHOLD or uncertain:
             issues.append({
                 "type": "high_cardinality",
                 "severity": "low",
                 "column": col,
                 "message": f"カラム '{col}' のユニーク率が {unique_rate:.1%} と高いです",
-                "suggestion": "IDカラムの可能性があります。特徴量として使用する場合は注意してください"
+                "suggestion": "IDカラムの可能性があります。特徴量として使用する場合は注意してください",
+                "uncertain": uncertain
             })
     
     return issues
 
+
+def _is_near_threshold(col_profile: dict, field: str, thresholds: tuple) -> bool:
+    """フィールドの信頼区間がいずれかのしきい値をまたぐか"""
+    interval = (col_profile.get("confidence_intervals") or {}).get(field)
+    if not interval:
+        return False
+    lower, upper = interval
+    return any(lower <= threshold <= upper for threshold in thresholds)
@@ -0,0 +1,167 @@
+"""ステップ単位の中間結果キャッシュ
+
+各ステップの実行後のDataFrameを、入力データのハッシュとそのステップまでのコードの連鎖ハッシュを
+キーにカラム単位のバイナリ形式（app/services/columnar_store.py）でディスクに保存する。
+プランの途中のステップを編集して再実行した場合、変更のない先頭のステップは保存済みの結果から
+再開する（最も長く一致する接頭辞を使う）。
+
+ディレクトリ構成:
+    <root_key>/summary.json   入力データのサマリとカラムのフィンガープリント（再開時に入力を読み込まずに
+                              before_summary を記録し、after_summary の差分計算に使う）
+    <key>/                    ステップ実行後のDataFrame（columnar_store の形式）
+
+合計サイズが上限を超えた場合は、最後に使われた時刻が古いエントリから削除する。
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Optional
+
+import pandas as pd
+
+from app.core.config import settings
+from app.schemas.plan_operation import StepSource
+from app.services import columnar_store
+from app.services.plan_operators import source_key
+
+# キャッシュの形式・実行方法を変更した場合に上げる（古いエントリは使われずに追い出される）
+STEP_CACHE_VERSION = "2"
+
+SUMMARY_FILE = "summary.json"
+
+
+def chain_keys(input_hash: str, codes: list[StepSource]) -> tuple[str, list[str]]:
+    """入力データのキーと、各ステップ実行後の連鎖キーを計算
+
+    Returns:
+        (入力データのキー, ステップ i 実行後のキーのリスト)
+    """
+    key = hashlib.sha256(f"{STEP_CACHE_VERSION}:{pd.__version__}:{input_hash}".encode()).hexdigest()
+    root_key = key
+    keys = []
+    for code in codes:
+        code_hash = hashlib.sha256(source_key(code).encode("utf-8")).hexdigest()
+        key = hashlib.sha256(f"{key}:{code_hash}".encode()).hexdigest()
+        keys.append(key)
+    return root_key, keys
+
+
+def write_checkpoint(df: pd.DataFrame, cache_dir: str, key: str, max_bytes: int) -> int:
+    """DataFrameをキャッシュに保存し、保存したバイト数を返す（DataFrame以外・保存できない型・上限超過の場合は0）
+
+    ステップ実行バックエンドのワーカー上で呼ばれるため、モジュールレベルの関数にしている。
+    """
+    if not isinstance(df, pd.DataFrame):
+        return 0
+    if max_bytes > 0 and int(df.memory_usage(index=True).sum()) > max_bytes:
+        return 0
+    entry_dir = os.path.join(cache_dir, key)
+    try:
+        columnar_store.write_frame(df, entry_dir)
+    except (ValueError, TypeError, OSError):
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        return 0
+    return _entry_size(entry_dir)
+
+
+class StepCache:
+    """ステップ単位の中間結果キャッシュ"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def longest_prefix(self, keys: list[str]) -> int:
+        """保存済みの結果がある最も後ろのステップ数を返す（なければ0）"""
+        for i in range(len(keys), 0, -1):
+            if os.path.exists(os.path.join(self.cache_dir, keys[i - 1], columnar_store.SCHEMA_FILE)):
+                return i
+        return 0
+
+    def load(self, key: str) -> pd.DataFrame:
+        """保存済みの結果を読み込む（最終使用時刻を更新する）"""
+        entry_dir = os.path.join(self.cache_dir, key)
+        df = columnar_store.load_frame(entry_dir)
+        self._touch(entry_dir)
+        return df
+
+    def get_summary(self, root_key: str) -> Optional[tuple[dict, dict]]:
+        """保存済みの入力データの (サマリ, フィンガープリント) を取得（なければ None）"""
+        entry_dir = os.path.join(self.cache_dir, root_key)
+        try:
+            with open(os.path.join(entry_dir, SUMMARY_FILE), encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._touch(entry_dir)
+        return saved["summary"], saved["fingerprints"]
+
+    def put_summary(self, root_key: str, summary: dict, fingerprints: dict) -> None:
+        """入力データのサマリとフィンガープリントを保存"""
+        entry_dir = os.path.join(self.cache_dir, root_key)
+        os.makedirs(entry_dir, exist_ok=True)
+        path = os.path.join(entry_dir, SUMMARY_FILE)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "fingerprints": fingerprints}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def evict(self) -> int:
+        """合計サイズが上限以下になるまで古いエントリを削除し、削除した件数を返す"""
+        if self.max_bytes <= 0:
+            return 0
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                entry_dir = os.path.join(self.cache_dir, name)
+                if name.endswith(".tmp") or not os.path.isdir(entry_dir):
+                    continue
+                try:
+                    entries.append((os.path.getmtime(entry_dir), _entry_size(entry_dir), entry_dir))
+                except OSError:
+                    continue
+            total = sum(size for _, size, _ in entries)
+            evicted = 0
+            for _, size, entry_dir in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                total -= size
+                evicted += 1
+            return evicted
+
+    @staticmethod
+    def _touch(entry_dir: str) -> None:
+        try:
+            now = time.time()
+            os.utime(entry_dir, (now, now))
+        except OSError:
+            pass
+
+
+def _entry_size(entry_dir: str) -> int:
+    size = 0
+    for name in os.listdir(entry_dir):
+        size += os.path.getsize(os.path.join(entry_dir, name))
+    return size
+
+
+_cache: Optional[StepCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_step_cache() -> Optional[StepCache]:
+    """設定に基づく共有キャッシュを取得（無効化されている場合は None）"""
+    global _cache
+    if not settings.EXECUTION_STEP_CACHE_ENABLED:
+        return None
+    cache_dir = settings.EXECUTION_STEP_CACHE_DIR or os.path.join(settings.DATA_DIR, "step_cache")
+    with _cache_lock:
+        if _cache is None or _cache.cache_dir != cache_dir:
+            _cache = StepCache(cache_dir, settings.EXECUTION_STEP_CACHE_MAX_BYTES)
+        return _cache
@@ -0,0 +1,219 @@
+"""プランステップの依存関係の解析
+
+各ステップのコードの構文木から、読み込むカラムと書き込むカラムを求める。df へのアクセスが
+すべて定数のカラム名（またはカラム名のリストを代入した変数、そのリストを回すループ変数）による
+df[...] の参照・代入であるステップだけを対象とし、それ以外（df 全体の参照・再代入、df.loc、
+行の絞り込み、グローバルな状態を変更する呼び出しなど）は解析できないステップとして扱う。
+
+書き込むカラムが他方の読み書きするカラムと重ならない2つのステップは依存関係がなく、
+それぞれのカラムだけを切り出したDataFrameで同時に実行して、プランの順に結果をマージできる
+（app/services/step_executor.py の run_step_group）。解析できないステップは前後のすべての
+ステップに依存する。
+"""
+import ast
+from typing import NamedTuple, Optional
+
+from app.schemas.plan_operation import StepSource
+from app.services.plan_operators import operation_columns
+
+# 他のステップと共有する状態（オプション・乱数など）を変更しうる名前
+_STATEFUL_NAMES = {
+    "set_option", "reset_option", "options", "random", "seed", "seterr",
+    "setattr", "delattr", "globals", "locals", "vars", "exec", "eval", "__import__",
+}
+
+
+class StepColumns(NamedTuple):
+    """ステップが読み込むカラムと書き込むカラム"""
+    reads: frozenset
+    writes: frozenset
+
+    def conflicts(self, other: "StepColumns") -> bool:
+        """どちらかの書き込むカラムを他方が読み書きするか"""
+        return bool(self.writes & (other.reads | other.writes) or other.writes & self.reads)
+
+
+class _UnsupportedStep(Exception):
+    """カラム単位で解析できない構文"""
+
+
+def analyze_columns(code: StepSource) -> Optional[StepColumns]:
+    """ステップが読み書きするカラムを求める（解析できない場合は None）"""
+    if isinstance(code, dict):
+        columns = operation_columns(code)
+        return None if columns is None else StepColumns(frozenset(columns[0]), frozenset(columns[1]))
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    analyzer = _ColumnAnalyzer()
+    try:
+        analyzer.statements(tree.body)
+    except _UnsupportedStep:
+        return None
+    return StepColumns(frozenset(analyzer.reads), frozenset(analyzer.writes))
+
+
+def build_dependencies(columns: list[Optional[StepColumns]]) -> list[set[int]]:
+    """各ステップが依存する（先に実行する必要がある）ステップの位置を求める"""
+    dependencies = []
+    for i, current in enumerate(columns):
+        dependencies.append({
+            j for j in range(i)
+            if current is None or columns[j] is None or current.conflicts(columns[j])
+        })
+    return dependencies
+
+
+def schedule(columns: list[Optional[StepColumns]], max_parallel: int) -> list[list[int]]:
+    """連続したステップを、互いに依存しない max_parallel 件以下のグループに分ける
+
+    ステップの順序は入れ替えない（ステップログ・中間結果キャッシュ・失敗時の打ち切りは
+    プランの順序に従うため）。
+    """
+    dependencies = build_dependencies(columns)
+    groups: list[list[int]] = []
+    for i in range(len(columns)):
+        group = groups[-1] if groups else None
+        if (
+            group is not None
+            and len(group) < max_parallel
+            and columns[i] is not None
+            and not dependencies[i] & set(group)
+        ):
+            group.append(i)
+        else:
+            groups.append([i])
+    return groups
+
+
+class _ColumnAnalyzer:
+    def __init__(self):
+        self.reads: set = set()
+        self.writes: set = set()
+        # カラム名の定数を代入したローカル変数とループ変数（名前 -> (カラム名, 種類)）。
+        # 種類は name（1つのカラム名。ループ変数はループするすべてのカラム名）, list, tuple
+        self.names: dict[str, tuple[tuple, str]] = {}
+
+    def statements(self, body: list[ast.stmt]) -> None:
+        for stmt in body:
+            self.statement(stmt)
+
+    def statement(self, stmt: ast.stmt) -> None:
+        if isinstance(stmt, (ast.Import, ast.ImportFrom)):
+            for alias in stmt.names:
+                name = (alias.asname or alias.name).split(".")[0]
+                if name == "df" or name in _STATEFUL_NAMES:
+                    raise _UnsupportedStep()
+                self.names.pop(name, None)
+        elif isinstance(stmt, ast.Expr):
+            self.expression(stmt.value)
+        elif isinstance(stmt, ast.Assign):
+            self.expression(stmt.value)
+            for target in stmt.targets:
+                self.target(target, _constant(stmt.value))
+        elif isinstance(stmt, ast.AugAssign):
+            self.expression(stmt.value)
+            if isinstance(stmt.target, ast.Subscript) and _is_frame(stmt.target.value):
+                self.reads.update(self.frame_columns(stmt.target))
+            self.target(stmt.target, None)
+        elif isinstance(stmt, ast.For) and not stmt.orelse and isinstance(stmt.target, ast.Name):
+            iterated = self.resolve(stmt.iter)
+            if iterated is None or iterated[1] == "name":
+                self.expression(stmt.iter)
+                iterated = None
+            # 2回目以降の反復では、ループ内で代入される変数は1回目と異なる値になりうる
+            for name in _assigned_names(stmt.body):
+                self.names.pop(name, None)
+            self.bind(stmt.target.id, None if iterated is None else (iterated[0], "name"))
+            self.statements(stmt.body)
+        elif isinstance(stmt, ast.If):
+            self.expression(stmt.test)
+            names = dict(self.names)
+            self.statements(stmt.body)
+            body_names, self.names = self.names, names
+            self.statements(stmt.orelse)
+            # どちらの分岐でも同じ値の変数だけを残す
+            self.names = {k: v for k, v in self.names.items() if body_names.get(k) == v}
+        elif isinstance(stmt, ast.Pass):
+            pass
+        else:
+            raise _UnsupportedStep()
+
+    def target(self, target: ast.expr, value: Optional[tuple]) -> None:
+        if isinstance(target, ast.Name):
+            self.bind(target.id, value)
+        elif isinstance(target, ast.Tuple):
+            for element in target.elts:
+                self.target(element, None)
+        elif isinstance(target, ast.Subscript) and _is_frame(target.value):
+            self.writes.update(self.frame_columns(target))
+        else:
+            raise _UnsupportedStep()
+
+    def bind(self, name: str, value: Optional[tuple]) -> None:
+        if name in ("df", "pd") or name in _STATEFUL_NAMES:
+            raise _UnsupportedStep()
+        if value is None:
+            self.names.pop(name, None)
+        else:
+            self.names[name] = value
+
+    def expression(self, node: ast.AST) -> None:
+        if isinstance(node, ast.Subscript) and _is_frame(node.value):
+            self.reads.update(self.frame_columns(node))
+            return
+        if isinstance(node, ast.Name) and (node.id == "df" or node.id in _STATEFUL_NAMES):
+            raise _UnsupportedStep()
+        if isinstance(node, ast.Attribute) and node.attr in _STATEFUL_NAMES:
+            raise _UnsupportedStep()
+        if isinstance(node, (ast.Lambda, ast.NamedExpr, ast.Await, ast.Yield, ast.YieldFrom)):
+            raise _UnsupportedStep()
+        if isinstance(node, (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+            # 内包表記の変数は同じ名前の外側の変数を隠す
+            names = dict(self.names)
+            for generator in node.generators:
+                for name in _assigned_names([generator.target]):
+                    self.names.pop(name, None)
+            for child in ast.iter_child_nodes(node):
+                self.expression(child)
+            self.names = names
+            return
+        for child in ast.iter_child_nodes(node):
+            self.expression(child)
+
+    def frame_columns(self, node: ast.Subscript) -> tuple:
+        """df[...] のカラム名（1つのカラム名、またはカラム名のリスト）"""
+        resolved = self.resolve(node.slice)
+        if resolved is None or resolved[1] == "tuple":
+            raise _UnsupportedStep()
+        return resolved[0]
+
+    def resolve(self, node: ast.AST) -> Optional[tuple]:
+        if isinstance(node, ast.Name):
+            return self.names.get(node.id)
+        return _constant(node)
+
+
+def _is_frame(node: ast.AST) -> bool:
+    return isinstance(node, ast.Name) and node.id == "df"
+
+
+def _constant(node: ast.AST) -> Optional[tuple]:
+    """カラム名の定数であれば (カラム名, 種類) を返す"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return (node.value,), "name"
+    if isinstance(node, (ast.List, ast.Tuple)) and all(
+        isinstance(e, ast.Constant) and isinstance(e.value, str) for e in node.elts
+    ):
+        return tuple(e.value for e in node.elts), "list" if isinstance(node, ast.List) else "tuple"
+    return None
+
+
+def _assigned_names(nodes: list[ast.AST]) -> set[str]:
+    names = set()
+    for node in nodes:
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store):
+                names.add(child.id)
+    return names
@@ -0,0 +1,631 @@
+"""プランステップの実行バックエンド
+
+- inprocess: APIプロセス内で exec する（従来の動作）
+- sandbox: 事前に起動したワーカープロセスで exec する
+
+sandbox では、1つの実行の間は同じワーカープロセスがDataFrameを保持し続け、
+親プロセスからは最初に一度だけ送る（pickle protocol 5 の out-of-band バッファを
+共有メモリ経由で渡し、ワーカーはコピーせずに共有メモリ上のバッファからDataFrameを復元する）。
+ステップごとにCPU時間（RLIMIT_CPU のソフトリミットと SIGXCPU）、実行時間（親プロセスからの強制終了）、
+メモリの上限を設け、上限を超えたステップは失敗として扱う。メモリの上限は RLIMIT_AS による
+仮想アドレス空間の上限で、RSS（実際に使用している物理メモリ）の上限ではない。共有メモリや
+ライブラリのマッピング、確保しただけで使っていない領域も含むため、RSS より大きい値になる。
+ワーカーへの要求が完了しなかった場合（タイムアウト・中断・異常終了・その他の例外）は、
+ワーカーとの通信の状態が分からないため、ワーカーを強制終了して新しいプロセスに置き換える。
+
+ステップのコードはプロセスごとのLRUキャッシュ（app/core/code_cache.py）でコンパイル済みの
+コードオブジェクトを再利用する。ワーカープロセスは実行をまたいで使い回すため、
+同じプランを繰り返し実行しても解析・コンパイルはワーカーごとに1回で済む。
+
+ステップごとに、CPU時間、ピークメモリ（実行中の最大RSSと開始時のRSSの差。/proc/self/clear_refs で
+最大RSSをリセットする）、実行前後のDataFrameのメモリ使用量・行数・カラム数を計測する。
+inprocess ではCPU時間は実行したスレッドのみ、ピークメモリは同じプロセスの他のスレッドの使用量も含む。
+
+依存関係のないステップのグループ（app/services/step_dependencies.py）は、それぞれが読み書きする
+カラムだけを切り出したDataFrameでスレッドを使って同時に実行し、プランの順にマージする。
+グループのCPU時間・実行時間の上限は1ステップの上限のステップ数倍とし、ステップごとの
+ピークメモリは計測しない。
+
+実行の取り消し・実行時間の上限（app/services/execution_cancellation.py）は executor.stop の
+イベントで通知する。sandbox では実行中のステップのワーカーを強制終了して中断し、inprocess では
+実行中のステップは止められないため、ステップの間でのみ中断する。
+"""
+import gc
+import multiprocessing
+import pickle
+import queue
+import resource
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Iterator, Optional
+
+import pandas as pd
+
+from app.core.code_cache import compile_step
+from app.core.config import settings
+from app.schemas.plan_operation import StepSource
+from app.services.plan_operators import apply_operation
+from app.services.step_dependencies import StepColumns
+
+EXECUTORS = ("sandbox", "inprocess")
+
+
+class StepCpuTimeExceeded(BaseException):
+    """ステップのCPU時間の上限超過（ユーザーコードの except Exception で捕捉されないよう BaseException）"""
+
+
+class StepInterrupted(Exception):
+    """実行中のステップの中断（executor.stop のイベントがセットされた）"""
+
+
+# 実行中のステップについて、中断の要求を確認する間隔（秒）
+_STOP_POLL_INTERVAL = 0.1
+# 中断したステップの status とエラーメッセージ
+_INTERRUPTED = ("cancelled", "実行の中断が要求されたため、ステップを強制終了しました")
+
+
+def frame_stats(df: Any) -> dict:
+    """DataFrameの行数・カラム数・メモリ使用量（バイト。文字列などのオブジェクトも含む）"""
+    if not isinstance(df, pd.DataFrame):
+        return {"rows": None, "columns": None, "memory_bytes": None}
+    return {
+        "rows": len(df),
+        "columns": len(df.columns),
+        "memory_bytes": int(df.memory_usage(index=True, deep=True).sum()),
+    }
+
+
+class _StepMeter:
+    """ステップ1回分のリソース使用量の計測（生成時に計測を開始する）"""
+
+    def __init__(self, cpu_clock: Callable[[], float]):
+        self.cpu_clock = cpu_clock
+        self.rss_start = _reset_peak_rss()
+        self.cpu_start = cpu_clock()
+
+    def finish(self, before: dict, after: Optional[dict]) -> dict:
+        """ExecutionStepLog のカラムと同じキーの計測結果を返す（失敗したステップは after を None にする）"""
+        cpu_time = self.cpu_clock() - self.cpu_start
+        peak = _read_proc_status("VmHWM")
+        peak_memory = max(peak - self.rss_start, 0) if peak is not None and self.rss_start is not None else None
+        return _step_metrics(cpu_time, peak_memory, before, after)
+
+
+def _step_metrics(cpu_time: float, peak_memory: Optional[int], before: dict, after: Optional[dict]) -> dict:
+    after = after or {}
+    return {
+        "cpu_time": cpu_time,
+        "peak_memory_bytes": peak_memory,
+        "memory_before_bytes": before["memory_bytes"],
+        "memory_after_bytes": after.get("memory_bytes"),
+        "rows_before": before["rows"],
+        "rows_after": after.get("rows"),
+        "columns_before": before["columns"],
+        "columns_after": after.get("columns"),
+    }
+
+
+def run_step_group(
+    df: pd.DataFrame, codes: list[StepSource], columns: list[StepColumns], stats: dict
+) -> tuple[pd.DataFrame, list[tuple], dict]:
+    """依存関係のないステップを同時に実行し、プランの順に df にマージする
+
+    各ステップは読み書きするカラムだけを切り出したDataFrameで実行し、書き込むカラムを df に戻す。
+    失敗したステップがあれば、順に実行した場合と同じく、そこまでのステップ（失敗したステップが
+    途中まで書き込んだカラムを含む）だけをマージする。
+
+    Args:
+        df: 現在のDataFrame
+        codes: ステップのコード（または構造化された操作）
+        columns: ステップが読み書きするカラム（step_dependencies.analyze_columns）
+        stats: 現在のDataFrameの frame_stats
+
+    Returns:
+        (マージ後のDataFrame, 実行したステップの (status, エラーメッセージ, リソース使用量, 実行時間) のリスト,
+        マージ後のDataFrameの frame_stats)
+    """
+    subs = [df[[c for c in df.columns if c in cols.reads or c in cols.writes]] for cols in columns]
+
+    def run(i: int) -> tuple[Optional[str], float, float]:
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            subs[i] = exec_step(codes[i], subs[i])
+            error = None
+        except MemoryError:
+            error = "メモリ使用量の上限を超えたため中断しました"
+        except Exception as e:
+            error = str(e)
+        return error, time.thread_time() - cpu_start, time.perf_counter() - start
+
+    # CPU時間の上限超過で中断した場合に、実行中のスレッドの終了を待たないよう with を使わない
+    pool = ThreadPoolExecutor(max_workers=len(codes), thread_name_prefix="step")
+    try:
+        outcomes = [future.result() for future in [pool.submit(run, i) for i in range(len(codes))]]
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    results = []
+    for i, (error, cpu_time, elapsed) in enumerate(outcomes):
+        before = stats
+        for col in subs[i].columns:
+            if col in columns[i].writes:
+                df[col] = subs[i][col]
+        if error is not None:
+            results.append(("failed", error, _step_metrics(cpu_time, None, before, None), elapsed))
+            break
+        stats = frame_stats(df)
+        results.append(("success", None, _step_metrics(cpu_time, None, before, stats), elapsed))
+    return df, results, stats
+
+
+class InProcessStepExecutor:
+    """現在のプロセスでステップを実行するバックエンド"""
+
+    def __init__(self):
+        self.df: Optional[pd.DataFrame] = None
+        self.alive = True
+        # 実行の中断を通知するイベント（inprocess では実行中のステップは中断しない）
+        self.stop: Optional[threading.Event] = None
+        self._stats = frame_stats(None)
+
+    def load(self, df: pd.DataFrame) -> None:
+        self.df = df
+        self._stats = frame_stats(df)
+
+    def run_step(self, code: StepSource) -> tuple[str, Optional[str], dict]:
+        """ステップを実行し、(success/failed, エラーメッセージ, リソース使用量) を返す"""
+        meter = _StepMeter(time.thread_time)
+        try:
+            self.df = exec_step(code, self.df)
+        except Exception as e:
+            return "failed", str(e), meter.finish(self._stats, None)
+        stats = frame_stats(self.df)
+        metrics = meter.finish(self._stats, stats)
+        self._stats = stats
+        return "success", None, metrics
+
+    def run_steps(self, codes: list[StepSource], columns: list[StepColumns]) -> list[tuple]:
+        """依存関係のないステップを同時に実行し、(status, エラーメッセージ, リソース使用量, 実行時間) のリストを返す
+
+        失敗したステップより後のステップの結果は含まない。
+        """
+        self.df, results, self._stats = run_step_group(self.df, codes, columns, self._stats)
+        return results
+
+    def call(self, func: Callable[..., Any], *args) -> Any:
+        """現在のDataFrameに関数を適用した結果を返す（func(df, *args)）"""
+        return func(self.df, *args)
+
+
+class SandboxStepExecutor:
+    """ワーカープロセスでステップを実行するバックエンド（SandboxPool.session で取得する）"""
+
+    def __init__(self, worker: "_SandboxWorker", wall_timeout: float, cpu_time: int):
+        self.worker = worker
+        self.wall_timeout = wall_timeout
+        self.cpu_time = cpu_time
+        # セットされると実行中のステップのワーカーを強制終了する
+        self.stop: Optional[threading.Event] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.worker.alive
+
+    def load(self, df: pd.DataFrame) -> None:
+        """DataFrameを共有メモリ経由でワーカーに送る"""
+        buffers: list[pickle.PickleBuffer] = []
+        header = pickle.dumps(df, protocol=5, buffer_callback=buffers.append)
+        raws = [buffer.raw() for buffer in buffers]
+        sizes = [raw.nbytes for raw in raws]
+        shm = shared_memory.SharedMemory(create=True, size=max(sum(sizes), 1))
+        try:
+            offset = 0
+            for raw in raws:
+                shm.buf[offset:offset + raw.nbytes] = raw
+                offset += raw.nbytes
+            status, error = self.worker.request(("load", header, shm.name, sizes), self.wall_timeout)
+        finally:
+            shm.close()
+            shm.unlink()
+        if status != "success":
+            raise RuntimeError(f"ワーカーにデータを送れません: {error}")
+
+    def run_step(self, code: StepSource) -> tuple[str, Optional[str], dict]:
+        """ステップを実行し、(success/failed, エラーメッセージ, リソース使用量) を返す
+
+        ワーカーが強制終了された場合はリソース使用量を計測できないため空の dict を返す。
+        stop のイベントで中断した場合は status が cancelled になる。
+        """
+        if not self.worker.alive:
+            return "failed", "ワーカープロセスが終了しています", {}
+        try:
+            return self.worker.request(("run", code, self.cpu_time), self.wall_timeout, self.stop)
+        except StepInterrupted:
+            return (*_INTERRUPTED, {})
+        except TimeoutError:
+            return "failed", f"実行時間の上限（{self.wall_timeout:g}秒）を超えたため中断しました", {}
+        except EOFError:
+            return "failed", self.worker.exit_message(), {}
+
+    def run_steps(self, codes: list[StepSource], columns: list[StepColumns]) -> list[tuple]:
+        """依存関係のないステップを同時に実行し、(status, エラーメッセージ, リソース使用量, 実行時間) のリストを返す
+
+        失敗したステップより後のステップの結果は含まない。グループの途中でワーカーを中断した場合は
+        先頭のステップの失敗として返す。
+        """
+        if not self.worker.alive:
+            return [("failed", "ワーカープロセスが終了しています", {}, 0.0)]
+        n = len(codes)
+        wall_timeout = self.wall_timeout * n
+        start = time.perf_counter()
+        try:
+            status, result = self.worker.request(
+                ("run_group", codes, columns, self.cpu_time * n), wall_timeout, self.stop
+            )
+        except StepInterrupted:
+            return [(*_INTERRUPTED, {}, time.perf_counter() - start)]
+        except TimeoutError:
+            message = f"実行時間の上限（{wall_timeout:g}秒）を超えたため中断しました"
+            return [("failed", message, {}, time.perf_counter() - start)]
+        except EOFError:
+            return [("failed", self.worker.exit_message(), {}, time.perf_counter() - start)]
+        if status != "success":
+            # CPU時間の上限を超えたスレッドは止められないため、ワーカーごと終了する
+            self.worker.kill()
+            return [("failed", result, {}, time.perf_counter() - start)]
+        return result
+
+    def call(self, func: Callable[..., Any], *args) -> Any:
+        """ワーカー上のDataFrameに関数を適用した結果を返す（func(df, *args)。func はモジュールレベルの関数）
+
+        ワーカーへの要求が完了しなかった場合は TimeoutError / EOFError などをそのまま送出する
+        （ワーカーは強制終了される）。
+        """
+        if not self.worker.alive:
+            raise EOFError("ワーカープロセスが終了しています")
+        status, result = self.worker.request(("call", func, *args), self.wall_timeout)
+        if status != "success":
+            raise RuntimeError(result)
+        return result
+
+
+class _SandboxWorker:
+    """ワーカープロセスとの接続"""
+
+    def __init__(self, context, memory_limit: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, memory_limit), daemon=True, name="step-sandbox"
+        )
+        self.process.start()
+        child_conn.close()
+        self.alive = True
+
+    @property
+    def exitcode(self) -> Optional[int]:
+        return self.process.exitcode
+
+    def request(self, message: tuple, timeout: float, stop: Optional[threading.Event] = None) -> tuple:
+        """メッセージを送って応答を待つ（timeout 秒で TimeoutError、stop がセットされると StepInterrupted）
+
+        応答を受け取れなかった場合は、送った要求がワーカーに残っている可能性があるため、
+        例外の種類にかかわらずワーカーを強制終了する（alive が False になる）。
+        """
+        try:
+            self.conn.send(message)
+            deadline = time.monotonic() + timeout if timeout > 0 else None
+            while True:
+                wait = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+                if stop is not None:
+                    wait = _STOP_POLL_INTERVAL if wait is None else min(wait, _STOP_POLL_INTERVAL)
+                if self.conn.poll(wait):
+                    return self.conn.recv()
+                if stop is not None and stop.is_set():
+                    raise StepInterrupted()
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError
+        except (StepInterrupted, TimeoutError):
+            self.kill()
+            raise
+        except (EOFError, OSError):
+            # 終了コードを残すため、ワーカーが自分で終了するのを少し待ってから強制終了する
+            self.process.join(1)
+            self.kill()
+            raise EOFError
+        except BaseException:
+            self.kill()
+            raise
+
+    def exit_message(self) -> str:
+        """異常終了したワーカーのエラーメッセージ"""
+        if self.exitcode == -signal.SIGKILL:
+            return "ワーカープロセスが強制終了されました（メモリ不足の可能性があります）"
+        return f"ワーカープロセスが異常終了しました（終了コード {self.exitcode}）"
+
+    def kill(self) -> None:
+        if not self.alive:
+            return
+        self.alive = False
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """事前に起動したワーカープロセスのプール
+
+    スレッドを持つサーバープロセスからの fork を避けるため spawn で起動する。
+    """
+
+    def __init__(self, workers: int, memory_limit: int):
+        self._context = multiprocessing.get_context("spawn")
+        self.memory_limit = memory_limit
+        self._idle: "queue.Queue[_SandboxWorker]" = queue.Queue()
+        for _ in range(workers):
+            self._idle.put(_SandboxWorker(self._context, memory_limit))
+
+    @contextmanager
+    def session(self, wall_timeout: float, cpu_time: int) -> Iterator[SandboxStepExecutor]:
+        """空いているワーカーを1つ占有する（終了時にDataFrameを破棄してプールに戻す）
+
+        要求が完了しなかったワーカーは強制終了されているため（_SandboxWorker.request）、
+        reset を送るのは直前の要求の応答を受け取ったワーカーだけになる。
+        """
+        worker = self._idle.get()
+        try:
+            yield SandboxStepExecutor(worker, wall_timeout, cpu_time)
+        finally:
+            if worker.alive:
+                try:
+                    worker.request(("reset",), wall_timeout)
+                except Exception:
+                    pass
+            if not worker.alive:
+                worker = _SandboxWorker(self._context, self.memory_limit)
+            self._idle.put(worker)
+
+    def shutdown(self) -> None:
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.kill()
+
+
+# 共有ワーカープール（execution: 通常の実行用、preview: プレビュー用）
+_pools: dict[str, SandboxPool] = {}
+_pool_lock = threading.Lock()
+
+
+def start_pool(kind: str = "execution") -> Optional[SandboxPool]:
+    """設定に基づく共有ワーカープールを起動（sandbox 以外の場合は起動しない）
+
+    プレビューが通常の実行の終了を待たないよう、プレビュー用のワーカーは別のプールにする。
+    """
+    with _pool_lock:
+        if kind not in _pools and settings.EXECUTION_STEP_EXECUTOR == "sandbox":
+            workers = (
+                settings.EXECUTION_PREVIEW_SANDBOX_WORKERS if kind == "preview"
+                else settings.EXECUTION_SANDBOX_WORKERS
+            )
+            _pools[kind] = SandboxPool(max(workers, 1), settings.EXECUTION_STEP_MEMORY_LIMIT)
+        return _pools.get(kind)
+
+
+def shutdown_pool() -> None:
+    """共有ワーカープールを停止"""
+    with _pool_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
+
+
+@contextmanager
+def open_executor(preview: bool = False) -> Iterator["InProcessStepExecutor | SandboxStepExecutor"]:
+    """設定に基づくステップ実行バックエンドを取得
+
+    preview=True の場合はプレビュー用のプールのワーカーを使い、プレビュー用の時間制限を適用する。
+    """
+    if settings.EXECUTION_STEP_EXECUTOR not in EXECUTORS:
+        raise ValueError(f"不正なステップ実行バックエンドです: {settings.EXECUTION_STEP_EXECUTOR}")
+    if settings.EXECUTION_STEP_EXECUTOR == "inprocess":
+        yield InProcessStepExecutor()
+        return
+    if preview:
+        pool = start_pool("preview")
+        limits = (settings.EXECUTION_PREVIEW_STEP_TIMEOUT, settings.EXECUTION_PREVIEW_STEP_CPU_TIME)
+    else:
+        pool = start_pool()
+        limits = (settings.EXECUTION_STEP_TIMEOUT, settings.EXECUTION_STEP_CPU_TIME)
+    with pool.session(*limits) as executor:
+        yield executor
+
+
+def exec_step(code: StepSource, df: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """コードスニペット（または構造化された操作）を実行し、更新後のDataFrameを返す
+
+    実行後の df が DataFrame でない場合（df = df['age'] や inplace=True の戻り値の代入など）は
+    TypeError を送出し、ステップの失敗として扱う（呼び出し元の df は更新しない）。
+    """
+    if isinstance(code, dict):
+        result = apply_operation(df, code)
+    else:
+        exec_globals = {"df": df, "pd": pd}
+        exec(compile_step(code), exec_globals)
+        result = exec_globals.get("df", df)
+    if not isinstance(result, pd.DataFrame):
+        raise TypeError(f"ステップの実行後の df が DataFrame ではありません（{type(result).__name__}）")
+    return result
+
+
+def _worker_main(conn: Connection, memory_limit: int) -> None:
+    """ワーカープロセスのメインループ
+
+    memory_limit は RLIMIT_AS（仮想アドレス空間）の上限として設定する（RSS の上限ではない）。
+    """
+    if memory_limit > 0:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    signal.signal(signal.SIGXCPU, _raise_cpu_time_exceeded)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    df = None
+    stats = frame_stats(None)
+    # DataFrameのバッファが参照している共有メモリ（DataFrameを破棄した後に閉じる）
+    memories: list[shared_memory.SharedMemory] = []
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        except Exception as e:
+            # メッセージは読み終わっているため、通信の状態は親プロセスと一致している
+            conn.send(("failed", f"要求を読み込めません: {e}"))
+            continue
+        kind = message[0]
+        if kind == "load":
+            df = None
+            memories = _close_shared_memory(memories)
+            try:
+                df, shm = _receive_frame(*message[1:])
+                memories.append(shm)
+                result = ("success", None)
+            except MemoryError:
+                result = ("failed", "メモリ使用量の上限を超えたため読み込めません")
+            except Exception as e:
+                result = ("failed", str(e))
+            stats = frame_stats(df)
+            conn.send(result)
+        elif kind == "run":
+            code, cpu_time = message[1], message[2]
+            meter = _StepMeter(time.process_time)
+            try:
+                _limit_cpu_time(cpu_time)
+                df = exec_step(code, df)
+                result = ("success", None)
+            except StepCpuTimeExceeded:
+                result = ("failed", f"CPU時間の上限（{cpu_time}秒）を超えたため中断しました")
+            except MemoryError:
+                result = ("failed", "メモリ使用量の上限を超えたため中断しました")
+            except Exception as e:
+                result = ("failed", str(e))
+            finally:
+                _limit_cpu_time(0)
+            if result[0] == "success":
+                after = frame_stats(df)
+                result += (meter.finish(stats, after),)
+                stats = after
+            else:
+                result += (meter.finish(stats, None),)
+            conn.send(result)
+        elif kind == "run_group":
+            codes, columns, cpu_time = message[1], message[2], message[3]
+            # 失敗した場合は df がどこまで更新されたか分からないため、親プロセスがワーカーごと終了する
+            try:
+                _limit_cpu_time(cpu_time)
+                df, results, stats = run_step_group(df, codes, columns, stats)
+                result = ("success", results)
+            except StepCpuTimeExceeded:
+                result = ("failed", f"CPU時間の上限（{cpu_time}秒）を超えたため中断しました")
+            except MemoryError:
+                result = ("failed", "メモリ使用量の上限を超えたため中断しました")
+            except Exception as e:
+                result = ("failed", str(e))
+            finally:
+                _limit_cpu_time(0)
+            conn.send(result)
+        elif kind == "call":
+            try:
+                conn.send(("success", message[1](df, *message[2:])))
+            except Exception as e:
+                conn.send(("failed", str(e)))
+        elif kind == "reset":
+            df = None
+            stats = frame_stats(None)
+            memories = _close_shared_memory(memories)
+            conn.send(("success", None))
+
+
+def _receive_frame(header: bytes, shm_name: str, sizes: list[int]) -> tuple[pd.DataFrame, shared_memory.SharedMemory]:
+    """共有メモリ上のバッファをコピーせずにDataFrameを復元し、(DataFrame, 共有メモリ) を返す
+
+    DataFrameの配列は共有メモリを直接参照するため、共有メモリは DataFrame を破棄するまで閉じない
+    （親プロセスが unlink した後もマッピングは残る）。
+    """
+    # spawn で起動したワーカーは親プロセスの resource_tracker を共有するため、
+    # 追跡の解除はせず、破棄（unlink）は親プロセスに任せる
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        buffers = []
+        offset = 0
+        for size in sizes:
+            buffers.append(shm.buf[offset:offset + size])
+            offset += size
+        df = pickle.loads(header, buffers=buffers)
+    except BaseException:
+        del buffers
+        _close_shared_memory([shm])
+        raise
+    return df, shm
+
+
+def _close_shared_memory(memories: list[shared_memory.SharedMemory]) -> list[shared_memory.SharedMemory]:
+    """共有メモリを閉じ、まだ参照が残っていて閉じられなかったものを返す（次の機会に閉じ直す）"""
+    if memories:
+        # 循環参照で残っている配列を解放する
+        gc.collect()
+    remaining = []
+    for shm in memories:
+        try:
+            shm.close()
+        except BufferError:
+            remaining.append(shm)
+    return remaining
+
+
+def _limit_cpu_time(seconds: int) -> None:
+    """これまでの使用量から seconds 秒でSIGXCPUが届くようにソフトリミットを設定（0で解除）
+
+    ハードリミットは一度下げると戻せないため変更しない。
+    """
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if seconds <= 0:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime) + 1 + seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _raise_cpu_time_exceeded(signum, frame) -> None:
+    raise StepCpuTimeExceeded()
+
+
+def _reset_peak_rss() -> Optional[int]:
+    """最大RSSを現在のRSSにリセットし、現在のRSS（バイト）を返す（Linux 以外は None）"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return None
+    return _read_proc_status("VmRSS")
+
+
+def _read_proc_status(field: str) -> Optional[int]:
+    """/proc/self/status の値（kB）をバイトで返す（読めない場合は None）"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None
+    return None
@@ -0,0 +1,439 @@
+"""プランのチャンク実行（アウトオブコア実行）
+
+プランのすべてのステップが行ごとに完結する操作であれば、入力をチャンク単位で読み込み、
+各チャンクにステップを順に適用して出力ファイルに書き出す。データ全体をメモリに載せないため、
+メモリ使用量はチャンクサイズと統計量（カラム数に比例）、LabelEncoder の語彙だけに依存する。
+
+行ごとに完結するかどうかはステップのコードの構文木から判定する。許可した構文とメソッド
+（dropna, fillna, astype, map など）だけからなり、引数が定数であるステップを対象とする。
+全体の統計量が必要なステップは、エージェントが生成する StandardScaler / LabelEncoder の
+テンプレートに一致するものだけに対応する。これらはまず、そこまでのステップを適用したチャンクを
+1パス読んで統計量を求め（fit）、最後のパスで変換する。構造化された操作（app/services/plan_operators.py）は
+行ごとに完結する操作と standardize / label_encode に対応する。
+
+判定したステップだけを実行するため、チャンク実行はステップ実行用のワーカープロセスを使わず、
+実行ワーカー内で行う。
+"""
+import ast
+import os
+import threading
+import time
+from typing import Callable, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.schemas.plan_operation import StepSource
+from app.services.profile_accumulators import ProfileAccumulator
+from app.services.step_executor import exec_step
+
+# 引数が定数であれば行ごとに完結するメソッド
+ROW_LOCAL_METHODS = {
+    "abs", "astype", "clip", "copy", "drop", "dropna", "fillna", "isin", "isna", "isnull",
+    "lower", "map", "notna", "notnull", "rename", "replace", "round", "strip", "upper",
+}
+# 行ごとに完結する構造化された操作
+ROW_LOCAL_OPERATIONS = {"drop_na", "drop_columns", "cast"}
+
+# 値として使える名前（astype(str) など）と pandas の定数・関数
+_SAFE_NAMES = {"str", "int", "float", "bool"}
+_PANDAS_CONSTANTS = {"NA", "NaT"}
+_PANDAS_FUNCTIONS = {"to_numeric"}
+
+_SCALER_TEMPLATE = """from sklearn.preprocessing import StandardScaler
+{var} = {columns!r}
+scaler = StandardScaler()
+df[{var}] = scaler.fit_transform(df[{var}])
+"""
+
+_ENCODER_TEMPLATE = """from sklearn.preprocessing import LabelEncoder
+{var} = {columns!r}
+for col in {var}:
+    le = LabelEncoder()
+    df[col] = le.fit_transform(df[col].astype(str))
+"""
+
+
+class RowLocalStep:
+    """行ごとに完結するステップ（チャンクにコードをそのまま適用する）"""
+
+    needs_fit = False
+
+    def __init__(self, code: StepSource):
+        self.code = code
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        return exec_step(self.code, df)
+
+
+class StandardScalerStep:
+    """StandardScaler のテンプレート（平均と標準偏差を fit のパスで求める）"""
+
+    needs_fit = True
+
+    def __init__(self, columns: list[str]):
+        self.columns = columns
+        self._n = np.zeros(len(columns))
+        self._mean = np.zeros(len(columns))
+        self._m2 = np.zeros(len(columns))
+        self.mean: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    def fit(self, df: pd.DataFrame) -> None:
+        values = df[self.columns].to_numpy(dtype=np.float64, na_value=np.nan)
+        n = (~np.isnan(values)).sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(n > 0, np.nansum(values, axis=0) / np.maximum(n, 1), 0.0)
+        m2 = np.nansum((values - mean) ** 2, axis=0)
+        # チャンクごとの平均・偏差平方和をマージ（Welford法）
+        total = self._n + n
+        delta = mean - self._mean
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self._mean = np.where(total > 0, self._mean + delta * n / np.maximum(total, 1), 0.0)
+            self._m2 = self._m2 + m2 + np.where(total > 0, delta ** 2 * self._n * n / np.maximum(total, 1), 0.0)
+        self._n = total
+
+    def finish_fit(self) -> None:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.mean = np.where(self._n > 0, self._mean, np.nan)
+            scale = np.sqrt(self._m2 / self._n)
+        # StandardScaler と同様に、分散がほぼ0のカラムはスケーリングしない
+        scale[scale < 10 * np.finfo(np.float64).eps] = 1.0
+        self.scale = scale
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        values = df[self.columns].to_numpy(dtype=np.float64, na_value=np.nan)
+        df[self.columns] = (values - self.mean) / self.scale
+        return df
+
+
+class LabelEncoderStep:
+    """LabelEncoder のテンプレート（語彙を fit のパスで求める）"""
+
+    needs_fit = True
+
+    def __init__(self, columns: list[str], max_vocabulary: int):
+        self.columns = columns
+        self.max_vocabulary = max_vocabulary
+        self._values: dict[str, set] = {col: set() for col in columns}
+        self._has_missing = {col: False for col in columns}
+        self.classes: dict[str, pd.Index] = {}
+
+    def fit(self, df: pd.DataFrame) -> None:
+        for col in self.columns:
+            values = df[col].astype(str)
+            missing = values.isna()
+            self._has_missing[col] = self._has_missing[col] or bool(missing.any())
+            self._values[col].update(values[~missing].unique().tolist())
+            if len(self._values[col]) > self.max_vocabulary:
+                raise ValueError(f"カラム {col} のユニーク値が多すぎるためチャンク実行できません")
+
+    def finish_fit(self) -> None:
+        # LabelEncoder と同様に文字列の昇順で、欠損は最後のクラスにする
+        for col in self.columns:
+            classes = sorted(self._values[col]) + ([np.nan] if self._has_missing[col] else [])
+            self.classes[col] = pd.Index(classes, dtype=object)
+        self._values = {}
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        for col in self.columns:
+            codes = self.classes[col].get_indexer(df[col].astype(str).astype(object))
+            if (codes < 0).any():
+                raise ValueError(f"カラム {col} に語彙にない値があります")
+            df[col] = codes.astype(np.int64)
+        return df
+
+
+class ChunkedExecutionCancelled(Exception):
+    """チャンク実行の中断（stop のイベントがセットされた）"""
+
+
+class ChunkedStepError(Exception):
+    """チャンク実行中にステップが失敗した"""
+
+    def __init__(self, index: int, message: str):
+        super().__init__(message)
+        self.index = index
+
+
+def analyze_step(code: StepSource, max_vocabulary: Optional[int] = None):
+    """ステップのコードをチャンク実行用のステップに変換（対応しない場合は None）"""
+    if isinstance(code, dict):
+        return _analyze_operation(code, max_vocabulary or settings.EXECUTION_STREAM_MAX_VOCABULARY)
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    fitted = _match_fit_template(tree, max_vocabulary or settings.EXECUTION_STREAM_MAX_VOCABULARY)
+    if fitted is not None:
+        return fitted
+    if tree.body and all(_is_row_local_statement(stmt) for stmt in tree.body):
+        return RowLocalStep(code)
+    return None
+
+
+def analyze_plan(codes: list[StepSource]) -> tuple[Optional[list], list[int]]:
+    """プランのステップをチャンク実行用に変換
+
+    Returns:
+        (チャンク実行用のステップ（対応しないステップがあれば None）, 対応しないステップの位置)
+    """
+    steps = [analyze_step(code) for code in codes]
+    unsupported = [i for i, step in enumerate(steps) if step is None]
+    return (None if unsupported else steps), unsupported
+
+
+def run_chunked(
+    make_chunks: Callable[[], Iterator[pd.DataFrame]],
+    steps: list,
+    output_path: str,
+    on_progress: Optional[Callable[[int, int, int], None]] = None,
+    stop: Optional[threading.Event] = None,
+) -> dict:
+    """ステップをチャンク単位で適用して出力ファイル（CSV）に書き出す
+
+    fit が必要なステップごとに入力を1パス読み、最後のパスで全ステップを適用して書き出す。
+    実行前後のサマリは最後のパスでマージ可能な統計量から求める（ユニーク数はユニーク値が
+    多いカラムでは推定値になる）。
+
+    Args:
+        make_chunks: 入力のチャンクを先頭から読み込むイテレータを返す関数（パスごとに呼ぶ）
+        steps: analyze_plan で変換したステップ
+        output_path: 出力先のCSVファイル
+        on_progress: チャンクを処理するごとに (何回目のパスか（1から）, パスの数, そのパスで処理した行数) で呼ぶ関数
+        stop: セットされるとチャンクの間で処理を打ち切るイベント（出力ファイルは作らない）
+
+    Returns:
+        before_summary, after_summary（失敗した場合は None）, step_times（ステップごとの合計秒数）,
+        step_cpu_times（ステップごとの合計CPU時間）, failed_step（失敗したステップの位置）, error_message,
+        cancelled（stop で打ち切ったか）
+    """
+    step_times = [0.0] * len(steps)
+    step_cpu_times = [0.0] * len(steps)
+    result = {
+        "before_summary": None,
+        "after_summary": None,
+        "step_times": step_times,
+        "step_cpu_times": step_cpu_times,
+        "failed_step": None,
+        "error_message": None,
+        "cancelled": False,
+    }
+    tmp_path = output_path + ".part"
+    passes = sum(1 for step in steps if step.needs_fit) + 1
+    current_pass = 0
+
+    def report(rows: int) -> None:
+        if on_progress is not None:
+            on_progress(current_pass, passes, rows)
+        if stop is not None and stop.is_set():
+            raise ChunkedExecutionCancelled()
+
+    try:
+        for k, step in enumerate(steps):
+            if not step.needs_fit:
+                continue
+            current_pass += 1
+            rows = 0
+            for chunk in make_chunks():
+                rows += len(chunk)
+                chunk = _apply_steps(steps[:k], chunk, step_times, step_cpu_times)
+                start, cpu_start = time.perf_counter(), time.thread_time()
+                try:
+                    step.fit(chunk)
+                except Exception as e:
+                    raise ChunkedStepError(k, str(e))
+                step_times[k] += time.perf_counter() - start
+                step_cpu_times[k] += time.thread_time() - cpu_start
+                report(rows)
+            step.finish_fit()
+
+        before = ProfileAccumulator()
+        after = ProfileAccumulator()
+        current_pass += 1
+        rows = 0
+        with open(tmp_path, "w", encoding="utf-8", newline="") as out:
+            header = True
+            for chunk in make_chunks():
+                rows += len(chunk)
+                before.update(chunk)
+                chunk = _apply_steps(steps, chunk, step_times, step_cpu_times)
+                after.update(chunk)
+                chunk.to_csv(out, header=header, index=False)
+                header = False
+                report(rows)
+        os.replace(tmp_path, output_path)
+    except ChunkedStepError as e:
+        result["failed_step"] = e.index
+        result["error_message"] = str(e)
+        return result
+    except ChunkedExecutionCancelled:
+        result["cancelled"] = True
+        return result
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    result["before_summary"] = summary_from_accumulator(before)
+    result["after_summary"] = summary_from_accumulator(after)
+    return result
+
+
+def summary_from_accumulator(accumulator: ProfileAccumulator) -> dict:
+    """マージ可能な統計量から generate_data_summary と同じ形式のサマリを生成"""
+    profile = accumulator.finalize()
+    summary = {
+        "rows": profile["rows"],
+        "columns": profile["columns"],
+        "missing_values": profile["missing_values"],
+        "column_info": {}
+    }
+    for col, col_profile in profile["column_profiles"].items():
+        col_info = {
+            "dtype": col_profile["dtype"],
+            "missing": col_profile["missing"],
+            "unique": col_profile["unique"]
+        }
+        if col_profile["dtype_category"] == "numeric":
+            for stat in ("mean", "std", "min", "max"):
+                col_info[stat] = col_profile.get(stat)
+        summary["column_info"][col] = col_info
+    return summary
+
+
+def _apply_steps(
+    steps: list, df: pd.DataFrame, step_times: list[float], step_cpu_times: list[float]
+) -> pd.DataFrame:
+    for i, step in enumerate(steps):
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            df = step.transform(df)
+        except Exception as e:
+            raise ChunkedStepError(i, str(e))
+        step_times[i] += time.perf_counter() - start
+        step_cpu_times[i] += time.thread_time() - cpu_start
+    return df
+
+
+def _analyze_operation(operation: dict, max_vocabulary: int):
+    op = operation["op"]
+    if op == "standardize":
+        return StandardScalerStep(list(operation["columns"]))
+    if op == "label_encode":
+        return LabelEncoderStep(list(operation["columns"]), max_vocabulary)
+    if op == "cast" and operation["dtype"] == "category":
+        # カテゴリはチャンクごとに異なるため不可
+        return None
+    if op in ROW_LOCAL_OPERATIONS or (op == "fill_na" and operation.get("strategy") == "constant"):
+        return RowLocalStep(operation)
+    return None
+
+
+def _match_fit_template(tree: ast.Module, max_vocabulary: int):
+    """StandardScaler / LabelEncoder のテンプレートと一致すればステップを返す"""
+    if len(tree.body) < 2:
+        return None
+    assign = tree.body[1]
+    if not (
+        isinstance(assign, ast.Assign)
+        and len(assign.targets) == 1
+        and isinstance(assign.targets[0], ast.Name)
+        and isinstance(assign.value, ast.List)
+        and assign.value.elts
+        and all(isinstance(e, ast.Constant) and isinstance(e.value, str) for e in assign.value.elts)
+    ):
+        return None
+    var = assign.targets[0].id
+    columns = [e.value for e in assign.value.elts]
+    dumped = ast.dump(tree)
+    if dumped == ast.dump(ast.parse(_SCALER_TEMPLATE.format(var=var, columns=columns))):
+        return StandardScalerStep(columns)
+    if dumped == ast.dump(ast.parse(_ENCODER_TEMPLATE.format(var=var, columns=columns))):
+        return LabelEncoderStep(columns, max_vocabulary)
+    return None
+
+
+def _is_row_local_statement(stmt: ast.stmt) -> bool:
+    if isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant):
+        return True
+    if not isinstance(stmt, ast.Assign) or len(stmt.targets) != 1:
+        return False
+    target = stmt.targets[0]
+    is_frame = isinstance(target, ast.Name) and target.id == "df"
+    is_column = (
+        isinstance(target, ast.Subscript)
+        and isinstance(target.value, ast.Name)
+        and target.value.id == "df"
+        and _is_constant(target.slice)
+    )
+    return (is_frame or is_column) and _is_row_local(stmt.value)
+
+
+def _is_constant(node: ast.AST) -> bool:
+    if isinstance(node, ast.Constant):
+        return True
+    if isinstance(node, ast.Name):
+        return node.id in _SAFE_NAMES
+    if isinstance(node, ast.Attribute):
+        return isinstance(node.value, ast.Name) and node.value.id == "pd" and node.attr in _PANDAS_CONSTANTS
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        return all(_is_constant(e) for e in node.elts)
+    if isinstance(node, ast.Dict):
+        return all(k is not None and _is_constant(k) for k in node.keys) and all(_is_constant(v) for v in node.values)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        return isinstance(node.operand, ast.Constant)
+    return False
+
+
+def _is_row_local(node: ast.AST) -> bool:
+    """式が行ごとに完結する（各行の結果がその行の値と定数だけで決まる）か"""
+    if _is_constant(node):
+        return True
+    if isinstance(node, ast.Name):
+        return node.id == "df"
+    if isinstance(node, ast.Subscript):
+        # カラムの選択、または行ごとの条件による絞り込み（スライスは位置に依存するため不可）
+        return _is_row_local(node.value) and not isinstance(node.slice, ast.Slice) and (
+            _is_constant(node.slice) or _is_row_local(node.slice)
+        )
+    if isinstance(node, ast.Attribute):
+        return node.attr == "str" and _is_row_local(node.value)
+    if isinstance(node, (ast.BinOp,)):
+        return _is_row_local(node.left) and _is_row_local(node.right)
+    if isinstance(node, ast.UnaryOp):
+        return _is_row_local(node.operand)
+    if isinstance(node, ast.BoolOp):
+        return all(_is_row_local(v) for v in node.values)
+    if isinstance(node, ast.Compare):
+        return _is_row_local(node.left) and all(_is_row_local(c) for c in node.comparators)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        return _is_row_local_call(node)
+    return False
+
+
+def _is_row_local_call(node: ast.Call) -> bool:
+    method = node.func.attr
+    receiver = node.func.value
+    keywords = {kw.arg: kw.value for kw in node.keywords}
+    if None in keywords:
+        return False
+    if isinstance(receiver, ast.Name) and receiver.id == "pd":
+        return (
+            method in _PANDAS_FUNCTIONS
+            and all(_is_row_local(arg) for arg in node.args)
+            and all(_is_constant(v) for v in keywords.values())
+        )
+    if method not in ROW_LOCAL_METHODS or not _is_row_local(receiver):
+        return False
+    if not all(_is_constant(arg) for arg in node.args) or not all(_is_constant(v) for v in keywords.values()):
+        return False
+    if method == "dropna":
+        axis = keywords.get("axis")
+        return not node.args and not (isinstance(axis, ast.Constant) and axis.value in (1, "columns"))
+    if method == "fillna":
+        return not ({"method", "limit", "axis"} & set(keywords))
+    if method in ("drop", "rename"):
+        # カラムの削除・名前の変更のみ（行ラベルはチャンクによって異なるため不可）
+        return not node.args and set(keywords) <= {"columns", "errors"} and "columns" in keywords
+    return True
@@ -0,0 +1,163 @@
+"""multipart/form-data のアップロードの受信
+
+Starlette の request.form() はファイルのパートをいったん一時ファイルに書き出すため、それを保存先に
+コピーするとディスクへの書き込みが2回になる。ここではリクエストボディをチャンク単位で読みながら
+multipart を解析し、ファイルのパートを保存先に直接書き込む（同時に内容ハッシュを計算する）。
+ファイルへの書き込みはイベントループを止めないようスレッドプールで行う。
+"""
+import codecs
+import hashlib
+import os
+from typing import NamedTuple, Optional
+
+from python_multipart import MultipartParser
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import parse_options_header
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+from app.exceptions import ValidationException
+
+# ファイル以外のフィールドの値の上限（バイト）
+MAX_FIELD_SIZE = 64 * 1024
+
+
+class ReceivedFile(NamedTuple):
+    """受信したファイルと、同じリクエストで送られたフィールド"""
+    filename: Optional[str]
+    content_hash: str
+    size: int
+    fields: dict[str, str]
+
+
+class _MultipartReceiver:
+    def __init__(self, file_field: str, charset: str):
+        self.file_field = file_field
+        self.charset = charset
+        self.fields: dict[str, str] = {}
+        self.filename: Optional[str] = None
+        self.file_seen = False
+        # 解析したファイルのデータ（チャンクを読むたびに書き込んで空にする）
+        self.pending: list[bytes] = []
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._name: Optional[str] = None
+        self._is_file = False
+        # 指定したフィールド以外のファイルのパート（読み捨てる）
+        self._ignored = False
+        self._data = bytearray()
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self) -> None:
+        self._disposition = b""
+        self._name = None
+        self._is_file = False
+        self._ignored = False
+        self._data = bytearray()
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        if b"name" not in options:
+            raise ValidationException("multipart のパートに name がありません")
+        self._name = options[b"name"].decode(self.charset, errors="replace")
+        if b"filename" not in options:
+            return
+        if self._name != self.file_field:
+            self._ignored = True
+            return
+        if self.file_seen:
+            raise ValidationException(f"ファイル（{self.file_field}）は1つだけ指定してください")
+        self.file_seen = True
+        self._is_file = True
+        self.filename = options[b"filename"].decode(self.charset, errors="replace")
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._is_file:
+            self.pending.append(data[start:end])
+        elif not self._ignored:
+            if len(self._data) + end - start > MAX_FIELD_SIZE:
+                raise ValidationException(f"フィールド {self._name} の値が大きすぎます")
+            self._data.extend(data[start:end])
+
+    def on_part_end(self) -> None:
+        if not self._is_file and not self._ignored and self._name is not None:
+            self.fields[self._name] = self._data.decode(self.charset, errors="replace")
+
+
+async def receive_file(request: Request, path: str, file_field: str = "file") -> ReceivedFile:
+    """multipart/form-data のファイルのパートを path に保存する
+
+    書き込み中は path + ".part" に書き、受信が完了した時点で path に置き換える
+    （途中で失敗した場合は何も残さない）。
+
+    Args:
+        request: リクエスト
+        path: 保存先のパス
+        file_field: ファイルのフィールド名
+
+    Returns:
+        元のファイル名、内容ハッシュ（SHA-256）、サイズと、ファイル以外のフィールド
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise ValidationException("multipart/form-data でファイルを送信してください")
+    charset = params.get(b"charset", b"utf-8").decode("latin-1")
+    try:
+        charset = codecs.lookup(charset).name
+    except LookupError:
+        charset = "latin-1"
+
+    receiver = _MultipartReceiver(file_field, charset)
+    parser = MultipartParser(params[b"boundary"], receiver.callbacks())
+    hasher = hashlib.sha256()
+    size = 0
+    tmp_path = path + ".part"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    out = open(tmp_path, "wb")
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except MultipartParseError as e:
+                raise ValidationException(f"multipart を解析できません: {e}")
+            if receiver.pending:
+                data = b"".join(receiver.pending)
+                receiver.pending.clear()
+                hasher.update(data)
+                size += len(data)
+                await run_in_threadpool(out.write, data)
+        parser.finalize()
+        out.close()
+        if not receiver.file_seen:
+            raise ValidationException(f"ファイル（{file_field}）が指定されていません")
+        if size == 0:
+            raise ValidationException("アップロードされたファイルが空です")
+        os.replace(tmp_path, path)
+    finally:
+        out.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return ReceivedFile(receiver.filename, hasher.hexdigest(), size, receiver.fields)
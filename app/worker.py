@@ -0,0 +1,37 @@
+"""実行キューのワーカープロセス
+
+APIサーバーとは別のプロセスで pending の実行を処理する。
+同じデータベースを参照していれば、複数のプロセス・ホストで同時に起動できる。
+
+実行方法:
+    python -m app.worker [ワーカースレッド数]
+"""
+import logging
+import signal
+import sys
+import threading
+
+from app.core.config import settings
+from app.db.migrations import upgrade_schema
+from app.db.session import engine
+from app.models import dataset, execution, plan, user  # noqa: F401  テーブル定義を登録する
+from app.services import execution_queue
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    upgrade_schema(engine)
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else max(settings.EXECUTION_WORKERS, 1)
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+
+    execution_queue.start_workers(workers)
+    logging.info("実行ワーカーを %d 個起動しました", workers)
+    stopped.wait()
+    execution_queue.shutdown_workers()
+
+
+if __name__ == "__main__":
+    main()
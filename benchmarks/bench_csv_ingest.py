@@ -0,0 +1,58 @@
+"""CSV読み込み層のベンチマーク
+
+pd.read_csv の既定の読み込みと、保存済みスキーマを使った読み込み（app/services/csv_ingest.py）の
+解析時間・DataFrameのメモリ使用量を比較する。
+
+実行方法:
+    python -m benchmarks.bench_csv_ingest [行数]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.services import csv_ingest
+
+
+def make_csv(path: str, n_rows: int) -> None:
+    """数値・低カーディナリティ文字列・ID文字列を含むCSVを生成"""
+    rng = np.random.default_rng(0)
+    pd.DataFrame({
+        "age": rng.integers(18, 80, n_rows),
+        "income": rng.normal(50000, 15000, n_rows),
+        "score": rng.uniform(0, 100, n_rows),
+        "category": rng.choice(["A", "B", "C", "D"], n_rows),
+        "prefecture": rng.choice([f"pref-{i}" for i in range(47)], n_rows),
+        "status": rng.choice(["active", "inactive", "pending"], n_rows),
+        "user_id": [f"user-{i:08d}" for i in range(n_rows)],
+    }).to_csv(path, index=False)
+
+
+def measure(label: str, read) -> None:
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        df = read()
+        best = min(best, time.perf_counter() - start)
+    memory = df.memory_usage(deep=True).sum() / 1024 / 1024
+    print(f"{label:<34} {best:8.3f} s {memory:10.1f} MiB")
+
+
+def main() -> None:
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench.csv")
+        make_csv(path, n_rows)
+        schema = csv_ingest.infer_schema(path)
+        print(f"rows={n_rows} pyarrow={csv_ingest.PYARROW_AVAILABLE}")
+        measure("pd.read_csv (default)", lambda: pd.read_csv(path))
+        measure("csv_ingest.read_csv", lambda: csv_ingest.read_csv(path, schema))
+        measure("csv_ingest.read_csv (no category)", lambda: csv_ingest.read_csv(path, schema, categories=False))
+        measure("csv_ingest.read_csv (usecols=2)", lambda: csv_ingest.read_csv(path, schema, usecols=["age", "category"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""プロファイリングサービスのベンチマーク
+
+行数 × カラム数 × 型の構成 × 欠損率 の組み合わせごとに合成データを生成し、
+プロファイリングの各段階の実行時間・ピークメモリ・行/秒を計測してJSONに保存する。
+保存した結果を --compare に指定すると、段階ごとの実行時間の比を表示し、
+しきい値を超えて遅くなった段階があれば終了コード1を返す。
+
+計測する段階:
+    profile_dataframe            読み込み済みのDataFrame全体
+    profile_column               _profile_column を数値以外のカラムに適用（profile_dataframe 内と同じ対象）
+    detect_data_quality_issues   profile_dataframe の結果に対する品質問題の検出
+    profile_csv_data[<mode>]     CSV文字列からのプロファイリング（キャッシュは使用しない）
+
+実行方法:
+    python -m benchmarks.bench_profiling --output results.json
+    python -m benchmarks.bench_profiling --quick --compare results.json
+"""
+import argparse
+import gc
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.services.profiling_service import (
+    PROFILER_VERSION,
+    _profile_column,
+    detect_data_quality_issues,
+    profile_csv_data,
+    profile_dataframe,
+)
+
+# 型の構成ごとの、数値・カテゴリ・文字列（高カーディナリティ）・真偽値カラムの割合
+DTYPE_MIXES = {
+    "numeric": {"numeric": 1.0},
+    "mixed": {"numeric": 0.5, "categorical": 0.3, "text": 0.1, "boolean": 0.1},
+    "categorical": {"categorical": 0.7, "text": 0.3},
+}
+
+FULL_MATRIX = {
+    "rows": [10_000, 100_000, 1_000_000],
+    "columns": [10, 50, 200],
+    "dtype_mix": list(DTYPE_MIXES),
+    "missing_rate": [0.0, 0.2],
+}
+
+QUICK_MATRIX = {
+    "rows": [10_000, 100_000],
+    "columns": [10, 50],
+    "dtype_mix": ["numeric", "mixed"],
+    "missing_rate": [0.0, 0.2],
+}
+
+CSV_MODES = ("exact", "stream", "sample")
+
+# CSVを経由する段階は、CSV文字列が大きくなりすぎない組み合わせだけで計測する
+CSV_MAX_CELLS = 5_000_000
+
+
+def make_frame(rows: int, columns: int, dtype_mix: str, missing_rate: float, seed: int = 0) -> pd.DataFrame:
+    """合成データを生成"""
+    rng = np.random.default_rng(seed)
+    kinds = []
+    for kind, share in DTYPE_MIXES[dtype_mix].items():
+        kinds += [kind] * int(round(share * columns))
+    kinds = (kinds + ["numeric"] * columns)[:columns]
+
+    data = {}
+    for i, kind in enumerate(kinds):
+        if kind == "numeric":
+            values = rng.normal(100, 15, rows) if i % 2 else rng.integers(0, 1000, rows).astype(np.float64)
+        elif kind == "categorical":
+            values = rng.choice([f"c{j}" for j in range(12)], rows).astype(object)
+        elif kind == "text":
+            values = np.char.add("id-", rng.integers(0, rows * 10, rows).astype(str)).astype(object)
+        else:
+            values = rng.random(rows) < 0.5
+        if missing_rate > 0 and kind != "boolean":
+            mask = rng.random(rows) < missing_rate
+            values = values.copy()
+            values[mask] = np.nan if kind == "numeric" else None
+        data[f"{kind}_{i}"] = values
+    return pd.DataFrame(data)
+
+
+def measure(func: Callable[[], object], repeat: int) -> dict:
+    """最速の実行時間とピークメモリ（tracemalloc で追跡できるアロケーション）を計測
+
+    tracemalloc は実行時間に影響するため、ピークメモリは別の1回の実行で計測する。
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": best, "peak_bytes": peak}
+
+
+def run_case(rows: int, columns: int, dtype_mix: str, missing_rate: float, repeat: int) -> dict:
+    """1つの組み合わせについて各段階を計測"""
+    df = make_frame(rows, columns, dtype_mix, missing_rate)
+    profile = profile_dataframe(df)
+    non_numeric = [col for col in df.columns if not pd.api.types.is_numeric_dtype(df[col])]
+    stages = {
+        "profile_dataframe": measure(lambda: profile_dataframe(df), repeat),
+        "profile_column": measure(lambda: [_profile_column(df[col]) for col in non_numeric], repeat),
+        "detect_data_quality_issues": measure(lambda: detect_data_quality_issues(profile), repeat),
+    }
+    if rows * columns <= CSV_MAX_CELLS:
+        csv_data = df.to_csv(index=False)
+        for mode in CSV_MODES:
+            stages[f"profile_csv_data[{mode}]"] = measure(
+                lambda: profile_csv_data(csv_data, mode=mode, use_cache=False), repeat
+            )
+    for result in stages.values():
+        result["rows_per_second"] = rows / result["seconds"] if result["seconds"] > 0 else None
+    return {
+        "case": case_key(rows, columns, dtype_mix, missing_rate),
+        "rows": rows,
+        "columns": columns,
+        "dtype_mix": dtype_mix,
+        "missing_rate": missing_rate,
+        "stages": stages,
+    }
+
+
+def case_key(rows: int, columns: int, dtype_mix: str, missing_rate: float) -> str:
+    return f"rows={rows},columns={columns},dtype_mix={dtype_mix},missing_rate={missing_rate}"
+
+
+def environment() -> dict:
+    """比較の際に確認する実行環境の情報"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "profiler_version": PROFILER_VERSION,
+        "parallel_workers": settings.PROFILING_PARALLEL_WORKERS,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """基準の結果と比較して表示し、しきい値を超えて遅くなった段階がなければ True を返す"""
+    base_cases = {case["case"]: case for case in baseline["cases"]}
+    ok = True
+    print(f"\nbaseline commit={baseline['environment'].get('commit')}")
+    for case in results["cases"]:
+        base = base_cases.get(case["case"])
+        if base is None:
+            continue
+        for stage, result in case["stages"].items():
+            base_result = base["stages"].get(stage)
+            if base_result is None or base_result["seconds"] <= 0:
+                continue
+            ratio = result["seconds"] / base_result["seconds"]
+            regressed = ratio > 1 + threshold
+            ok = ok and not regressed
+            print(f"{'REGRESSION' if regressed else 'ok':<10} {ratio:6.2f}x  {stage:<28} {case['case']}")
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="小さい組み合わせだけを計測する")
+    parser.add_argument("--rows", type=int, nargs="+", help="行数（組み合わせの既定値を上書き）")
+    parser.add_argument("--columns", type=int, nargs="+", help="カラム数（組み合わせの既定値を上書き）")
+    parser.add_argument("--dtype-mix", nargs="+", choices=list(DTYPE_MIXES), help="型の構成")
+    parser.add_argument("--missing-rate", type=float, nargs="+", help="欠損率")
+    parser.add_argument("--repeat", type=int, default=3, help="各段階の試行回数（最速値を採用）")
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    parser.add_argument("--compare", help="比較する基準の結果のJSONファイル")
+    parser.add_argument("--threshold", type=float, default=0.2, help="遅くなったとみなす実行時間の増加率")
+    args = parser.parse_args()
+
+    matrix = dict(QUICK_MATRIX if args.quick else FULL_MATRIX)
+    for key in ("rows", "columns", "dtype_mix", "missing_rate"):
+        if getattr(args, key):
+            matrix[key] = getattr(args, key)
+
+    results = {"environment": environment(), "matrix": matrix, "cases": []}
+    for rows, columns, dtype_mix, missing_rate in itertools.product(*matrix.values()):
+        case = run_case(rows, columns, dtype_mix, missing_rate, args.repeat)
+        results["cases"].append(case)
+        for stage, result in case["stages"].items():
+            print(
+                f"{case['case']:<60} {stage:<28} {result['seconds']:9.4f} s "
+                f"{result['peak_bytes'] / 1024 / 1024:9.1f} MiB {result['rows_per_second'] or 0:14,.0f} rows/s"
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        return 0 if compare(results, baseline, args.threshold) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
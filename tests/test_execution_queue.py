@@ -0,0 +1,682 @@
+"""実行キューのテスト"""
+import asyncio
+import gzip
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+from app.db.base import Base
+from app.exceptions import UnauthorizedAccessException, ValidationException
+from app.models import dataset, execution, plan, user  # noqa: F401
+from app.models.execution import Execution
+from app.models.plan import Plan, PlanStep
+from app.models.dataset import Dataset
+from app.models.user import User
+from app.repositories.execution_repository import ExecutionRepository
+from app.services import execution_output, step_cache, step_executor
+from app.services.execution_events import events_path, iter_events, open_event_stream
+from app.services.execution_output import RangeNotSatisfiable, get_output_file, iter_file, iter_gzip, parse_range
+from app.services.execution_service import (
+    _generate_sample_data,
+    cancel_execution,
+    enqueue_batch_execution,
+    enqueue_execution,
+    generate_after_summary,
+    get_batch_progress,
+    preview_plan,
+    run_execution,
+    summarize_columns,
+    update_batch_parent,
+)
+
+
+def _collect(events, until=None) -> list:
+    """イベントの非同期イテレータを最後まで（until に一致するメッセージまで）読む"""
+    async def collect():
+        messages = []
+        async for message in events:
+            messages.append(message)
+            if until is not None and until(message):
+                break
+        return messages
+    return asyncio.run(collect())
+
+
+def _make_session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def _make_plan(db) -> Plan:
+    owner = User(id=str(uuid.uuid4()), email="owner@example.com", password_hash="x")
+    data = Dataset(id=str(uuid.uuid4()), user_id=owner.id, name="data")
+    new_plan = Plan(id=str(uuid.uuid4()), user_id=owner.id, dataset_id=data.id, task_type="classification")
+    new_plan.steps = [
+        PlanStep(id=str(uuid.uuid4()), order=1, name="fill", code_snippet="df = df.fillna(0)"),
+        PlanStep(id=str(uuid.uuid4()), order=2, name="drop", code_snippet="df = df.drop(columns=['target'])"),
+    ]
+    db.add_all([owner, data, new_plan])
+    db.commit()
+    return new_plan
+
+
+def test_claim_next_pending_is_exclusive_and_fifo(tmp_path, monkeypatch):
+    """pending の実行が古い順に1回だけ取得され、再実行は中間結果キャッシュから再開されることを確認"""
+    monkeypatch.setattr(settings, "EXECUTION_STEP_CACHE_DIR", str(tmp_path / "step_cache"))
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    Session = _make_session(tmp_path)
+    db = Session()
+    new_plan = _make_plan(db)
+    ids = []
+    for i in range(3):
+        pending = Execution(
+            id=str(uuid.uuid4()), plan_id=new_plan.id, status="pending",
+            created_at=datetime(2024, 1, 1) + timedelta(seconds=i)
+        )
+        ExecutionRepository(db).create(pending)
+        ids.append(pending.id)
+
+    other = Session()
+    claimed = [
+        ExecutionRepository(db).claim_next_pending("worker-a"),
+        ExecutionRepository(other).claim_next_pending("worker-b"),
+        ExecutionRepository(db).claim_next_pending("worker-a"),
+    ]
+    assert [e.id for e in claimed] == ids
+    assert [e.worker_id for e in claimed] == ["worker-a", "worker-b", "worker-a"]
+    assert all(e.status == "running" and e.started_at is not None for e in claimed)
+    assert ExecutionRepository(other).claim_next_pending("worker-b") is None
+
+    # サンプルデータで実行され、ステップログが記録される
+    try:
+        done = run_execution(db, claimed[0])
+        assert done.status == "completed"
+        assert [log.status for log in done.step_logs] == ["success", "success"]
+
+        # 2番目のステップを編集して再実行すると、1番目のステップは保存済みの結果から再開する
+        new_plan.steps[1].code_snippet = "df = df.drop(columns=['score'])"
+        db.commit()
+        rerun = run_execution(db, claimed[2])
+        assert [log.status for log in rerun.step_logs] == ["cached", "success"]
+        assert rerun.before_summary_json == done.before_summary_json
+        assert "target" in json.loads(rerun.after_summary_json)["column_info"]
+        assert "score" not in json.loads(rerun.after_summary_json)["column_info"]
+    finally:
+        step_executor.shutdown_pool()
+    db.close()
+    other.close()
+
+
+def test_step_logs_are_committed_in_batches(tmp_path, monkeypatch):
+    """ステップログが設定したステップ数ごとと終了時にまとめてコミットされることを確認"""
+    monkeypatch.setattr(settings, "EXECUTION_STEP_EXECUTOR", "inprocess")
+    monkeypatch.setattr(settings, "EXECUTION_STEP_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "EXECUTION_STEP_LOG_FLUSH_STEPS", 2)
+    monkeypatch.setattr(settings, "EXECUTION_STEP_LOG_FLUSH_INTERVAL", 3600.0)
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    Session = _make_session(tmp_path)
+    db = Session()
+    new_plan = _make_plan(db)
+    new_plan.steps.append(PlanStep(id=str(uuid.uuid4()), order=3, name="head", code_snippet="df = df.head(10)"))
+    db.commit()
+    pending = ExecutionRepository(db).create(Execution(id=str(uuid.uuid4()), plan_id=new_plan.id, status="pending"))
+    claimed = ExecutionRepository(db).claim_next_pending("worker-a")
+    assert claimed.id == pending.id
+
+    commits = []
+    event.listen(db, "after_commit", lambda session: commits.append(session))
+    done = run_execution(db, claimed)
+    assert len(commits) == 2
+    assert done.status == "completed"
+    assert [log.step_order for log in done.step_logs] == [1, 2, 3]
+    assert json.loads(done.after_summary_json)["rows"] == 10
+
+    # 他のセッションからもコミット済みの結果として見える
+    other = Session()
+    assert len(ExecutionRepository(other).find_by_id(done.id).step_logs) == 3
+    db.close()
+    other.close()
+
+
+def test_output_is_saved_and_streamed_in_ranges(tmp_path, monkeypatch):
+    """前処理後のデータが保存され、範囲指定・gzip 圧縮でチャンク単位に読み出せることを確認"""
+    monkeypatch.setattr(settings, "EXECUTION_STEP_EXECUTOR", "inprocess")
+    monkeypatch.setattr(settings, "EXECUTION_STEP_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    Session = _make_session(tmp_path)
+    db = Session()
+    new_plan = _make_plan(db)
+    ExecutionRepository(db).create(Execution(id=str(uuid.uuid4()), plan_id=new_plan.id, status="pending"))
+    done = run_execution(db, ExecutionRepository(db).claim_next_pending("worker-a"))
+    assert done.status == "completed"
+
+    path, fmt = get_output_file(db, done.id, new_plan.user_id)
+    assert fmt == "csv" and path == done.output_path
+    with pytest.raises(UnauthorizedAccessException):
+        get_output_file(db, done.id, str(uuid.uuid4()))
+    saved = pd.read_csv(path)
+    assert len(saved) == json.loads(done.after_summary_json)["rows"] and "target" not in saved.columns
+
+    content = open(path, "rb").read()
+    size = len(content)
+    assert b"".join(iter_file(path, 0, size - 1, chunk_size=7)) == content
+    assert parse_range("bytes=10-19", size) == (10, 19)
+    assert parse_range("bytes=-5", size) == (size - 5, size - 1)
+    assert parse_range(f"bytes=5-{size * 2}", size) == (5, size - 1)
+    assert parse_range("bytes=0-1,5-6", size) is None
+    assert parse_range("bytes=5-2", size) is None
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(f"bytes={size}-", size)
+    assert b"".join(iter_file(path, 10, 19, chunk_size=3)) == content[10:20]
+    assert gzip.decompress(b"".join(iter_gzip(path, chunk_size=16))) == content
+    db.close()
+
+
+def test_progress_events_are_streamed_while_running(tmp_path, monkeypatch):
+    """実行中のイベントが発生順に配信され、finished で終了し、Last-Event-ID 以降だけを再送することを確認"""
+    monkeypatch.setattr(settings, "EXECUTION_STEP_EXECUTOR", "inprocess")
+    monkeypatch.setattr(settings, "EXECUTION_STEP_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    Session = _make_session(tmp_path)
+    db = Session()
+    new_plan = _make_plan(db)
+    pending = ExecutionRepository(db).create(Execution(id=str(uuid.uuid4()), plan_id=new_plan.id, status="pending"))
+
+    # ワーカーが取得する前から購読できる
+    received = []
+    subscriber = threading.Thread(
+        target=lambda: received.extend(_collect(iter_events(pending.id, poll_interval=0.01, heartbeat_interval=60)))
+    )
+    subscriber.start()
+    done = run_execution(db, ExecutionRepository(db).claim_next_pending("worker-a"))
+    subscriber.join(5)
+    assert not subscriber.is_alive()
+
+    records = [json.loads(message.split("data: ", 1)[1]) for message in received]
+    assert [r["event"] for r in records] == [
+        "started", "step_started", "step_finished", "step_started", "step_finished", "finished"
+    ]
+    assert [r["id"] for r in records] == list(range(1, 7))
+    assert records[2]["rows_after"] == 100 and records[2]["peak_memory_bytes"] is not None
+    assert records[-1]["status"] == done.status == "completed"
+
+    replayed = _collect(open_event_stream(db, done.id, new_plan.user_id, last_event_id=4))
+    assert [message.split("\n")[0] for message in replayed] == ["id: 5", "id: 6"]
+    with pytest.raises(UnauthorizedAccessException):
+        open_event_stream(db, done.id, str(uuid.uuid4()))
+    db.close()
+
+
+def test_cancel_and_max_runtime_stop_executions(tmp_path, monkeypatch):
+    """取り消し・実行時間の上限で実行が cancelled になり、実行中のステップが強制終了されることを確認"""
+    monkeypatch.setattr(settings, "EXECUTION_STEP_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "EXECUTION_CANCEL_CHECK_INTERVAL", 0.05)
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    Session = _make_session(tmp_path)
+    db = Session()
+    new_plan = _make_plan(db)
+
+    # pending の実行はすぐに取り消され、購読中のクライアントには finished のイベントが届く
+    pending = ExecutionRepository(db).create(Execution(id=str(uuid.uuid4()), plan_id=new_plan.id, status="pending"))
+    assert cancel_execution(db, pending.id, new_plan.user_id).status == "cancelled"
+    assert json.loads(open(events_path(pending.id)).read())["status"] == "cancelled"
+    with pytest.raises(ValidationException):
+        cancel_execution(db, pending.id, new_plan.user_id)
+    assert ExecutionRepository(db).claim_next_pending("worker-a") is None
+
+    # 実行時間の上限はステップの間で確認する（inprocess では実行中のステップは止めない）
+    monkeypatch.setattr(settings, "EXECUTION_STEP_EXECUTOR", "inprocess")
+    new_plan.max_runtime = 0.5
+    new_plan.steps = [
+        PlanStep(id=str(uuid.uuid4()), order=i, name=f"sleep{i}", code_snippet="import time\ntime.sleep(0.3)\ndf = df")
+        for i in range(1, 5)
+    ]
+    db.commit()
+    ExecutionRepository(db).create(Execution(id=str(uuid.uuid4()), plan_id=new_plan.id, status="pending"))
+    done = run_execution(db, ExecutionRepository(db).claim_next_pending("worker-a"))
+    assert done.status == "cancelled" and "0.5秒" in done.error_message
+    assert [log.status for log in done.step_logs] == ["success", "success"]
+    assert done.after_summary_json is None and done.output_path is None
+
+    # sandbox では実行中のステップのワーカーを強制終了する
+    monkeypatch.setattr(settings, "EXECUTION_STEP_EXECUTOR", "sandbox")
+    monkeypatch.setattr(settings, "EXECUTION_SANDBOX_WORKERS", 1)
+    new_plan.max_runtime = None
+    new_plan.steps[1].code_snippet = "import time\ntime.sleep(60)\ndf = df"
+    db.commit()
+    running = ExecutionRepository(db).create(Execution(id=str(uuid.uuid4()), plan_id=new_plan.id, status="pending"))
+    step_executor.shutdown_pool()
+    try:
+        worker_db = Session()
+        worker = threading.Thread(
+            target=lambda: run_execution(worker_db, ExecutionRepository(worker_db).claim_next_pending("worker-a"))
+        )
+        worker.start()
+        _collect(
+            iter_events(running.id, poll_interval=0.01),
+            until=lambda message: '"step_started"' in message and '"sleep2"' in message,
+        )
+        assert cancel_execution(db, running.id, new_plan.user_id).cancel_requested_at is not None
+        worker.join(10)
+        assert not worker.is_alive()
+        worker_db.close()
+    finally:
+        step_executor.shutdown_pool()
+    db.expire_all()
+    cancelled = ExecutionRepository(db).find_by_id(running.id)
+    assert cancelled.status == "cancelled" and cancelled.error_message == "実行が取り消されました"
+    assert [log.status for log in cancelled.step_logs] == ["success", "cancelled"]
+    assert cancelled.execution_time < 10
+    db.close()
+
+
+def test_watcher_keeps_heartbeat_after_stopping_until_run_exits(tmp_path, monkeypatch):
+    """実行時間の上限で中断を要求した後も、実行が終わるまで生存を記録し続け、回収されないことを確認"""
+    from app.services import execution_queue
+    from app.services.execution_cancellation import ExecutionWatcher
+
+    monkeypatch.setattr(settings, "EXECUTION_HEARTBEAT_INTERVAL", 0.05)
+    monkeypatch.setattr(settings, "EXECUTION_STALE_TIMEOUT", 0.5)
+    Session = _make_session(tmp_path)
+    db = Session()
+    new_plan = _make_plan(db)
+    new_plan.max_runtime = 0.05
+    db.commit()
+    ExecutionRepository(db).create(Execution(id=str(uuid.uuid4()), plan_id=new_plan.id, status="pending"))
+    running = ExecutionRepository(db).claim_next_pending("other-host:1:token:execution-worker-0")
+
+    with ExecutionWatcher(db, running, check_interval=0.01) as watcher:
+        assert watcher.stop.wait(5) and watcher.reason == "timeout"
+        # 中断を要求した後のステップが終わるまで、古くなったとみなされる時間より長く処理を続ける
+        time.sleep(1.0)
+        db.expire_all()
+        assert execution_queue.sweep_stale_executions(db) == 0
+    db.expire_all()
+    execution = ExecutionRepository(db).find_by_id(running.id)
+    assert execution.status == "running" and execution.worker_id == running.worker_id
+    assert datetime.utcnow() - execution.heartbeat_at.replace(tzinfo=None) < timedelta(seconds=0.5)
+    db.close()
+
+
+def test_preview_runs_on_sampled_rows_without_saving(tmp_path, monkeypatch):
+    """プレビューが一部の行だけで実行され、実行履歴を残さずにステップごとの変化を返すことを確認"""
+    monkeypatch.setattr(settings, "EXECUTION_STEP_EXECUTOR", "inprocess")
+    monkeypatch.setattr(settings, "EXECUTION_STREAM_CHUNK_SIZE", 7)
+    monkeypatch.setattr(settings, "EXECUTION_PREVIEW_HEAD_ROWS", 3)
+    Session = _make_session(tmp_path)
+    db = Session()
+    new_plan = _make_plan(db)
+    csv_data = pd.DataFrame({
+        "age": [float(i) if i % 4 else None for i in range(50)], "id": range(50), "target": range(50)
+    }).to_csv(index=False)
+
+    head = preview_plan(db, new_plan.id, new_plan.user_id, csv_data=csv_data, rows=10)
+    assert head["status"] == "completed" and head["rows"] == 10 and head["total_rows"] is None
+    assert [r["columns_delta"] for r in head["step_results"]] == [0, -1]
+    assert head["columns"] == ["age", "id"] and head["head"] == [[0.0, 0], [1.0, 1], [2.0, 2]]
+
+    # random は入力全体から元の順序のまま選び、同じシードで同じ行を選ぶ
+    sampled = preview_plan(db, new_plan.id, new_plan.user_id, csv_data=csv_data, rows=20, sample="random", seed=3)
+    assert sampled["rows"] == 20 and sampled["total_rows"] == 50
+    ids = [row[1] for row in sampled["head"]]
+    assert ids == sorted(ids) and len(set(ids)) == 3
+    again = preview_plan(db, new_plan.id, new_plan.user_id, csv_data=csv_data, rows=20, sample="random", seed=3)
+    assert again["head"] == sampled["head"]
+    assert preview_plan(db, new_plan.id, new_plan.user_id, rows=5, sample="random", seed=1)["rows"] == 5
+
+    # 失敗したステップで打ち切り、エラーを返す
+    failing = preview_plan(db, new_plan.id, new_plan.user_id, csv_data="age\n1\n", rows=10)
+    assert failing["status"] == "failed" and failing["step_results"][-1]["status"] == "failed"
+    assert "target" in failing["error_message"] and failing["head"] == [[1]]
+    with pytest.raises(ValidationException):
+        preview_plan(db, new_plan.id, new_plan.user_id, rows=0)
+    assert db.query(Execution).count() == 0
+    db.close()
+
+
+def test_invalid_steps_are_rejected_before_enqueue(tmp_path, monkeypatch):
+    """保存済みの構文エラー・不正な操作のステップは、キューに登録する前に拒否されることを確認"""
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    Session = _make_session(tmp_path)
+    db = Session()
+    new_plan = _make_plan(db)
+    invalid_steps = (
+        PlanStep(id=str(uuid.uuid4()), order=1, name="broken", code_snippet="df = df.dropna("),
+        PlanStep(id=str(uuid.uuid4()), order=1, name="bad", operation_json='{"op": "scale_all"}'),
+        PlanStep(id=str(uuid.uuid4()), order=1, name="missing", operation_json='{"op": "standardize"}'),
+    )
+    for step in invalid_steps:
+        new_plan.steps = [step]
+        db.commit()
+        with pytest.raises(ValidationException, match=step.name):
+            enqueue_execution(db, new_plan.id, new_plan.user_id, csv_data="a\n1\n")
+    assert db.query(Execution).count() == 0
+
+    new_plan.steps = [PlanStep(id=str(uuid.uuid4()), order=1, name="ok", operation_json='{"op": "drop_na"}')]
+    db.commit()
+    assert enqueue_execution(db, new_plan.id, new_plan.user_id, csv_data="a\n1\n").status == "pending"
+    db.close()
+
+
+def test_after_summary_reuses_unchanged_columns():
+    """変更されていないカラムの統計量を再利用しても、全カラムを計算し直した結果と一致することを確認"""
+    df = _generate_sample_data()
+    df["flag"] = df["age"] > 40
+    df["empty"] = float("nan")
+    before, fingerprints = summarize_columns(df)
+
+    after_df = df.drop(columns=["flag"]).assign(income=df["income"].fillna(0), label=df["category"].str.lower())
+    expected, after_fingerprints = summarize_columns(after_df)
+    assert generate_after_summary(after_df, before, fingerprints) == expected
+    assert after_fingerprints["age"] == fingerprints["age"]
+    assert after_fingerprints["income"] != fingerprints["income"]
+    assert expected["column_info"]["empty"]["mean"] is None
+
+    # 行が減った場合はすべてのカラムを計算し直す
+    head = df.head(10)
+    assert generate_after_summary(head, before, fingerprints) == summarize_columns(head)[0]
+
+
+def test_batch_execution_tracks_children_and_finishes_parent(tmp_path, monkeypatch):
+    """一括実行の子が処理されると、親の集計と状態が更新されることを確認"""
+    monkeypatch.setattr(settings, "EXECUTION_STEP_EXECUTOR", "inprocess")
+    monkeypatch.setattr(settings, "EXECUTION_STEP_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "EXECUTION_BATCH_INPUT_DIR", str(tmp_path / "inputs"))
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    (tmp_path / "inputs").mkdir()
+    for day in range(3):
+        pd.DataFrame({"age": [20 + day, None], "target": [0, 1]}).to_csv(tmp_path / "inputs" / f"{day}.csv", index=False)
+    # target カラムがないため2番目のステップが失敗する
+    pd.DataFrame({"age": [1]}).to_csv(tmp_path / "inputs" / "broken.csv", index=False)
+    Session = _make_session(tmp_path)
+    db = Session()
+    new_plan = _make_plan(db)
+
+    with pytest.raises(ValidationException):
+        enqueue_batch_execution(db, new_plan.id, new_plan.user_id, file_paths=["../test.db"])
+
+    parent = enqueue_batch_execution(
+        db, new_plan.id, new_plan.user_id, file_paths=["0.csv", "1.csv", "2.csv", "broken.csv"]
+    )
+    assert parent.status == "running"
+    assert get_batch_progress(parent)["pending"] == 4
+
+    repo = ExecutionRepository(db)
+    while (child := repo.claim_next_pending("worker-a")) is not None:
+        assert parent.status == "running"
+        run_execution(db, child)
+        parent = update_batch_parent(db, child.parent_id)
+
+    assert parent.status == "failed" and parent.error_message.startswith("1件")
+    progress = get_batch_progress(parent)
+    assert (progress["completed"], progress["failed"], progress["rows"]) == (3, 1, 6)
+    assert progress["rows_per_second"] > 0
+    assert [r["status"] for r in progress["results"]][-1] == "failed"
+    # 入力ファイルは実行後も残り、一覧には親だけが表示される
+    assert (tmp_path / "inputs" / "0.csv").exists()
+    assert [e.id for e in repo.find_by_plan_id(new_plan.id)] == [parent.id]
+    db.close()
+
+
+def test_interactive_executions_are_claimed_before_large_batch(tmp_path, monkeypatch):
+    """大きな一括実行の後に登録した通常の実行が、一括実行の終了を待たずに取得されることを確認"""
+    monkeypatch.setattr(settings, "EXECUTION_BATCH_INPUT_DIR", str(tmp_path / "inputs"))
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    (tmp_path / "inputs").mkdir()
+    for day in range(10):
+        pd.DataFrame({"age": [day], "target": [0]}).to_csv(tmp_path / "inputs" / f"{day}.csv", index=False)
+    Session = _make_session(tmp_path)
+    db = Session()
+    new_plan = _make_plan(db)
+    repo = ExecutionRepository(db)
+
+    parent = enqueue_batch_execution(
+        db, new_plan.id, new_plan.user_id, file_paths=[f"{day}.csv" for day in range(10)]
+    )
+    # 1つの一括実行で同時に処理する子は上限まで
+    claimed = [repo.claim_next_pending(f"worker-{i}", batch_concurrency=2) for i in range(3)]
+    assert [c.parent_id for c in claimed[:2]] == [parent.id, parent.id] and claimed[2] is None
+
+    interactive = enqueue_execution(db, new_plan.id, new_plan.user_id, csv_data="age,target\n1,0\n")
+    assert repo.claim_next_pending("worker-2", batch_concurrency=2).id == interactive.id
+    # 上限がなくても通常の実行を先に取得する
+    second = enqueue_execution(db, new_plan.id, new_plan.user_id, csv_data="age,target\n1,0\n")
+    assert repo.claim_next_pending("worker-3").id == second.id
+    assert get_batch_progress(parent)["pending"] == 8
+
+    # 処理中の子が終わると、次の子を取得できる
+    assert repo.finish_claim(claimed[0].id, "worker-0", "failed", "stopped")
+    assert repo.claim_next_pending("worker-0", batch_concurrency=2).parent_id == parent.id
+    db.close()
+
+
+def test_failed_runs_are_finalized_and_stale_claims_swept(tmp_path, monkeypatch):
+    """処理中の例外で実行が failed になり、停止したワーカーの実行が回収されることを確認"""
+    from app.services import execution_queue, execution_service
+
+    monkeypatch.setattr(settings, "EXECUTION_STEP_EXECUTOR", "inprocess")
+    monkeypatch.setattr(settings, "EXECUTION_STEP_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    Session = _make_session(tmp_path)
+    db = Session()
+    new_plan = _make_plan(db)
+
+    # 想定外の例外でも running のまま残らず、イベントと実行履歴の状態が一致する。
+    # 記録前に書き出した実行結果は削除する
+    def broken(db, execution, *args, **kwargs):
+        execution_output.write_output(pd.DataFrame({"a": [1]}), execution_output.output_path(execution.id), "csv")
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(execution_service, "_run_memory_execution", broken)
+    ExecutionRepository(db).create(Execution(id=str(uuid.uuid4()), plan_id=new_plan.id, status="pending"))
+    done = run_execution(db, ExecutionRepository(db).claim_next_pending("worker-a"))
+    db.expire_all()
+    assert ExecutionRepository(db).find_by_id(done.id).status == "failed"
+    assert "boom" in done.error_message and done.completed_at is not None
+    finished = [json.loads(line) for line in open(events_path(done.id))][-1]
+    assert finished["event"] == "finished" and finished["status"] == "failed"
+    assert not os.path.exists(execution_output.output_path(done.id))
+    monkeypatch.undo()
+
+    # 停止したワーカーの実行: 取得した回数が上限未満なら pending に戻し、上限に達していれば failed にする
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    monkeypatch.setattr(settings, "EXECUTION_STALE_TIMEOUT", 60.0)
+    monkeypatch.setattr(settings, "EXECUTION_MAX_ATTEMPTS", 2)
+    host = execution_queue.socket.gethostname()
+    now = datetime.utcnow()
+    rows = {
+        # このプロセスのトークンだが処理中のワーカーがない（スレッドが異常終了した）
+        "orphan": (f"{host}:1:{execution_queue._PROCESS_TOKEN}:execution-worker-9", now, 1),
+        # 生存の記録が途絶えた別ホストのワーカー（取得した回数が上限に達している）
+        "stale": ("other-host:1:token:execution-worker-0", now - timedelta(minutes=5), 2),
+        # 生存の記録が新しい別ホストのワーカー（回収しない）
+        "alive": ("other-host:1:token:execution-worker-1", now, 1),
+    }
+    ids = {}
+    for key, (worker_id, heartbeat_at, attempts) in rows.items():
+        row = ExecutionRepository(db).create(Execution(
+            id=str(uuid.uuid4()), plan_id=new_plan.id, status="running",
+            worker_id=worker_id, started_at=heartbeat_at, heartbeat_at=heartbeat_at, attempts=attempts,
+        ))
+        ids[key] = row.id
+        execution_output.write_output(pd.DataFrame({"a": [1]}), execution_output.output_path(row.id), "csv")
+    assert execution_queue.sweep_stale_executions(db) == 2
+    assert execution_queue.sweep_stale_executions(db) == 0
+    db.expire_all()
+    repo = ExecutionRepository(db)
+    orphan = repo.find_by_id(ids["orphan"])
+    assert orphan.status == "pending" and orphan.worker_id is None
+    stale = repo.find_by_id(ids["stale"])
+    assert stale.status == "failed" and stale.completed_at is not None
+    assert json.loads(open(events_path(stale.id)).read())["status"] == "failed"
+    assert not os.path.exists(execution_output.output_path(stale.id))
+    assert repo.find_by_id(ids["alive"]).status == "running"
+
+    # 戻した実行を再び処理すると、以前の試行の実行結果は上書きされる（別の形式のファイルも残さない）
+    stale_output = execution_output.output_path(orphan.id, "parquet")
+    os.rename(execution_output.output_path(orphan.id), stale_output)
+
+    # pending に戻した実行は再び取得でき、取得した回数が増える
+    assert repo.claim_next_pending("worker-b").id == orphan.id
+    db.expire_all()
+    assert repo.find_by_id(orphan.id).attempts == 2
+    monkeypatch.setattr(settings, "EXECUTION_STEP_EXECUTOR", "inprocess")
+    monkeypatch.setattr(settings, "EXECUTION_STEP_CACHE_ENABLED", False)
+    rerun = run_execution(db, repo.find_by_id(orphan.id))
+    assert rerun.status == "completed" and rerun.output_path.endswith(".csv")
+    assert not os.path.exists(stale_output)
+    db.close()
+
+
+def test_step_leaving_non_dataframe_fails_and_logs_are_flushed(tmp_path, monkeypatch):
+    """df が DataFrame でなくなったステップは失敗になり、After サマリの失敗でもステップログが残ることを確認"""
+    from app.services import execution_service
+
+    monkeypatch.setattr(settings, "EXECUTION_STEP_EXECUTOR", "inprocess")
+    monkeypatch.setattr(settings, "EXECUTION_STEP_CACHE_DIR", str(tmp_path / "step_cache"))
+    monkeypatch.setattr(settings, "EXECUTION_STEP_LOG_FLUSH_STEPS", 100)
+    monkeypatch.setattr(settings, "EXECUTION_STEP_LOG_FLUSH_INTERVAL", 3600.0)
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    Session = _make_session(tmp_path)
+    db = Session()
+    new_plan = _make_plan(db)
+    new_plan.steps[1].code_snippet = "df = df.drop(columns=['target'], inplace=True)"
+    db.commit()
+
+    ExecutionRepository(db).create(Execution(id=str(uuid.uuid4()), plan_id=new_plan.id, status="pending"))
+    done = run_execution(db, ExecutionRepository(db).claim_next_pending("worker-a"))
+    assert done.status == "failed"
+    assert [log.status for log in done.step_logs] == ["success", "failed"]
+    assert "DataFrame" in done.step_logs[1].error_message
+
+    # After サマリの作成に失敗しても、まだコミットしていないステップログと実行結果を同じコミットで書き込む
+    new_plan.steps[1].code_snippet = "df = df.drop(columns=['target'])"
+    db.commit()
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("summary failed")
+
+    monkeypatch.setattr(execution_service, "generate_after_summary", broken)
+    ExecutionRepository(db).create(Execution(id=str(uuid.uuid4()), plan_id=new_plan.id, status="pending"))
+    done = run_execution(db, ExecutionRepository(db).claim_next_pending("worker-a"))
+    other = Session()
+    saved = ExecutionRepository(other).find_by_id(done.id)
+    assert saved.status == "failed" and "summary failed" in saved.error_message
+    assert [log.status for log in saved.step_logs] == ["cached", "success"]
+    other.close()
+    db.close()
+
+
+def test_checkpoint_skips_non_dataframe_results(tmp_path, monkeypatch):
+    """DataFrame以外の結果は中間結果として保存せず、そのステップからは再開しないことを確認"""
+    cache_dir = str(tmp_path / "step_cache")
+    assert step_cache.write_checkpoint(pd.Series([1, 2, 3]), cache_dir, "series", 0) == 0
+    assert step_cache.write_checkpoint(None, cache_dir, "none", 0) == 0
+    assert not (tmp_path / "step_cache").exists()
+
+    monkeypatch.setattr(settings, "EXECUTION_STEP_EXECUTOR", "inprocess")
+    monkeypatch.setattr(settings, "EXECUTION_STEP_CACHE_DIR", cache_dir)
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    Session = _make_session(tmp_path)
+    db = Session()
+    new_plan = _make_plan(db)
+    new_plan.steps[1].code_snippet = "df = df['age']"
+    db.commit()
+    for _ in range(2):
+        ExecutionRepository(db).create(Execution(id=str(uuid.uuid4()), plan_id=new_plan.id, status="pending"))
+        done = run_execution(db, ExecutionRepository(db).claim_next_pending("worker-a"))
+    # 2回目は1つ目のステップだけを中間結果から再開し、DataFrame以外になるステップは再び失敗する
+    assert done.status == "failed"
+    assert [log.status for log in done.step_logs] == ["cached", "failed"]
+    db.close()
+
+
+def test_event_streams_do_not_hold_threadpool_workers(tmp_path, monkeypatch):
+    """購読中のイベントストリームがスレッドプールを占有せず、同期のエンドポイントが応答できることを確認"""
+    import anyio
+    from anyio import to_thread
+    from fastapi import FastAPI
+    from sqlalchemy.pool import StaticPool
+
+    from app.db.session import get_db
+    from app.dependencies.auth import get_current_user
+    from app.models.user import User
+    from app.routers import executions
+
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    monkeypatch.setattr(settings, "EXECUTION_EVENTS_POLL_INTERVAL", 0.01)
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    new_plan = _make_plan(db)
+    pending = ExecutionRepository(db).create(Execution(id=str(uuid.uuid4()), plan_id=new_plan.id, status="pending"))
+    owner_id = new_plan.user_id
+    db.close()
+
+    def override_db():
+        session = Session()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app = FastAPI()
+    app.include_router(executions.execution_detail_router, prefix="/api/v1")
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_current_user] = lambda: User(id=owner_id, email="owner@example.com")
+
+    async def request(path: str, sent: list, disconnect: anyio.Event) -> None:
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+            "headers": [(b"host", b"test")], "client": ("test", 1), "server": ("test", 80),
+        }
+        received = False
+
+        async def receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        await app(scope, receive, send)
+
+    async def scenario():
+        # スレッドプールを購読者の数より小さくする（同期のイテレータでは全スレッドが塞がる）
+        to_thread.current_default_thread_limiter().total_tokens = 3
+        disconnect = anyio.Event()
+        streams = [[] for _ in range(8)]
+        async with anyio.create_task_group() as tg:
+            for sent in streams:
+                tg.start_soon(request, f"/api/v1/executions/{pending.id}/events", sent, disconnect)
+            with anyio.fail_after(5):
+                while not all(sent for sent in streams):
+                    await anyio.sleep(0.01)
+                detail = []
+                await request(f"/api/v1/executions/{pending.id}", detail, anyio.Event())
+            disconnect.set()
+            tg.cancel_scope.cancel()
+        return streams, detail
+
+    streams, detail = anyio.run(scenario)
+    assert all(sent[0]["status"] == 200 for sent in streams)
+    assert detail[0]["status"] == 200
+    assert json.loads(detail[1]["body"])["data"]["status"] == "pending"
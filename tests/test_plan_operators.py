@@ -0,0 +1,99 @@
+"""構造化された操作のテスト"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.models import dataset, execution, plan, user  # noqa: F401
+from app.models.plan import PlanStep
+from app.schemas.plan_operation import validate_operation
+from app.services import streaming_execution
+from app.services.step_dependencies import StepColumns, analyze_columns
+from app.services.step_executor import exec_step
+
+SCALE_SNIPPET = (
+    "from sklearn.preprocessing import StandardScaler\n"
+    "numeric_cols = ['a', 'b', 'k']\n"
+    "scaler = StandardScaler()\n"
+    "df[numeric_cols] = scaler.fit_transform(df[numeric_cols])"
+)
+ENCODE_SNIPPET = (
+    "from sklearn.preprocessing import LabelEncoder\n"
+    "categorical_cols = ['c', 'n']\n"
+    "for col in categorical_cols:\n"
+    "    le = LabelEncoder()\n"
+    "    df[col] = le.fit_transform(df[col].astype(str))"
+)
+
+
+def test_operations_match_sklearn_snippets():
+    """standardize / label_encode が従来の sklearn のコードスニペットと同じ結果になることを確認"""
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({
+        "a": rng.normal(size=1000),
+        "b": np.where(rng.random(1000) < 0.1, np.nan, rng.integers(0, 50, 1000)),
+        "k": 5.0,
+        "c": rng.choice(["x", "y", "Z", None], size=1000),
+        "n": rng.integers(0, 12, 1000),
+    })
+    for snippet, operation in (
+        (SCALE_SNIPPET, {"op": "standardize", "columns": ["a", "b", "k"]}),
+        (ENCODE_SNIPPET, {"op": "label_encode", "columns": ["c", "n"]}),
+    ):
+        pd.testing.assert_frame_equal(exec_step(operation, df.copy()), exec_step(snippet, df.copy()))
+        assert analyze_columns(operation) == analyze_columns(snippet)
+
+    clipped = exec_step({"op": "clip_outliers", "columns": ["a"], "method": "zscore", "factor": 1.0}, df)
+    assert clipped["a"].max() <= df["a"].mean() + df["a"].std(ddof=0) + 1e-12
+    filled = exec_step({"op": "fill_na", "columns": ["b"], "strategy": "median"}, df)
+    assert filled["b"].isna().sum() == 0 and filled["b"].dtype == np.float64
+    with pytest.raises(KeyError):
+        exec_step({"op": "standardize", "columns": ["missing"]}, df)
+
+    # チャンク実行は行ごとに完結する操作と standardize / label_encode に対応する
+    assert isinstance(
+        streaming_execution.analyze_step({"op": "standardize", "columns": ["a"]}),
+        streaming_execution.StandardScalerStep,
+    )
+    assert isinstance(streaming_execution.analyze_step({"op": "drop_na"}), streaming_execution.RowLocalStep)
+    assert streaming_execution.analyze_step({"op": "one_hot", "columns": ["c"]}) is None
+    assert analyze_columns({"op": "one_hot", "columns": ["c"]}) is None
+    assert analyze_columns({"op": "cast", "columns": ["n"], "dtype": "str"}) == StepColumns(
+        frozenset({"n"}), frozenset({"n"})
+    )
+
+
+def test_operations_are_validated_with_defaults():
+    """不正な操作は ValueError になり、省略したパラメータは既定値で補われることを確認"""
+    operation = validate_operation({"op": "fill_na", "columns": ["a"]})
+    assert operation == {"op": "fill_na", "columns": ["a"], "strategy": "mean", "value": None}
+    assert validate_operation({"op": "drop_na"})["how"] == "any"
+    step = PlanStep(order=1, name="fill")
+    step.operation = {"op": "fill_na", "columns": ["a"]}
+    assert step.source == step.operation
+
+    for operation in (
+        {"op": "scale_all"},
+        {"op": "standardize"},
+        {"op": "cast", "columns": ["a"], "dtype": "decimal"},
+        {"op": "fill_na", "strategy": "constant"},
+        {"op": "drop_na", "subset": ["a"]},
+    ):
+        with pytest.raises(ValueError):
+            validate_operation(operation)
+
+
+def test_cast_converts_each_column_by_its_own_inference():
+    """datetime / numeric への変換がカラムごとに形式・型を推定し、変換済みのカラムはそのまま残すことを確認"""
+    df = pd.DataFrame({
+        "iso": ["2024-01-02", "2024-02-03"],
+        "us": ["01/02/2024", "02/03/2024"],
+        "ints": ["1", "2"],
+        "floats": ["1.5", "x"],
+        "done": pd.to_datetime(["2024-01-01", None]),
+    })
+    dates = exec_step({"op": "cast", "columns": ["iso", "us", "done"], "dtype": "datetime"}, df)
+    assert dates["us"].dt.month.tolist() == [1, 2] and dates["iso"].dt.day.tolist() == [2, 3]
+    assert dates["done"].equals(df["done"])
+    numbers = exec_step({"op": "cast", "columns": ["ints", "floats"], "dtype": "numeric"}, df)
+    assert numbers["ints"].dtype == np.int64
+    assert numbers["floats"].iloc[0] == 1.5 and np.isnan(numbers["floats"].iloc[1])
@@ -0,0 +1,135 @@
+"""マージ可能なプロファイル統計量のテスト"""
+import io
+import math
+
+import numpy as np
+import pandas as pd
+
+from app.services.profile_accumulators import ColumnAccumulator, HyperLogLog, KLLSketch, ProfileAccumulator
+from app.services.profiling_service import profile_appended_chunks, profile_csv_stream, profile_dataframe
+
+
+def test_kll_sketch_quantiles_within_rank_error():
+    """KLLスケッチの分位点が順位誤差の範囲に収まることを確認"""
+    values = np.random.default_rng(0).normal(size=200_000)
+    sketch = KLLSketch(k=200)
+    for chunk in np.array_split(values, 7):
+        sketch.update(chunk)
+
+    assert sketch.n == len(values)
+    sorted_values = np.sort(values)
+    for q, estimate in zip((0.25, 0.5, 0.75), sketch.quantiles((0.25, 0.5, 0.75))):
+        rank = np.searchsorted(sorted_values, estimate) / len(values)
+        assert abs(rank - q) <= sketch.rank_error()
+
+
+def test_hyperloglog_estimate_and_merge():
+    """HyperLogLogの推定値とマージ結果を確認"""
+    left, right = HyperLogLog(12), HyperLogLog(12)
+    left.update(np.arange(0, 60_000, dtype=np.float64))
+    right.update(np.arange(40_000, 100_000, dtype=np.float64))
+    left.merge(right)
+
+    assert abs(left.estimate() - 100_000) / 100_000 <= 3 * left.relative_error()
+
+
+def test_accumulator_merge_and_round_trip_match_single_pass():
+    """分割して集計・シリアライズ・マージした結果が一括集計と一致することを確認"""
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({
+        "value": rng.normal(10, 2, 1000),
+        "label": rng.choice(["a", "b"], 1000),
+    })
+    df.loc[rng.random(1000) < 0.1, "value"] = np.nan
+
+    whole = ProfileAccumulator()
+    whole.update(df)
+    first, second = ProfileAccumulator(), ProfileAccumulator()
+    first.update(df.iloc[:400])
+    second.update(df.iloc[400:])
+    merged = ProfileAccumulator.from_dict(first.to_dict())
+    merged.merge(ProfileAccumulator.from_dict(second.to_dict()))
+
+    expected = whole.finalize()["column_profiles"]
+    actual = merged.finalize()["column_profiles"]
+    for key in ("count", "missing", "unique", "mean", "std", "min", "max"):
+        assert math.isclose(actual["value"][key], expected["value"][key], rel_tol=1e-9)
+    assert actual["label"]["top_values"] == expected["label"]["top_values"]
+
+
+def test_column_switching_to_categorical_does_not_double_count():
+    """数値のチャンクの後に文字列のチャンクが来ても、同じ値を二重に数えないことを確認"""
+    few = ColumnAccumulator()
+    few.update(pd.Series([1, 2, 3]))
+    few.update(pd.Series(["1", "2", "x"], dtype=object))
+    profile = few.finalize()
+    assert profile["dtype_category"] == "categorical"
+    assert profile["unique"] == 4
+    assert profile["top_values"] == {"1.0": 2, "2.0": 2, "3.0": 1, "x": 1}
+
+    many = ColumnAccumulator()
+    many.update(pd.Series(np.arange(5_000, dtype=np.float64)))
+    many.update(pd.Series([str(i) for i in range(5_000)] + ["x"], dtype=object))
+    assert abs(many.finalize()["unique"] - 5_001) / 5_001 <= 3 * many.distinct.relative_error()
+
+    merged = ColumnAccumulator.from_dict(few.to_dict())
+    other = ColumnAccumulator()
+    other.update(pd.Series(["3", "y"], dtype=object))
+    merged.merge(other)
+    assert merged.finalize()["top_values"] == {"1.0": 2, "2.0": 2, "3.0": 2, "x": 1, "y": 1}
+
+
+def test_profile_csv_stream_matches_exact_profile():
+    """ストリーミングプロファイルが厳密な結果と誤差の範囲で一致することを確認"""
+    rng = np.random.default_rng(2)
+    n = 50_000
+    df = pd.DataFrame({
+        "x": rng.exponential(size=n),
+        "group": rng.choice(["A", "B", "C"], n),
+    })
+    df.loc[rng.random(n) < 0.2, "x"] = np.nan
+    csv = df.to_csv(index=False)
+
+    exact = profile_dataframe(pd.read_csv(io.StringIO(csv)))
+    stream = profile_csv_stream(io.StringIO(csv), chunksize=7_000)
+
+    assert stream["mode"] == "stream"
+    assert stream["rows"] == exact["rows"]
+    assert stream["missing_values"] == exact["missing_values"]
+    x_exact, x_stream = exact["column_profiles"]["x"], stream["column_profiles"]["x"]
+    assert math.isclose(x_stream["mean"], x_exact["mean"], rel_tol=1e-9)
+    assert math.isclose(x_stream["std"], x_exact["std"], rel_tol=1e-9)
+    assert x_stream["min"] == x_exact["min"] and x_stream["max"] == x_exact["max"]
+    values = np.sort(df["x"].dropna().to_numpy())
+    for q_key, q in (("q1", 0.25), ("median", 0.5), ("q3", 0.75)):
+        rank = np.searchsorted(values, x_stream[q_key]) / len(values)
+        assert abs(rank - q) <= x_stream["error_bounds"][q_key]
+    assert stream["column_profiles"]["group"]["top_values"] == exact["column_profiles"]["group"]["top_values"]
+
+
+def test_profile_appended_chunks_matches_exact_profile():
+    """保存した状態に追記分だけを加えたプロファイルが全体の厳密な結果と一致することを確認"""
+    rng = np.random.default_rng(4)
+    n = 30_000
+    df = pd.DataFrame({
+        "x": rng.standard_cauchy(n),
+        "group": rng.choice(["A", "B", "C"], n),
+    })
+    df.loc[rng.random(n) < 0.1, "x"] = np.nan
+    history, delta = df.iloc[:25_000], df.iloc[25_000:].reset_index(drop=True)
+
+    _, state = profile_appended_chunks(None, lambda size: [history.iloc[:10_000], history.iloc[10_000:]], [])
+    history_reads = []
+    profile, _ = profile_appended_chunks(
+        state, lambda size: history_reads.append(size) or [history], [delta.iloc[:2_000], delta.iloc[2_000:]]
+    )
+    assert not history_reads  # 状態があれば既存データは読み直さない
+
+    exact = profile_dataframe(df)
+    assert profile["mode"] == "incremental"
+    assert profile["rows"] == n
+    assert profile["missing_values"] == exact["missing_values"]
+    x, x_exact = profile["column_profiles"]["x"], exact["column_profiles"]["x"]
+    assert math.isclose(x["mean"], x_exact["mean"], rel_tol=1e-9)
+    assert abs(x["outliers_rate"] - x_exact["outliers_rate"]) <= x["error_bounds"]["outliers_rate"]
+    assert profile["column_profiles"]["group"]["top_values"] == exact["column_profiles"]["group"]["top_values"]
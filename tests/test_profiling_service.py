@@ -0,0 +1,514 @@
+"""プロファイリングサービスのテスト"""
+import io
+import math
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.core.config import settings
+from app.services import columnar_store, csv_ingest, parallel_profiling, profiling_service
+from app.services.profile_cache import ProfileCache
+from app.services.profiling_service import (
+    _profile_column,
+    detect_data_quality_issues,
+    profile_csv_data,
+    profile_dataframe,
+)
+
+
+def _make_frame() -> pd.DataFrame:
+    """検証用のDataFrameを生成"""
+    rng = np.random.default_rng(0)
+    n = 500
+    df = pd.DataFrame({
+        "age": rng.integers(18, 80, n),
+        "income": rng.normal(50000, 15000, n),
+        "category": rng.choice(["A", "B", "C"], n),
+        "score": rng.standard_cauchy(n),
+        "nullable_int": pd.array(rng.integers(0, 5, n), dtype="Int64"),
+        "all_missing": np.full(n, np.nan),
+        "constant": np.ones(n),
+    })
+    df.loc[rng.random(n) < 0.2, "income"] = np.nan
+    df.loc[rng.random(n) < 0.1, "category"] = None
+    df.loc[rng.random(n) < 0.3, "nullable_int"] = pd.NA
+    return df
+
+
+def _assert_profiles_equal(actual: dict, expected: dict):
+    assert list(actual.keys()) == list(expected.keys())
+    for key, value in expected.items():
+        if isinstance(value, float):
+            assert math.isclose(actual[key], value, rel_tol=1e-9, abs_tol=1e-9), key
+        else:
+            assert actual[key] == value, key
+
+
+def test_profile_dataframe_matches_per_column_profile():
+    """一括計算の結果がカラム単位のプロファイルと一致することを確認"""
+    df = _make_frame()
+    profile = profile_dataframe(df)
+
+    assert profile["rows"] == len(df)
+    assert profile["columns"] == len(df.columns)
+    assert profile["missing_values"] == int(df.isnull().sum().sum())
+    assert math.isclose(profile["missing_rate"], df.isnull().sum().sum() / df.size)
+    assert profile["numeric_columns"] == ["age", "income", "score", "nullable_int", "all_missing", "constant"]
+    assert profile["categorical_columns"] == ["category"]
+
+    for col in df.columns:
+        _assert_profiles_equal(profile["column_profiles"][col], _profile_column(df[col]))
+
+
+def test_profile_dataframe_empty_and_boolean_columns():
+    """空のDataFrameと真偽値カラムを扱えることを確認"""
+    empty = profile_dataframe(pd.DataFrame({"a": pd.Series([], dtype="float64")}))
+    assert empty["rows"] == 0
+    assert empty["missing_rate"] == 0
+    assert "mean" not in empty["column_profiles"]["a"]
+
+    flags = profile_dataframe(pd.DataFrame({"flag": [True, False, True, True]}))
+    assert flags["column_profiles"]["flag"]["mean"] == 0.75
+    assert flags["column_profiles"]["flag"]["median"] == 1.0
+
+
+def test_sample_mode_confidence_intervals_and_uncertain_issues():
+    """sampleモードの推定値・信頼区間と、しきい値付近の問題の扱いを確認"""
+    rng = np.random.default_rng(3)
+    n = 20_000
+    df = pd.DataFrame({"x": rng.normal(size=n)})
+    df.loc[rng.random(n) < 0.1, "x"] = np.nan
+    csv = df.to_csv(index=False)
+
+    profile = profile_csv_data(csv, mode="sample", sample_size=2_000)
+    col_profile = profile["column_profiles"]["x"]
+    assert profile["mode"] == "sample"
+    assert profile["sample_size"] == 2_000
+    assert profile["rows"] == n
+    lower, upper = col_profile["confidence_intervals"]["missing_rate"]
+    assert lower <= col_profile["missing_rate"] <= upper
+
+    # 欠損率10%付近はしきい値をまたぐため uncertain として検出される
+    issues = detect_data_quality_issues(profile)
+    missing_issues = [i for i in issues if i["column"] == "x" and "missing" in i["type"]]
+    assert missing_issues and missing_issues[0]["uncertain"]
+
+    # サンプルサイズが行数以上なら全数となり、信頼区間の幅は0になる
+    full = profile_csv_data(csv, mode="sample", sample_size=n)
+    exact = profile_csv_data(csv)
+    full_x, exact_x = full["column_profiles"]["x"], exact["column_profiles"]["x"]
+    assert full_x["missing"] == exact_x["missing"]
+    assert full_x["unique"] == exact_x["unique"]
+    assert math.isclose(full_x["median"], exact_x["median"])
+    assert full_x["confidence_intervals"]["median"] == [full_x["median"], full_x["median"]]
+    assert not any(issue["uncertain"] for issue in detect_data_quality_issues(exact))
+
+
+def test_profile_cache_hit_eviction_and_invalidate(tmp_path):
+    """プロファイルキャッシュのヒット・追い出し・無効化を確認"""
+    cache = ProfileCache(max_bytes=300, db_path=str(tmp_path / "cache.db"))
+    first = {"rows": 1, "payload": "x" * 200}
+    second = {"rows": 2, "payload": "y" * 200}
+
+    assert cache.get("a") is None
+    cache.put("a", first)
+    assert cache.get("a") is first
+    cache.put("b", second)  # メモリ層の上限を超えるため "a" が追い出される
+    assert cache.stats()["evictions"] == 1
+    assert cache.get("a") == first  # ディスク層から復元される
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["disk_entries"] == 2
+
+    cache.invalidate()
+    assert cache.get("a") is None and cache.get("b") is None
+    assert cache.stats()["disk_entries"] == 0
+
+
+def test_columnar_store_round_trip(tmp_path):
+    """カラム単位の保存形式に変換したデータがCSVの読み込み結果と一致することを確認"""
+    df = _make_frame().drop(columns=["nullable_int"])
+    df["flag"] = df["age"] > 50
+    csv_path = tmp_path / "data.csv"
+    df.to_csv(csv_path, index=False)
+
+    store_dir = str(tmp_path / "store")
+    schema = columnar_store.convert_csv(str(csv_path), store_dir, chunksize=128)
+    assert schema["rows"] == len(df)
+
+    expected = pd.read_csv(csv_path)
+    pd.testing.assert_frame_equal(columnar_store.load_frame(store_dir), expected)
+    pd.testing.assert_frame_equal(
+        columnar_store.load_frame(store_dir, ["category", "income"]), expected[["category", "income"]]
+    )
+    chunks = list(columnar_store.iter_chunks(store_dir, 200))
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected)
+
+    # 追記した行が末尾に連結され、新しい文字列は辞書に追加される
+    delta = expected.iloc[:50].assign(category="D")
+    delta_path = tmp_path / "delta.csv"
+    delta.to_csv(delta_path, index=False)
+    schema = columnar_store.append_csv(str(delta_path), store_dir, chunksize=32)
+    assert schema["rows"] == len(df) + len(delta)
+    pd.testing.assert_frame_equal(
+        columnar_store.load_frame(store_dir), pd.concat([expected, delta], ignore_index=True)
+    )
+
+    # DataFrameから保存した場合は型とインデックス（連番でない整数）も復元される
+    filtered = expected.dropna().assign(label=lambda d: d["category"].astype(object))
+    frame_dir = str(tmp_path / "frame")
+    columnar_store.write_frame(filtered, frame_dir)
+    pd.testing.assert_frame_equal(columnar_store.load_frame(frame_dir), filtered)
+    with pytest.raises(ValueError):
+        columnar_store.write_frame(filtered.astype({"category": "category"}), frame_dir)
+
+
+def test_columnar_store_variable_length_categories(tmp_path):
+    """長い値や末尾がNUL文字の値を含む辞書が元の値のまま、値の合計程度の大きさで保存されることを確認"""
+    long_value = "x" * 100_000
+    values = [f"v{i}" for i in range(1000)] + [long_value, "ab\x00", "\x00"]
+    df = pd.DataFrame({"text": values, "other": ["ab\x00", None] * (len(values) // 2) + ["c"]})
+    frame_dir = str(tmp_path / "frame")
+    schema = columnar_store.write_frame(df, frame_dir)
+    pd.testing.assert_frame_equal(columnar_store.load_frame(frame_dir), df)
+    loaded = columnar_store.load_rows(frame_dir, np.array([1000, 1001, 1002]), ["text"])
+    assert loaded["text"].tolist() == [long_value, "ab\x00", "\x00"]
+    size = sum(os.path.getsize(os.path.join(frame_dir, name)) for name in os.listdir(frame_dir))
+    assert size < 200_000
+    assert schema["columns"][0]["category_count"] == len(values)
+
+    # CSVから変換・追記した場合も長い値が保存される
+    csv_path = tmp_path / "data.csv"
+    pd.DataFrame({"text": values[:1001]}).to_csv(csv_path, index=False)
+    store_dir = str(tmp_path / "store")
+    columnar_store.convert_csv(str(csv_path), store_dir, chunksize=100)
+    delta_path = tmp_path / "delta.csv"
+    pd.DataFrame({"text": ["new", long_value + "y"]}).to_csv(delta_path, index=False)
+    columnar_store.append_csv(str(delta_path), store_dir, chunksize=100)
+    assert columnar_store.load_frame(store_dir)["text"].tolist() == values[:1001] + ["new", long_value + "y"]
+
+
+def test_parallel_profile_matches_serial(monkeypatch):
+    """カラム並列プロファイリングの結果が逐次処理と同じ順序・内容になることを確認"""
+    df = _make_frame()
+    df["flag"] = df["age"] > 50
+    # float64 に変換すると同じ値になる大きな整数（ユニーク数は元の型で数える）
+    df["big"] = np.int64(2**60) + np.arange(len(df))
+    expected = profile_dataframe(df)
+    assert expected["column_profiles"]["big"]["unique"] == len(df)
+
+    monkeypatch.setattr(settings, "PROFILING_PARALLEL_WORKERS", 2)
+    # 数値カラムが複数のブロックに分かれるようにする
+    monkeypatch.setattr(profiling_service, "NUMERIC_BLOCK_BYTES", len(df) * 8 * 4)
+    monkeypatch.setattr(settings, "PROFILING_PARALLEL_SHARDS", 3)
+    monkeypatch.setattr(settings, "PROFILING_PARALLEL_MIN_COLUMNS", 1)
+    try:
+        actual = profile_dataframe(df)
+    finally:
+        parallel_profiling.shutdown_executor()
+
+    assert list(actual["column_profiles"]) == list(expected["column_profiles"])
+    assert actual["numeric_columns"] == expected["numeric_columns"]
+    assert actual["missing_values"] == expected["missing_values"]
+    for col in df.columns:
+        _assert_profiles_equal(actual["column_profiles"][col], expected["column_profiles"][col])
+
+
+def test_parallel_profile_recovers_from_broken_pool(monkeypatch):
+    """ワーカーが異常終了したプロセスプールを作り直し、作り直せない場合は逐次処理で計算することを確認"""
+    df = _make_frame()
+    expected = profile_dataframe(df)
+    monkeypatch.setattr(settings, "PROFILING_PARALLEL_WORKERS", 2)
+    monkeypatch.setattr(settings, "PROFILING_PARALLEL_MIN_COLUMNS", 1)
+
+    def broken_executor():
+        executor = parallel_profiling.ProcessPoolExecutor(
+            max_workers=1, mp_context=parallel_profiling.multiprocessing.get_context("spawn")
+        )
+        with pytest.raises(parallel_profiling.BrokenProcessPool):
+            executor.submit(os._exit, 1).result()
+        return executor
+
+    try:
+        broken = broken_executor()
+        monkeypatch.setattr(parallel_profiling, "_executor", broken)
+        actual = profile_dataframe(df)
+        assert parallel_profiling._executor not in (None, broken)
+        for col in df.columns:
+            _assert_profiles_equal(actual["column_profiles"][col], expected["column_profiles"][col])
+
+        monkeypatch.setattr(parallel_profiling, "_get_executor", broken_executor)
+        actual = profile_dataframe(df)
+        for col in df.columns:
+            _assert_profiles_equal(actual["column_profiles"][col], expected["column_profiles"][col])
+    finally:
+        parallel_profiling.shutdown_executor()
+
+
+def test_csv_ingest_schema_and_fallback(tmp_path, monkeypatch):
+    """スキーマの推定・再利用と、サンプル外の行が合わない場合の読み直しを確認"""
+    monkeypatch.setattr(settings, "INGEST_SCHEMA_SAMPLE_ROWS", 100)
+    df = _make_frame().drop(columns=["nullable_int"])
+    df["id"] = [f"id-{i}" for i in range(len(df))]
+    # サンプル外の最終行で初めて欠損が現れる整数カラム
+    df["small_int"] = [str(i) for i in range(len(df) - 1)] + [""]
+    csv_path = str(tmp_path / "data.csv")
+    df.to_csv(csv_path, index=False)
+
+    schema = csv_ingest.infer_schema(csv_path)
+    dtypes = {column["name"]: column["dtype"] for column in schema["columns"]}
+    assert dtypes["category"] == "category"
+    assert dtypes["id"] == "str"
+    assert dtypes["small_int"] == "int64"
+
+    schema_path = str(tmp_path / "data.schema.json")
+    csv_ingest.save_schema(schema_path, schema)
+    assert csv_ingest.load_schema(schema_path) == schema
+
+    expected = pd.read_csv(csv_path)
+    actual = csv_ingest.read_csv(csv_path, schema)
+    assert actual["small_int"].isnull().sum() == 1
+    pd.testing.assert_frame_equal(actual, expected)
+
+    selected = csv_ingest.read_csv(csv_path, schema, usecols=["category", "age"])
+    assert list(selected.columns) == ["age", "category"]
+    assert isinstance(selected["category"].dtype, pd.CategoricalDtype)
+    plain = csv_ingest.read_csv(csv_path, schema, categories=False)
+    assert plain["category"].dtype == expected["category"].dtype
+
+    chunks = list(csv_ingest.iter_csv_chunks(csv_path, 128, schema))
+    assert sum(len(chunk) for chunk in chunks) == len(df)
+    pd.testing.assert_series_equal(
+        pd.concat(chunks, ignore_index=True)["income"], expected["income"]
+    )
+    assert [str(chunk["small_int"].dtype) for chunk in chunks] == ["int64", "int64", "int64", "float64"]
+
+    # 引用符内の改行を含む行があっても、スキーマと合わないチャンクの行がずれない
+    quoted = pd.DataFrame({
+        "note": [f"line {i}\nnext" if i % 7 == 0 else f"n{i}" for i in range(300)],
+        "value": [str(i) for i in range(250)] + ["x"] * 50,
+    })
+    quoted_path = str(tmp_path / "quoted.csv")
+    quoted.to_csv(quoted_path, index=False)
+    quoted_schema = csv_ingest.infer_schema(quoted_path)
+    chunks = list(csv_ingest.iter_csv_chunks(quoted_path, 64, quoted_schema))
+    assert chunks[0]["value"].dtype == np.int64
+    combined = pd.concat(chunks, ignore_index=True)
+    assert combined["note"].tolist() == quoted["note"].tolist()
+    assert combined["value"].astype(str).tolist() == quoted["value"].tolist()
+
+
+def test_csv_ingest_with_pyarrow_engine(tmp_path, monkeypatch):
+    """pyarrow エンジンでの一括読み込みが既定のエンジンと同じ結果になることを確認"""
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(settings, "INGEST_USE_PYARROW", True)
+    monkeypatch.setattr(csv_ingest, "PYARROW_AVAILABLE", True)
+    monkeypatch.setattr(settings, "INGEST_SCHEMA_SAMPLE_ROWS", 100)
+    df = _make_frame().drop(columns=["nullable_int"])
+    csv_path = str(tmp_path / "data.csv")
+    df.to_csv(csv_path, index=False)
+    schema = csv_ingest.infer_schema(csv_path)
+
+    selected = csv_ingest.read_csv(csv_path, schema, usecols=["age", "category"])
+    assert isinstance(selected["category"].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(
+        selected.astype({"category": object}),
+        pd.read_csv(csv_path, usecols=["age", "category"]).astype({"category": object}),
+    )
+
+    # サンプル外の行で欠損が現れる整数カラムは型推論で読み直す
+    df["late_missing"] = [str(i) for i in range(len(df) - 1)] + [""]
+    df.to_csv(csv_path, index=False)
+    actual = csv_ingest.read_csv(csv_path, csv_ingest.infer_schema(csv_path), categories=False)
+    assert actual["late_missing"].isnull().sum() == 1
+    assert len(actual) == len(df)
+
+
+def test_upload_endpoint_and_profile_by_dataset_id(tmp_path, monkeypatch):
+    """アップロードしたCSVを dataset_id でプロファイリングでき、解析できないCSVは何も残さないことを確認"""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse
+    from fastapi.testclient import TestClient
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from app.db.base import Base
+    from app.db.session import get_db
+    from app.dependencies.auth import get_current_user
+    from app.exceptions import ValidationException
+    from app.models import dataset, execution, plan, user  # noqa: F401
+    from app.models.user import User
+    from app.routers import datasets, profiling
+
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    monkeypatch.setattr(settings, "UPLOAD_CHUNK_SIZE", 64)
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add(User(id="owner", email="owner@example.com", password_hash="x"))
+        db.commit()
+
+    def override_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(datasets.router, prefix="/api/v1")
+    app.include_router(profiling.router, prefix="/api/v1")
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_current_user] = lambda: User(id="owner", email="owner@example.com")
+
+    @app.exception_handler(ValidationException)
+    async def validation_handler(request: Request, exc: ValidationException):
+        return JSONResponse(status_code=400, content={"data": None, "message": str(exc)})
+
+    df = _make_frame()
+    csv = df.to_csv(index=False).encode()
+    client = TestClient(app)
+    response = client.post(
+        "/api/v1/datasets/upload",
+        files={"file": ("people.csv", csv, "text/csv")},
+        data={"description": "テスト"},
+    )
+    assert response.status_code == 201, response.text
+    uploaded = response.json()["data"]
+    assert uploaded["name"] == "people.csv" and uploaded["description"] == "テスト"
+    assert (uploaded["rows"], uploaded["columns"]) == df.shape
+    with open(tmp_path / "data" / "datasets" / f"{uploaded['dataset_id']}.csv", "rb") as f:
+        assert f.read() == csv
+
+    response = client.post("/api/v1/profiling/analyze", json={"dataset_id": uploaded["dataset_id"]})
+    assert response.status_code == 200, response.text
+    profile = response.json()["data"]
+    expected = profile_csv_data(csv.decode())
+    assert profile["rows"] == expected["rows"] and profile["missing_values"] == expected["missing_values"]
+
+    before = sorted(os.listdir(tmp_path / "data" / "datasets"))
+    response = client.post("/api/v1/datasets/upload", files={"file": ("broken.csv", b'a,b\n1,"2\n3,4\n', "text/csv")})
+    assert response.status_code == 400
+    assert sorted(os.listdir(tmp_path / "data" / "datasets")) == before
+    response = client.post("/api/v1/datasets/upload", files={"file": ("empty.csv", b"", "text/csv")})
+    assert response.status_code == 400
+    assert sorted(os.listdir(tmp_path / "data" / "datasets")) == before
+
+
+def test_concurrent_appends_and_schema_upgrade(tmp_path, monkeypatch):
+    """同じデータセットへの同時の追記が失われず、既存のテーブルに不足しているカラムが追加されることを確認"""
+    from sqlalchemy import create_engine, inspect, text
+    from sqlalchemy.orm import sessionmaker
+
+    from app.db.base import Base
+    from app.db.migrations import add_missing_columns
+    from app.models import dataset, execution, plan, user  # noqa: F401
+    from app.models.user import User
+    from app.services.dataset_service import append_dataset_rows, dataset_file_path, upload_dataset
+    from app.services.upload_receiver import ReceivedFile
+
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    df = _make_frame().drop(columns=["nullable_int"])
+    path = dataset_file_path("appended")
+    os.makedirs(os.path.dirname(path))
+    df.to_csv(path, index=False)
+    with Session() as db:
+        db.add(User(id="owner", email="owner@example.com", password_hash="x"))
+        db.commit()
+        upload_dataset(db, "owner", "appended", ReceivedFile("data.csv", "hash", os.path.getsize(path), {}))
+
+    errors = []
+
+    def append(i):
+        try:
+            with Session() as db:
+                csv = df.iloc[i * 50:(i + 1) * 50].to_csv(index=False).encode()
+                append_dataset_rows(db, "appended", "owner", io.BytesIO(csv))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=append, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    expected_rows = len(df) + 200
+    assert len(pd.read_csv(path)) == expected_rows
+    with Session() as db:
+        saved = db.get(dataset.Dataset, "appended")
+        assert saved.rows == expected_rows
+        assert columnar_store.read_schema(saved.store_path)["rows"] == expected_rows
+    assert not [name for name in os.listdir(os.path.dirname(path)) if name.endswith((".append", ".tmp"))]
+
+    # カラムを追加する前の datasets テーブルに content_hash・store_path を追加する
+    old_engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with old_engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE datasets (id VARCHAR PRIMARY KEY, user_id VARCHAR NOT NULL, name VARCHAR(255) NOT NULL, "
+            "description TEXT, file_path VARCHAR(500), rows INTEGER, columns INTEGER, "
+            "created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL)"
+        ))
+    assert add_missing_columns(old_engine) == ["datasets.content_hash", "datasets.store_path"]
+    assert {"content_hash", "store_path"} <= {c["name"] for c in inspect(old_engine).get_columns("datasets")}
+    assert add_missing_columns(old_engine) == []
+
+
+def test_append_in_place_and_readers_stop_at_committed_bytes(tmp_path, monkeypatch):
+    """追記がCSVをコピーせずにその場で書き足され、読み込みが確定済みのバイト数で打ち切られることを確認"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from app.db.base import Base
+    from app.exceptions import ValidationException
+    from app.models import dataset, execution, plan, user  # noqa: F401
+    from app.models.user import User
+    from app.services.dataset_service import (
+        append_dataset_rows, dataset_file_path, get_dataset_schema, load_dataset_frame, upload_dataset,
+    )
+    from app.services.upload_receiver import ReceivedFile
+
+    monkeypatch.setattr(settings, "DATA_DIR", str(tmp_path / "data"))
+    monkeypatch.setattr(settings, "COLUMNAR_STORE_ENABLED", False)
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    df = pd.DataFrame({"id": range(10), "name": [f"n{i}" for i in range(10)]})
+    path = dataset_file_path("inplace")
+    os.makedirs(os.path.dirname(path))
+    df.to_csv(path, index=False)
+    with sessionmaker(bind=engine)() as db:
+        db.add(User(id="owner", email="owner@example.com", password_hash="x"))
+        db.commit()
+        saved = upload_dataset(db, "owner", "inplace", ReceivedFile("data.csv", "hash", os.path.getsize(path), {}))
+        inode = os.stat(path).st_ino
+
+        # 書き込み途中の追記（確定前の行）は読み込まれない
+        with open(path, "ab") as f:
+            f.write(b"10,n10\n11,n")
+        assert get_dataset_schema(saved)["committed_bytes"] < os.path.getsize(path)
+        pd.testing.assert_frame_equal(load_dataset_frame(saved), df, check_dtype=False)
+        chunks = list(csv_ingest.iter_csv_chunks(path, 4, get_dataset_schema(saved)))
+        assert sum(len(chunk) for chunk in chunks) == len(df)
+
+        # 次の追記は確定前の残りを切り詰めてから書き足す
+        delta = pd.DataFrame({"id": [10, 11], "name": ["a", "b"]})
+        append_dataset_rows(db, "inplace", "owner", io.BytesIO(delta.to_csv(index=False).encode()))
+        assert os.stat(path).st_ino == inode
+        assert get_dataset_schema(saved)["committed_bytes"] == os.path.getsize(path)
+        expected = pd.concat([df, delta], ignore_index=True)
+        pd.testing.assert_frame_equal(load_dataset_frame(saved), expected, check_dtype=False)
+        pd.testing.assert_frame_equal(pd.read_csv(path), expected)
+
+        # 失敗した追記は確定済みの内容を変えない
+        with pytest.raises(ValidationException):
+            append_dataset_rows(db, "inplace", "owner", io.BytesIO(b"other\n1\n"))
+        assert os.path.getsize(path) == get_dataset_schema(saved)["committed_bytes"]
@@ -0,0 +1,86 @@
+"""ステップの依存関係の解析と同時実行のテスト"""
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.services import step_executor
+from app.services.step_dependencies import StepColumns, analyze_columns, schedule
+
+SCALE = (
+    "from sklearn.preprocessing import StandardScaler\n"
+    "numeric_cols = ['a', 'b']\n"
+    "scaler = StandardScaler()\n"
+    "df[numeric_cols] = scaler.fit_transform(df[numeric_cols])"
+)
+ENCODE = (
+    "from sklearn.preprocessing import LabelEncoder\n"
+    "categorical_cols = ['c']\n"
+    "for col in categorical_cols:\n"
+    "    le = LabelEncoder()\n"
+    "    df[col] = le.fit_transform(df[col].astype(str))"
+)
+IMPUTE = "df['d'] = df['d'].fillna(df['d'].median())"
+
+
+def test_independent_steps_are_grouped():
+    """カラムが重ならない連続したステップだけが同じグループになることを確認"""
+    assert analyze_columns(SCALE) == StepColumns(frozenset({"a", "b"}), frozenset({"a", "b"}))
+    assert analyze_columns(ENCODE) == StepColumns(frozenset({"c"}), frozenset({"c"}))
+    # df 全体の参照・再代入、行の絞り込み、ループ内で値が変わる変数は解析しない
+    for code in (
+        "df = df.dropna()",
+        "print(df.info())",
+        "df['e'] = df[df['a'] > 0]['a']",
+        "c = 'x'\nfor i in range(2):\n    df[c] = 1\n    c = 'y'",
+        "import numpy as np\ndf['z'] = np.random.rand(3)",
+    ):
+        assert analyze_columns(code) is None, code
+
+    codes = ["df = df.dropna()", SCALE, ENCODE, IMPUTE, "df['e'] = df['a'] * 2", "df['f'] = df['c'] + 1"]
+    columns = [analyze_columns(code) for code in codes]
+    assert schedule(columns, 4) == [[0], [1, 2, 3], [4, 5]]
+    assert schedule(columns, 2) == [[0], [1, 2], [3, 4], [5]]
+    assert schedule(columns, 1) == [[0], [1], [2], [3], [4], [5]]
+
+
+def test_step_group_matches_sequential_execution(monkeypatch):
+    """同時に実行した結果が順に実行した結果と一致し、失敗したステップで打ち切られることを確認"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "a": rng.normal(size=500),
+        "b": rng.normal(size=500),
+        "c": rng.choice(["x", "y", "z"], size=500),
+        "d": np.where(rng.random(500) < 0.2, np.nan, rng.normal(size=500)),
+    })
+    codes = [SCALE, ENCODE, IMPUTE, "df['e'] = df['d'] * 2"]
+    columns = [analyze_columns(code) for code in codes[:3]]
+
+    sequential = step_executor.InProcessStepExecutor()
+    sequential.load(df.copy())
+    for code in codes[:3]:
+        assert sequential.run_step(code)[0] == "success"
+
+    monkeypatch.setattr(settings, "EXECUTION_STEP_EXECUTOR", "sandbox")
+    monkeypatch.setattr(settings, "EXECUTION_SANDBOX_WORKERS", 1)
+    step_executor.shutdown_pool()
+    try:
+        with step_executor.open_executor() as executor:
+            executor.load(df.copy())
+            results = executor.run_steps(codes[:3], columns)
+            assert [r[0] for r in results] == ["success"] * 3
+            assert results[1][2]["columns_before"] == 4 and results[1][2]["cpu_time"] >= 0
+            pd.testing.assert_frame_equal(executor.call(pd.DataFrame.copy), sequential.df)
+
+            # 2番目のステップが失敗した場合、3番目のステップの結果はマージされない
+            failing = [
+                "df['g'] = df['a'] + 1",
+                "df['h'] = df['missing'] * 2",
+                "df['i'] = df['b'] + 1",
+            ]
+            results = executor.run_steps(failing, [analyze_columns(code) for code in failing])
+            assert [r[0] for r in results] == ["success", "failed"]
+            assert "missing" in results[1][1]
+            after = executor.call(pd.DataFrame.copy)
+            assert "g" in after.columns and "i" not in after.columns
+    finally:
+        step_executor.shutdown_pool()
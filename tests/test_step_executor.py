@@ -0,0 +1,121 @@
+"""ステップ実行バックエンドのテスト"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.core.code_cache import CodeCache
+from app.core.config import settings
+from app.services import step_executor
+from app.services.execution_service import generate_data_summary
+
+
+def test_sandbox_limits_are_reported_as_failed_steps(monkeypatch):
+    """CPU時間・実行時間・メモリの上限超過が失敗として返り、ワーカーが置き換えられることを確認"""
+    monkeypatch.setattr(settings, "EXECUTION_STEP_EXECUTOR", "sandbox")
+    monkeypatch.setattr(settings, "EXECUTION_SANDBOX_WORKERS", 1)
+    monkeypatch.setattr(settings, "EXECUTION_STEP_CPU_TIME", 1)
+    monkeypatch.setattr(settings, "EXECUTION_STEP_TIMEOUT", 10.0)
+    monkeypatch.setattr(settings, "EXECUTION_STEP_MEMORY_LIMIT", 2 * 1024 ** 3)
+    df = pd.DataFrame({"x": np.arange(1000, dtype=np.float64), "label": ["a", "b"] * 500})
+    step_executor.shutdown_pool()
+    try:
+        with step_executor.open_executor() as executor:
+            executor.load(df)
+            status, message, metrics = executor.run_step("df['y'] = df['x'] * 2")
+            assert (status, message) == ("success", None)
+            assert (metrics["rows_before"], metrics["rows_after"]) == (1000, 1000)
+            assert (metrics["columns_before"], metrics["columns_after"]) == (2, 3)
+            assert metrics["memory_after_bytes"] - metrics["memory_before_bytes"] == 8000
+            status, message, metrics = executor.run_step("blob = b'x' * (200 * 1024 ** 2)")
+            assert status == "success" and metrics["peak_memory_bytes"] >= 150 * 1024 ** 2
+            status, message, metrics = executor.run_step("try:\n    while True: pass\nexcept Exception: pass")
+            assert status == "failed" and "CPU時間" in message
+            assert metrics["cpu_time"] >= 0.9 and metrics["rows_after"] is None
+            status, message, _ = executor.run_step("blob = bytearray(4 * 1024 ** 3)")
+            assert status == "failed" and "メモリ" in message
+            summary = executor.call(generate_data_summary)
+            assert summary["columns"] == 3 and summary["rows"] == 1000
+
+        monkeypatch.setattr(settings, "EXECUTION_STEP_TIMEOUT", 1.0)
+        monkeypatch.setattr(settings, "EXECUTION_STEP_CPU_TIME", 0)
+        with step_executor.open_executor() as executor:
+            executor.load(df)
+            status, message, metrics = executor.run_step("import time\ntime.sleep(30)")
+            assert status == "failed" and "実行時間" in message and metrics == {}
+            assert not executor.alive
+
+        # 強制終了したワーカーは新しいプロセスに置き換えられている
+        with step_executor.open_executor() as executor:
+            executor.load(df)
+            status, _, metrics = executor.run_step("df = df.head(5)")
+            assert status == "success" and metrics["rows_after"] == 5
+            assert executor.call(generate_data_summary)["rows"] == 5
+    finally:
+        step_executor.shutdown_pool()
+
+
+def test_code_cache_reuses_compiled_steps_and_rejects_syntax_errors():
+    """同じコードはコンパイル済みのコードを再利用し、構文エラーは SyntaxError になることを確認"""
+    cache = CodeCache(max_entries=2)
+    first = cache.compile("df = df.dropna()")
+    assert cache.compile("df = df.dropna()") is first
+    cache.compile("df = df.head(1)")
+    cache.compile("df = df.tail(1)")
+    assert cache.compile("df = df.dropna()") is not first
+    assert cache.stats() == {"hits": 1, "misses": 4, "evictions": 2, "entries": 2, "max_entries": 2}
+
+    with pytest.raises(SyntaxError):
+        cache.compile("df = df.dropna(")
+
+
+def _sleep(df, seconds):
+    time.sleep(seconds)
+
+
+def _worker_pid(df):
+    return os.getpid()
+
+
+def _buffer_owner(df):
+    """df['x'] の配列が参照しているバッファの型名"""
+    base = np.asarray(df["x"])
+    while isinstance(base, np.ndarray) and base.base is not None:
+        base = base.base
+    return type(base.obj if isinstance(base, memoryview) else base).__name__
+
+
+def test_sandbox_worker_is_replaced_after_incomplete_request(monkeypatch):
+    """共有メモリをコピーせずにDataFrameを復元し、応答がなかったワーカーは reset せずに置き換えることを確認"""
+    monkeypatch.setattr(settings, "EXECUTION_STEP_EXECUTOR", "sandbox")
+    monkeypatch.setattr(settings, "EXECUTION_SANDBOX_WORKERS", 1)
+    monkeypatch.setattr(settings, "EXECUTION_STEP_TIMEOUT", 1.0)
+    df = pd.DataFrame({"x": np.arange(1000, dtype=np.float64), "label": ["a", "b"] * 500})
+    step_executor.shutdown_pool()
+    try:
+        with step_executor.open_executor() as executor:
+            executor.load(df)
+            assert executor.call(_buffer_owner) == "mmap"
+            pid = executor.call(_worker_pid)
+            with pytest.raises(TimeoutError):
+                executor.call(_sleep, 30)
+            assert not executor.alive
+            with pytest.raises(EOFError):
+                executor.call(_worker_pid)
+
+        with step_executor.open_executor() as executor:
+            executor.load(df)
+            assert executor.call(_worker_pid) != pid
+            # 失敗したステップは df を更新しない
+            status, message, _ = executor.run_step("df = df['x']")
+            assert status == "failed" and "DataFrame" in message
+            assert executor.call(generate_data_summary)["columns"] == 2
+            pid = executor.call(_worker_pid)
+
+        # 応答を受け取ったワーカーは reset してそのまま使い回す
+        with step_executor.open_executor() as executor:
+            assert executor.call(_worker_pid) == pid
+    finally:
+        step_executor.shutdown_pool()
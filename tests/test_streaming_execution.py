@@ -0,0 +1,88 @@
+"""チャンク実行のテスト"""
+import numpy as np
+import pandas as pd
+
+from app.services import csv_ingest, streaming_execution
+from app.services.step_executor import exec_step
+
+PLAN = [
+    "# カテゴリが欠損した行を削除\ndf = df.dropna(subset=['category'])",
+    "df['age'] = df['age'].fillna(0).astype(int)",
+    "# 数値列の標準化\nfrom sklearn.preprocessing import StandardScaler\nnumeric_cols = ['income', 'score']\n"
+    "scaler = StandardScaler()\ndf[numeric_cols] = scaler.fit_transform(df[numeric_cols])",
+    "# カテゴリ変数のラベルエンコーディング\nfrom sklearn.preprocessing import LabelEncoder\ncategorical_cols = ['category', 'city']\n"
+    "for col in categorical_cols:\n    le = LabelEncoder()\n    df[col] = le.fit_transform(df[col].astype(str))",
+    "df = df[df['age'] > 20].rename(columns={'score': 'score_scaled'})",
+]
+
+
+def test_chunked_execution_matches_in_memory_execution(tmp_path):
+    """行ごとに完結するステップとテンプレートのステップを、チャンク実行しても結果が一致することを確認"""
+    rng = np.random.default_rng(0)
+    n = 1000
+    df = pd.DataFrame({
+        "age": rng.integers(18, 80, n).astype(float),
+        "income": rng.normal(50000, 15000, n),
+        "category": rng.choice(["A", "B", "C"], n).astype(object),
+        "city": rng.choice(["tokyo", "osaka", "nagoya", "fukuoka"], n).astype(object),
+        "score": rng.uniform(0, 100, n),
+    })
+    df.loc[rng.random(n) < 0.1, "age"] = np.nan
+    df.loc[rng.random(n) < 0.05, "category"] = None
+    df.loc[rng.random(n) < 0.05, "city"] = None
+    df.loc[rng.random(n) < 0.1, "income"] = np.nan
+    input_path = tmp_path / "input.csv"
+    df.to_csv(input_path, index=False)
+
+    steps, unsupported = streaming_execution.analyze_plan(PLAN)
+    assert unsupported == []
+    assert [step.needs_fit for step in steps] == [False, False, True, True, False]
+
+    schema = csv_ingest.infer_schema(str(input_path))
+    output_path = tmp_path / "output.csv"
+    result = streaming_execution.run_chunked(
+        lambda: csv_ingest.iter_csv_chunks(str(input_path), 97, schema), steps, str(output_path)
+    )
+    assert result["failed_step"] is None
+
+    expected = csv_ingest.read_csv(str(input_path), categories=False)
+    for code in PLAN:
+        expected = exec_step(code, expected)
+    actual = pd.read_csv(output_path)
+    assert list(actual.columns) == list(expected.columns)
+    assert len(actual) == len(expected) == result["after_summary"]["rows"]
+    for col in expected.columns:
+        np.testing.assert_allclose(actual[col].to_numpy(dtype=float), expected[col].to_numpy(dtype=float), rtol=1e-9)
+    assert result["before_summary"]["rows"] == n
+    assert result["before_summary"]["column_info"]["category"]["missing"] == int(df["category"].isna().sum())
+
+
+def test_unsupported_steps_are_reported():
+    """全体に依存するステップや任意のコードはチャンク実行の対象外になることを確認"""
+    codes = [
+        "df = df.fillna(0)",
+        "df = df.fillna(df.mean())",
+        "df = df.head(5)",
+        "df = df.dropna(axis=1)",
+        "print(df.info())",
+        "df = df.drop(columns=['a'])",
+        "import os\nos.remove('x')",
+        "df['a'] = pd.to_numeric(df['a'], errors='coerce')",
+    ]
+    steps, unsupported = streaming_execution.analyze_plan(codes)
+    assert steps is None
+    assert unsupported == [1, 2, 3, 4, 6]
+
+
+def test_failed_step_stops_chunked_execution(tmp_path):
+    """チャンク実行中に失敗したステップの位置とエラーが返り、出力ファイルは作られないことを確認"""
+    input_path = tmp_path / "input.csv"
+    pd.DataFrame({"a": [1, 2, 3]}).to_csv(input_path, index=False)
+    steps, _ = streaming_execution.analyze_plan(["df = df.fillna(0)", "df['b'] = df['missing'].astype(int)"])
+    output_path = tmp_path / "output.csv"
+    result = streaming_execution.run_chunked(
+        lambda: csv_ingest.iter_csv_chunks(str(input_path), 2), steps, str(output_path)
+    )
+    assert result["failed_step"] == 1 and "missing" in result["error_message"]
+    assert result["after_summary"] is None
+    assert not output_path.exists() and not (tmp_path / "output.csv.part").exists()